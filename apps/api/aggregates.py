@@ -0,0 +1,121 @@
+"""Dashboard counters maintained in the transactions that change the rows.
+
+``stat_counts`` holds one integer per (metric, scope, bucket), e.g.
+``("samples.status", "", "Plated")`` or ``("runs.qc", "RUN-0001", "Fail")``.
+Writers add deltas next to their own inserts and updates, so the counters
+commit or roll back with the rows they describe and the dashboard reads a
+few dozen counter rows instead of scanning samples, aliquots and metrics:
+
+    aggregates.bump(db, aggregates.RUN_QC, {"Pass": 90, "Fail": 6}, scope=run_id)
+
+Deltas are applied by ``database.upsert`` as ``INSERT ... ON CONFLICT DO
+UPDATE SET value = value + excluded.value``. ``replace`` rewrites the
+whole table from counts recomputed off the base tables (see
+``app.rebuild_stats``) for new databases or after manual data fixes.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, insert, select
+from sqlalchemy.engine import Engine
+
+from database import upsert
+
+SAMPLE_STATUS = "samples.status"
+RUN_STATUS = "runs.status"
+PLATE_STATUS = "plates.status"  # Active until every well's BeadChip is on a Completed run, then Done
+PRS_STATUS = "prs_jobs.status"
+RUN_QC = "runs.qc"  # genotype metrics per qc_flag, scope = run_id
+EXTRACTION_QC = "extractions.qc"  # aliquots per current qc_flag, scope = extraction batch id
+ALIQUOT_QC = "aliquots.qc"  # all aliquots per current qc_flag, "Pending" until their first DNA QC
+TURNAROUND = "samples.turnaround"  # created_at -> first Genotyped (from Plated or Hold for QA), bucket = histogram label
+TURNAROUND_SECONDS = "samples.turnaround_seconds"  # bucket "sum", for the mean
+
+# Upper bucket edges in days; the last bucket is open-ended
+TURNAROUND_EDGES_DAYS = [1, 2, 3, 5, 7, 14, 28]
+TURNAROUND_BUCKETS = (
+    [f"{lo}-{hi}d" for lo, hi in zip([0] + TURNAROUND_EDGES_DAYS, TURNAROUND_EDGES_DAYS)]
+    + [f"{TURNAROUND_EDGES_DAYS[-1]}d+"]
+)
+
+metadata = MetaData()
+
+stat_counts = Table(
+    "stat_counts",
+    metadata,
+    Column("metric", String, primary_key=True),
+    Column("scope", String, primary_key=True),  # "" for lab-wide counters
+    Column("bucket", String, primary_key=True),
+    Column("value", Integer, nullable=False),
+)
+
+Deltas = Mapping[Tuple[str, str], int]
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def bump(conn, metric: str, deltas: Mapping[str, int], scope: str = ""):
+    """Add ``{bucket: delta}`` to one scope of ``metric``."""
+    bump_scoped(conn, metric, {(scope, bucket): n for bucket, n in deltas.items()})
+
+
+def bump_scoped(conn, metric: str, deltas: Deltas):
+    """Add ``{(scope, bucket): delta}`` to ``metric``; zero deltas are skipped."""
+    rows = [{"metric": metric, "scope": scope or "", "bucket": str(bucket), "value": int(n)}
+            for (scope, bucket), n in deltas.items() if n]
+    upsert(conn, stat_counts, ("metric", "scope", "bucket"), rows,
+           set_=lambda new: {"value": stat_counts.c.value + new.value})
+
+
+def move(conn, metric: str, moves: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+    """Apply ``(scope, old_bucket, new_bucket)`` moves; a None bucket means "not counted"."""
+    deltas: Counter = Counter()
+    for scope, old, new in moves:
+        if old == new:
+            continue
+        if old is not None:
+            deltas[(scope, old)] -= 1
+        if new is not None:
+            deltas[(scope, new)] += 1
+    bump_scoped(conn, metric, deltas)
+
+
+def turnaround_deltas(seconds: Iterable[float]) -> Tuple[Dict[str, int], int]:
+    """Histogram counts and total seconds for a batch of turnaround times."""
+    seconds = np.asarray(list(seconds), dtype=float)
+    if not len(seconds):
+        return {}, 0
+    buckets = np.searchsorted(np.asarray(TURNAROUND_EDGES_DAYS) * 86400.0, seconds, side="right")
+    values, counts = np.unique(buckets, return_counts=True)
+    return {TURNAROUND_BUCKETS[v]: int(c) for v, c in zip(values, counts)}, int(seconds.sum())
+
+
+def record_turnaround(conn, seconds: Iterable[float]):
+    histogram, total = turnaround_deltas(seconds)
+    if histogram:
+        bump(conn, TURNAROUND, histogram)
+        bump(conn, TURNAROUND_SECONDS, {"sum": total})
+
+
+def read(conn, metric: str, scopes: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+    """``{scope: {bucket: value}}`` for one metric, optionally for some scopes only."""
+    query = select(stat_counts.c.scope, stat_counts.c.bucket, stat_counts.c.value).where(stat_counts.c.metric == metric)
+    if scopes is not None:
+        query = query.where(stat_counts.c.scope.in_(scopes))
+    out: Dict[str, Dict[str, int]] = {}
+    for scope, bucket, value in conn.execute(query):
+        if value:
+            out.setdefault(scope, {})[bucket] = value
+    return out
+
+
+def replace(conn, counts: Mapping[str, Deltas]):
+    """Overwrite every counter with ``{metric: {(scope, bucket): value}}``."""
+    conn.execute(delete(stat_counts))
+    rows = [{"metric": metric, "scope": scope or "", "bucket": str(bucket), "value": int(n)}
+            for metric, values in counts.items() for (scope, bucket), n in values.items() if n]
+    if rows:
+        conn.execute(insert(stat_counts), rows)
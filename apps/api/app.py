@@ -1,21 +1,58 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, File, Header, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, ForeignKey, Text, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import delete, exists, or_, func, insert, inspect, select, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased, sessionmaker, Session
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Literal, Optional, Dict, Any
+from collections import Counter
+from contextlib import asynccontextmanager
 from datetime import datetime
+import csv
 import json
 import os
 from pathlib import Path
 
+import anyio
+import numpy as np
+
+import aggregates
+import events
+import idempotency
+import instrumentation
+import job_queue
+import plate_layout
+import prs_jobs
+import query_stats
+import response_cache
+import run_analytics
+import sample_status
+import samplesheet
+import search_index
+from database import is_sqlite, make_async_engine, make_engine
+from id_allocator import IdAllocator
+from metrics_import import MetricsFileError, chunked, iter_metrics, open_text
+from models import (
+    Base, KitModel, SampleModel, ConsentModel, ExtractionBatchModel,
+    AliquotModel, DNAQCModel, PlateModel, PlateWellModel,
+    RunModel, BeadChipModel, GenotypeMetricsModel, PRSJobModel
+)
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate_async, split_values
+from prs_package import stream_tar
+from qc_rules import CompiledProfile, Profile, ProfileIn, ProfileStore, Thresholds
+from write_queue import WriteQueue
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lims.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Async engine for read-heavy endpoints (aiosqlite / asyncpg), same pool settings
+async_engine = make_async_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 # QC Thresholds (environment-overridable)
 DNA_MIN_CONC = float(os.getenv("DNA_MIN_CONC", "20"))
@@ -25,135 +62,135 @@ A260_230_MIN = float(os.getenv("A260_230_MIN", "1.8"))
 CALLRATE_MIN = float(os.getenv("CALLRATE_MIN", "0.98"))
 DISHQC_MIN = float(os.getenv("DISHQC_MIN", "0.82"))
 
-# SQLAlchemy Models
-class KitModel(Base):
-    __tablename__ = "kits"
-    id = Column(String, primary_key=True)
-    qr_code = Column(String, unique=True, nullable=False)
-    clinic_id = Column(String, nullable=True)
-    status = Column(String, default="Allocated")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    samples = relationship("SampleModel", back_populates="kit")
-
-class SampleModel(Base):
-    __tablename__ = "samples"
-    id = Column(String, primary_key=True)
-    kit_qr = Column(String, ForeignKey("kits.qr_code"))
-    sample_type = Column(String)
-    subject_pseudoid = Column(String)
-    collection_datetime = Column(DateTime)
-    status = Column(String, default="Received")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    kit = relationship("KitModel", back_populates="samples")
-    consent = relationship("ConsentModel", back_populates="sample", uselist=False)
-    aliquots = relationship("AliquotModel", back_populates="sample")
-
-class ConsentModel(Base):
-    __tablename__ = "consents"
-    id = Column(String, primary_key=True)
-    sample_id = Column(String, ForeignKey("samples.id"))
-    consent_type = Column(String)
-    consent_date = Column(DateTime)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    sample = relationship("SampleModel", back_populates="consent")
-
-class ExtractionBatchModel(Base):
-    __tablename__ = "extraction_batches"
-    id = Column(String, primary_key=True)
-    batch_date = Column(DateTime, default=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    aliquots = relationship("AliquotModel", back_populates="extraction_batch")
-
-class AliquotModel(Base):
-    __tablename__ = "aliquots"
-    id = Column(String, primary_key=True)
-    sample_id = Column(String, ForeignKey("samples.id"))
-    extraction_batch_id = Column(String, ForeignKey("extraction_batches.id"))
-    label = Column(String)
-    qc_flag = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    sample = relationship("SampleModel", back_populates="aliquots")
-    extraction_batch = relationship("ExtractionBatchModel", back_populates="aliquots")
-    dna_qc = relationship("DNAQCModel", back_populates="aliquot", uselist=False)
-    plate_wells = relationship("PlateWellModel", back_populates="aliquot")
-
-class DNAQCModel(Base):
-    __tablename__ = "dna_qc"
-    id = Column(String, primary_key=True)
-    aliquot_id = Column(String, ForeignKey("aliquots.id"))
-    concentration = Column(Float)
-    a260_280 = Column(Float)
-    a260_230 = Column(Float)
-    qc_flag = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    aliquot = relationship("AliquotModel", back_populates="dna_qc")
-
-class PlateModel(Base):
-    __tablename__ = "plates"
-    id = Column(String, primary_key=True)
-    name = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    wells = relationship("PlateWellModel", back_populates="plate")
-
-class PlateWellModel(Base):
-    __tablename__ = "plate_wells"
-    id = Column(String, primary_key=True)
-    plate_id = Column(String, ForeignKey("plates.id"))
-    aliquot_id = Column(String, ForeignKey("aliquots.id"))
-    well = Column(String)
-    sentrix_barcode = Column(String)
-    sentrix_position = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    plate = relationship("PlateModel", back_populates="wells")
-    aliquot = relationship("AliquotModel", back_populates="plate_wells")
-
-class RunModel(Base):
-    __tablename__ = "runs"
-    id = Column(String, primary_key=True)
-    run_name = Column(String)
-    run_date = Column(DateTime)
-    status = Column(String, default="Created")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    beadchips = relationship("BeadChipModel", back_populates="run")
-    metrics = relationship("GenotypeMetricsModel", back_populates="run")
-    prs_jobs = relationship("PRSJobModel", back_populates="run")
-
-class BeadChipModel(Base):
-    __tablename__ = "beadchips"
-    id = Column(String, primary_key=True)
-    run_id = Column(String, ForeignKey("runs.id"))
-    barcode = Column(String, unique=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    run = relationship("RunModel", back_populates="beadchips")
-
-class GenotypeMetricsModel(Base):
-    __tablename__ = "genotype_metrics"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    run_id = Column(String, ForeignKey("runs.id"))
-    sample_id = Column(String, ForeignKey("samples.id"))
-    call_rate = Column(Float)
-    dish_qc = Column(Float)
-    heterozygosity = Column(Float, nullable=True)
-    sex_call = Column(String, nullable=True)
-    sex_concordance = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    run = relationship("RunModel", back_populates="metrics")
-
-class PRSJobModel(Base):
-    __tablename__ = "prs_jobs"
-    id = Column(String, primary_key=True)
-    run_id = Column(String, ForeignKey("runs.id"))
-    job_name = Column(String)
-    status = Column(String, default="Created")
-    output_path = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    run = relationship("RunModel", back_populates="prs_jobs")
-
-# Create tables
+# Bulk accessioning
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "10000"))
+
+# Metrics file import
+METRICS_CHUNK_ROWS = int(os.getenv("METRICS_CHUNK_ROWS", "5000"))
+MAX_REPORTED_ERRORS = 100
+
+def add_missing_columns():
+    """Add nullable columns introduced after a table was created"""
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                    added.append((table.name, column.name))
+    return added
+
+def deduplicate_upload_rows():
+    """Keep the latest metrics row per (run_id, sample_id) and QC row per aliquot before
+    their unique indexes are created (uploads appended duplicates before they upserted)"""
+    indexes = {ix["name"] for name in ("genotype_metrics", "dna_qc") for ix in inspect(engine).get_indexes(name)}
+    removed = 0
+    with engine.begin() as conn:
+        if "ux_genotype_metrics_sample_id_run_id" not in indexes:
+            latest = select(func.max(GenotypeMetricsModel.id)).group_by(
+                GenotypeMetricsModel.run_id, GenotypeMetricsModel.sample_id)
+            removed += conn.execute(
+                delete(GenotypeMetricsModel).where(GenotypeMetricsModel.id.not_in(latest))
+            ).rowcount
+            conn.execute(text("DROP INDEX IF EXISTS ix_genotype_metrics_sample_id_run_id"))
+        if "ux_dna_qc_aliquot_id" not in indexes:
+            newer = aliased(DNAQCModel)
+            removed += conn.execute(delete(DNAQCModel).where(exists().where(
+                newer.aliquot_id == DNAQCModel.aliquot_id,
+                or_(newer.created_at > DNAQCModel.created_at,
+                    (newer.created_at == DNAQCModel.created_at) & (newer.id > DNAQCModel.id))
+            ))).rowcount
+    return removed
+
+# Create tables (and columns/indexes added to tables that already exist)
+stats_missing = not inspect(engine).has_table("stat_counts")
+search_missing = not inspect(engine).has_table("search_terms")
 Base.metadata.create_all(bind=engine)
+job_queue.create_tables(engine)
+sample_status.create_tables(engine)
+aggregates.create_tables(engine)
+response_cache.create_tables(engine)
+search_index.create_tables(engine)
+events.create_tables(engine)
+idempotency.create_tables(engine)
+run_analytics.create_tables(engine)
+new_columns = add_missing_columns()
+duplicates_removed = deduplicate_upload_rows()
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+# QC threshold profiles; the environment thresholds define the "default" profile
+qc_profiles = ProfileStore(engine, Thresholds(
+    dna_min_conc=DNA_MIN_CONC,
+    a260_280_min=A260_280_MIN,
+    a260_280_max=A260_280_MAX,
+    a260_230_min=A260_230_MIN,
+    callrate_min=CALLRATE_MIN,
+    dishqc_min=DISHQC_MIN
+))
+# Environment overrides may just have saved a new default profile version
+with engine.begin() as conn:
+    response_cache.invalidate(conn, response_cache.SETTINGS)
+
+# ID allocation (per-prefix sequences, reserved in blocks per worker)
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "1000"))
+ids = IdAllocator(engine, block_size=ID_BLOCK_SIZE)
+ids.register("KIT", 4, KitModel.id)
+ids.register("SAMP", 5, SampleModel.id)
+ids.register("CONS", 4, ConsentModel.id)
+ids.register("EXT", 4, ExtractionBatchModel.id)
+ids.register("QC", 5, DNAQCModel.id)
+ids.register("PLT", 4, PlateModel.id)
+ids.register("WELL", 5, PlateWellModel.id)
+ids.register("RUN", 4, RunModel.id)
+ids.register("CHIP", 4, BeadChipModel.id)
+ids.register("PRS", 4, PRSJobModel.id)
+
+# Small writes (kits, samples, consents) are group-committed by one writer thread on SQLite
+WRITE_QUEUE = os.getenv("WRITE_QUEUE", "true" if is_sqlite(DATABASE_URL) else "false").lower() in ("1", "true", "yes")
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "64"))
+WRITE_QUEUE_MAX_WAIT_MS = float(os.getenv("WRITE_QUEUE_MAX_WAIT_MS", "0"))
+writes = WriteQueue(SessionLocal, enabled=WRITE_QUEUE, max_batch=WRITE_QUEUE_MAX_BATCH, max_wait=WRITE_QUEUE_MAX_WAIT_MS / 1000)
+
+# Background jobs (PRS packages, see prs_jobs.py); PRS_WORKERS=0 when workers run via `python job_queue.py`
+PRS_WORKERS = int(os.getenv("PRS_WORKERS", "2"))
+# Jobs queued before the handler left app.py would import app (and rerun startup) in the worker
+with engine.begin() as conn:
+    conn.execute(
+        update(job_queue.jobs)
+        .where(job_queue.jobs.c.handler == "app:build_prs_package")
+        .values(handler=prs_jobs.HANDLER)
+    )
+
+# Change events for GET /events (server-sent events), fanned out per process
+event_bus = events.EventBus(
+    async_engine,
+    poll_interval=float(os.getenv("EVENTS_POLL_INTERVAL_S", "1.0")),
+    heartbeat=float(os.getenv("EVENTS_HEARTBEAT_S", "15")),
+    queue_size=int(os.getenv("EVENTS_QUEUE_SIZE", "256")),
+    replay_limit=int(os.getenv("EVENTS_REPLAY_LIMIT", "1000")),
+    retention=float(os.getenv("EVENTS_RETENTION_S", "86400")),
+    late=float(os.getenv("EVENTS_LATE_S", "600")),
+)
+event_bus.watch_commits(SessionLocal)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pool = job_queue.WorkerPool(DATABASE_URL, PRS_WORKERS)
+    pool.start()
+    await event_bus.start()
+    yield
+    await event_bus.stop()
+    pool.stop()
+    writes.stop()
+    await async_engine.dispose()
 
 # FastAPI app
-app = FastAPI(title="Gennext LIMS — API", version="0.0.1")
+app = FastAPI(title="Gennext LIMS — API", version="0.0.1", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -162,9 +199,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Query-Count", "Server-Timing", "ETag", "X-Cache"],
+)
+
+# Request instrumentation: Prometheus metrics on GET /metrics, optional
+# X-Query-Count / Server-Timing headers and slow-request stack dumps
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "false").lower() in ("1", "true", "yes")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 = profiler off
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/lims_profiles")
+query_stats.install(engine)
+query_stats.install(async_engine.sync_engine)
+
+registry = instrumentation.Registry()
+request_metrics = instrumentation.RequestMetrics(registry)
+profiler = instrumentation.SlowRequestProfiler(
+    PROFILE_SLOW_MS / 1000, PROFILE_INTERVAL_MS / 1000, PROFILE_DIR
+) if PROFILE_SLOW_MS > 0 else None
+app.add_middleware(
+    instrumentation.MetricsMiddleware,
+    metrics=request_metrics,
+    server_timing=SERVER_TIMING,
+    query_count_header=QUERY_COUNT_HEADER,
+    profiler=profiler,
+    unprofiled_paths=["/events"],
 )
 
-# Dependency
+def threadpool_stats():
+    # Sync endpoints run on anyio's default limiter; only readable from the event loop
+    return anyio.to_thread.current_default_thread_limiter().statistics()
+
+registry.gauge("lims_threadpool_busy_threads", "Threadpool tokens in use by sync endpoints",
+               fn=lambda: threadpool_stats().borrowed_tokens)
+registry.gauge("lims_threadpool_capacity", "Threadpool size", fn=lambda: threadpool_stats().total_tokens)
+registry.gauge("lims_threadpool_queue_depth", "Sync endpoint calls waiting for a thread",
+               fn=lambda: threadpool_stats().tasks_waiting)
+registry.gauge("lims_db_pool_checked_out", "Connections checked out of the sync pool",
+               fn=lambda: getattr(engine.pool, "checkedout", lambda: 0)())
+registry.gauge("lims_write_queue_depth", "Writes waiting for the group-commit writer", fn=lambda: writes.pending)
+registry.counter("lims_write_queue_commits_total", "Group commits", fn=lambda: writes.commits)
+registry.counter("lims_write_queue_writes_total", "Writes committed through the queue", fn=lambda: writes.writes)
+registry.counter("lims_samplesheet_cache_hits_total", "SampleSheet cache hits", fn=lambda: samplesheets.hits)
+registry.counter("lims_samplesheet_cache_misses_total", "SampleSheet cache misses", fn=lambda: samplesheets.misses)
+response_cache_requests = registry.counter(
+    "lims_response_cache_requests_total", "Cached GET responses by outcome (hit, miss, not_modified)", ("route", "result"))
+upload_requests = registry.counter(
+    "lims_upload_requests_total", "Metrics/QC uploads by outcome (applied, replayed)", ("route", "result"))
+registry.gauge("lims_events_subscribers", "Open GET /events streams", fn=lambda: event_bus.subscribers)
+registry.counter("lims_events_delivered_total", "Events queued to /events subscribers", fn=lambda: event_bus.delivered)
+registry.counter("lims_events_dropped_subscribers_total", "/events streams closed for falling behind",
+                 fn=lambda: event_bus.dropped)
+registry.counter("lims_events_late_total", "Events delivered after later IDs (long PostgreSQL transactions)",
+                 fn=lambda: event_bus.late_delivered)
+if profiler:
+    registry.counter("lims_profiler_dumps_total", "Slow-request stack dumps written", fn=lambda: profiler.dumps)
+
+# Pool exhaustion, lock timeouts and statement timeouts surface as OperationalError
+@app.exception_handler(OperationalError)
+async def database_unavailable(request: Request, exc: OperationalError):
+    return JSONResponse(status_code=503, content={"detail": "Database busy or statement timed out"})
+
+# Dependencies
 def get_db():
     db = SessionLocal()
     try:
@@ -172,6 +268,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Pydantic models
 class KitCreate(BaseModel):
     clinic_id: Optional[str] = None
@@ -188,6 +288,27 @@ class SampleCreate(BaseModel):
     subject_pseudoid: str
     collection_datetime: datetime
 
+class KitBatchCreate(BaseModel):
+    kits: List[KitCreate]
+
+class SampleBatchCreate(BaseModel):
+    samples: List[SampleCreate]
+
+class BatchRowResult(BaseModel):
+    row: int  # position in the request, or line number in a CSV manifest
+    id: Optional[str] = None
+    qr_code: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    mode: str
+    committed: bool
+    created: int
+    failed: int
+    results: List[BatchRowResult]
+
+BatchMode = Literal["atomic", "partial"]
+
 class SampleOut(BaseModel):
     id: str
     kit_qr: str
@@ -197,6 +318,17 @@ class SampleOut(BaseModel):
     status: str
     has_consent: bool
 
+class SampleTransition(BaseModel):
+    sample_ids: List[str]
+    status: str
+    reason: Optional[str] = None
+
+class StatusChange(BaseModel):
+    from_status: Optional[str]
+    to_status: str
+    reason: Optional[str]
+    changed_at: datetime
+
 class ConsentCreate(BaseModel):
     sample_id: str
     consent_type: str = "General"
@@ -220,15 +352,36 @@ class DNAQCIn(BaseModel):
 class DNAQCResult(BaseModel):
     aliquot_id: str
     qc_flag: str
+    recorded: bool = True
+
+class PlateControl(BaseModel):
+    aliquot_id: str
+    well: Optional[str] = None  # pinned well; placed like a sample when omitted
+
+class PlateAssign(BaseModel):
+    aliquot_ids: List[str]
+    beadchip_barcodes: List[str]
+    order: Literal["row_major", "column_major", "random"] = "column_major"
+    controls: List[PlateControl] = []
+    seed: Optional[int] = None  # for order=random; echoed by /plates:layout
 
 class PlateCreate(BaseModel):
     name: str
-    wells: List[Dict[str, str]]  # [{well, aliquot_id, sentrix_barcode, sentrix_position}]
+    plate_format: Literal["96", "384"] = "96"
+    wells: List[Dict[str, str]] = []  # [{well, aliquot_id, sentrix_barcode, sentrix_position}]
+    assign: Optional[PlateAssign] = None  # auto-assign wells instead of listing them
+
+class PlateLayout(BaseModel):
+    plate_format: str
+    seed: Optional[int] = None
+    wells: List[Dict[str, str]]
+    errors: List[str]
 
 class PlateOut(BaseModel):
     id: str
     name: str
     well_count: int
+    unknown_aliquot_ids: List[str] = []
 
 class RunCreate(BaseModel):
     run_name: str
@@ -260,339 +413,1110 @@ class PRSJobOut(BaseModel):
     status: str
     output_path: Optional[str]
 
+class PRSJobStatus(PRSJobOut):
+    attempts: int = 0
+    error: Optional[str] = None
+
+class Page(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+class LineageRun(BaseModel):
+    id: str
+    run_name: Optional[str]
+    run_date: Optional[datetime]
+    status: Optional[str]
+
+class LineageMetrics(BaseModel):
+    call_rate: Optional[float]
+    dish_qc: Optional[float]
+    heterozygosity: Optional[float]
+    sex_call: Optional[str]
+    qc_flag: Optional[str]
+    qc_threshold_version: Optional[str]
+
+class LineageWell(BaseModel):
+    plate_id: str
+    plate_name: Optional[str]
+    well: Optional[str]
+    sentrix_barcode: Optional[str]
+    sentrix_position: Optional[str]
+    run: Optional[LineageRun] = None  # None until the BeadChip is registered on a run
+    metrics: Optional[LineageMetrics] = None
+
+class LineageAliquot(BaseModel):
+    id: str
+    label: Optional[str]
+    extraction_batch_id: Optional[str]
+    qc_flag: Optional[str]
+    wells: List[LineageWell] = []
+
+class Lineage(BaseModel):
+    sample_id: str
+    subject_pseudoid: Optional[str]
+    sample_type: Optional[str]
+    status: Optional[str]
+    collection_datetime: Optional[datetime]
+    kit_id: Optional[str]
+    kit_qr: Optional[str]
+    clinic_id: Optional[str]
+    consent_id: Optional[str]
+    consent_date: Optional[datetime]
+    aliquots: List[LineageAliquot] = []
+
+class LineageBatchIn(BaseModel):
+    identifiers: List[str]
+
+class LineageBatchOut(BaseModel):
+    results: Dict[str, List[Lineage]]  # identifier -> samples it resolved to
+    unknown: List[str]
+
+def created_range(column, date_from: Optional[datetime], date_to: Optional[datetime]) -> list:
+    filters = []
+    if date_from:
+        filters.append(column >= date_from)
+    if date_to:
+        filters.append(column < date_to)
+    return filters
+
+# Consent gate
+class GateResult:
+    """Outcome of a consent check: the sample behind each known ID, and what failed"""
+    def __init__(self):
+        self.sample_ids: Dict[str, str] = {}  # requested ID -> sample ID
+        self.unknown: List[str] = []
+        self.missing_consent: List[str] = []  # sample IDs, in request order
+
+    def require_consent(self, before: str):
+        if self.missing_consent:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Consent required: sample(s) {', '.join(self.missing_consent)} missing Consent. Attach via /consents before {before}."
+            )
+
+class ConsentGate:
+    """Resolves sample or aliquot IDs to their sample's consent in one LEFT JOIN query.
+
+    Rows are memoized for the life of the gate (one request), so later steps
+    can reuse ``sample_status`` / ``aliquot_sample`` without re-fetching.
+    """
+    def __init__(self, db: Session):
+        self.db = db
+        self.sample_status: Dict[str, Optional[str]] = {}
+        self.has_consent: Dict[str, bool] = {}
+        self.aliquot_sample: Dict[str, Optional[str]] = {}
+
+    def _load_samples(self, sample_ids: List[str]):
+        todo = [sid for sid in set(sample_ids) if sid not in self.sample_status]
+        if not todo:
+            return
+        rows = self.db.execute(
+            select(SampleModel.id, SampleModel.status, func.count(ConsentModel.id))
+            .outerjoin(ConsentModel, ConsentModel.sample_id == SampleModel.id)
+            .where(SampleModel.id.in_(todo))
+            .group_by(SampleModel.id, SampleModel.status)
+        ).all()
+        for sample_id, status, consents in rows:
+            self.sample_status[sample_id] = status
+            self.has_consent[sample_id] = consents > 0
+        for sample_id in todo:
+            self.sample_status.setdefault(sample_id, None)
+
+    def _load_aliquots(self, aliquot_ids: List[str]):
+        todo = [aid for aid in set(aliquot_ids) if aid not in self.aliquot_sample]
+        if not todo:
+            return
+        rows = self.db.execute(
+            select(AliquotModel.id, AliquotModel.sample_id, SampleModel.status, func.count(ConsentModel.id))
+            .outerjoin(SampleModel, SampleModel.id == AliquotModel.sample_id)
+            .outerjoin(ConsentModel, ConsentModel.sample_id == AliquotModel.sample_id)
+            .where(AliquotModel.id.in_(todo))
+            .group_by(AliquotModel.id, AliquotModel.sample_id, SampleModel.status)
+        ).all()
+        for aliquot_id, sample_id, status, consents in rows:
+            self.aliquot_sample[aliquot_id] = sample_id
+            if sample_id not in self.sample_status:
+                self.sample_status[sample_id] = status
+                self.has_consent[sample_id] = consents > 0
+        for aliquot_id in todo:
+            self.aliquot_sample.setdefault(aliquot_id, None)
+
+    def _result(self, requested: List[str], sample_of) -> GateResult:
+        result = GateResult()
+        missing = {}
+        for requested_id in requested:
+            sample_id = sample_of(requested_id)
+            if sample_id is None or self.sample_status.get(sample_id) is None:
+                result.unknown.append(requested_id)
+                continue
+            result.sample_ids[requested_id] = sample_id
+            if not self.has_consent[sample_id]:
+                missing[sample_id] = None
+        result.missing_consent = list(missing)
+        return result
+
+    def check_samples(self, sample_ids: List[str]) -> GateResult:
+        self._load_samples(sample_ids)
+        return self._result(sample_ids, lambda sid: sid)
+
+    def check_aliquots(self, aliquot_ids: List[str]) -> GateResult:
+        self._load_aliquots(aliquot_ids)
+        return self._result(aliquot_ids, self.aliquot_sample.get)
+
+# Response cache for polled GETs, invalidated by tag versions (see response_cache.py)
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "60"))  # 0 = off
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+responses = response_cache.ResponseCache(
+    response_cache.backend_from_url(RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE), RESPONSE_CACHE_TTL_S
+)
+
+def cache_lookup(request: Request, versions: Dict[str, int]):
+    """(key, ETag, response) for a cached GET; the response is a 304 or a cache hit, else None"""
+    route = request.scope["route"].path
+    key = f"{route}?{'&'.join(sorted(f'{k}={v}' for k, v in request.query_params.multi_items()))}"
+    etag = response_cache.etag(key, versions)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if samplesheet.etag_matches(request.headers.get("if-none-match"), etag):
+        responses.count_not_modified()
+        response_cache_requests.inc((route, "not_modified"))
+        return key, etag, Response(status_code=304, headers=headers)
+    body = responses.get(key, etag)
+    response_cache_requests.inc((route, "miss" if body is None else "hit"))
+    if body is None:
+        return key, etag, None
+    return key, etag, Response(body, media_type="application/json", headers={**headers, "X-Cache": "HIT"})
+
+def cache_store(key: str, etag: str, content: Any) -> Response:
+    body = JSONResponse(jsonable_encoder(content)).body
+    responses.put(key, etag, body)
+    return Response(body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "no-cache", "X-Cache": "MISS"})
+
+async def cache_lookup_async(request: Request, versions: Dict[str, int]):
+    """``cache_lookup`` for async endpoints; a backend doing I/O (sqlite) runs in the threadpool"""
+    if responses.backend.blocking:
+        return await run_in_threadpool(cache_lookup, request, versions)
+    return cache_lookup(request, versions)
+
+async def cache_store_async(key: str, etag: str, content: Any) -> Response:
+    if responses.backend.blocking:
+        return await run_in_threadpool(cache_store, key, etag, content)
+    return cache_store(key, etag, content)
+
+# Upload receipts: re-posting an applied payload replays its response (see idempotency.py)
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+
+def metrics_scope(run_id: str) -> str:
+    return f"runs/{run_id}/metrics"
+
+def upload_receipt(db: Session, route: str, scope: str, digest: str, idempotency_key: Optional[str]) -> Optional[Response]:
+    """The stored response of an already applied payload, else None"""
+    try:
+        stored = idempotency.lookup(db, scope, digest, idempotency_key)
+    except idempotency.KeyReuseError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    upload_requests.inc((route, "applied" if stored is None else "replayed"))
+    if stored is None:
+        return None
+    return Response(stored, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+def store_receipt(db: Session, scope: str, digest: str, idempotency_key: Optional[str], content: Any,
+                  complete: bool = True):
+    """``complete=False`` when rows were skipped for unknown IDs, which may exist by the next upload"""
+    idempotency.record(db, scope, digest, JSONResponse(jsonable_encoder(content)).body.decode(),
+                       idempotency_key, IDEMPOTENCY_TTL_S, complete=complete)
+
 # Endpoints
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of this process's request and resource metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok", "time": datetime.utcnow().isoformat()}
 
+def resolve_rules(profile: Optional[str]) -> CompiledProfile:
+    rules = qc_profiles.compiled(profile)
+    if rules is None:
+        raise HTTPException(status_code=404, detail=f"QC profile {profile} not found")
+    return rules
+
 @app.get("/settings")
-def get_settings():
-    """Return QC thresholds and system settings"""
-    return {
-        "DNA_MIN_CONC": DNA_MIN_CONC,
-        "A260_280_MIN": A260_280_MIN,
-        "A260_280_MAX": A260_280_MAX,
-        "A260_230_MIN": A260_230_MIN,
-        "CALLRATE_MIN": CALLRATE_MIN,
-        "DISHQC_MIN": DISHQC_MIN
-    }
+def get_settings(request: Request, profile: Optional[str] = None):
+    """Return QC thresholds (default profile unless ?profile=name[@version]) and system settings"""
+    with engine.connect() as conn:
+        key, etag, cached = cache_lookup(request, response_cache.tag_versions(conn, [response_cache.SETTINGS]))
+    if cached:
+        return cached
+    rules = resolve_rules(profile)
+    t = rules.profile.thresholds
+    return cache_store(key, etag, {
+        "DNA_MIN_CONC": t.dna_min_conc,
+        "A260_280_MIN": t.a260_280_min,
+        "A260_280_MAX": t.a260_280_max,
+        "A260_230_MIN": t.a260_230_min,
+        "CALLRATE_MIN": t.callrate_min,
+        "DISHQC_MIN": t.dishqc_min,
+        "QC_PROFILE": rules.key,
+        "profiles": [p.key for p in qc_profiles.list(latest_only=True)]
+    })
+
+@app.get("/settings/profiles", response_model=List[Profile])
+def list_qc_profiles(name: Optional[str] = None, assay: Optional[str] = None, clinic_id: Optional[str] = None, all_versions: bool = False):
+    profiles = qc_profiles.list(latest_only=not all_versions)
+    return [p for p in profiles
+            if (name is None or p.name == name)
+            and (assay is None or p.assay == assay)
+            and (clinic_id is None or p.clinic_id == clinic_id)]
+
+@app.post("/settings/profiles", response_model=Profile)
+def save_qc_profile(payload: ProfileIn):
+    """Store thresholds as the next version of a named profile"""
+    profile = qc_profiles.save(payload)
+    with engine.begin() as conn:
+        response_cache.invalidate(conn, response_cache.SETTINGS)
+    return profile
+
+def check_batch_size(n: int):
+    if n > BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Batch of {n} rows exceeds BATCH_MAX_ROWS={BATCH_MAX_ROWS}")
+
+def commit_batch(db: Session, model, rows: List[Dict[str, Any]], results: List[BatchRowResult], mode: str):
+    """Insert ``rows`` in one executemany, or reject the whole batch (422) in atomic mode if any row failed"""
+    failed = sum(1 for r in results if r.error)
+    if failed and mode == "atomic":
+        for r in results:
+            r.id = r.qr_code = None
+        return JSONResponse(status_code=422, content=BatchResult(
+            mode=mode, committed=False, created=0, failed=failed, results=results
+        ).model_dump())
+    if rows:
+        db.execute(insert(model), rows)
+        search_index.index_rows(db, model.__tablename__, rows)
+        db.commit()
+    return BatchResult(mode=mode, committed=True, created=len(rows), failed=failed, results=results)
 
 @app.post("/kits", response_model=KitOut)
-def create_kit(payload: KitCreate, db: Session = Depends(get_db)):
-    kit_count = db.query(KitModel).count()
-    kit = KitModel(
-        id=f"KIT-{kit_count+1:04d}",
-        qr_code=f"QR-{kit_count+1:04d}",
-        clinic_id=payload.clinic_id,
-        status="Allocated"
-    )
-    db.add(kit)
-    db.commit()
-    return KitOut(
-        id=kit.id,
-        qr_code=kit.qr_code,
-        clinic_id=kit.clinic_id,
-        status=kit.status
-    )
+def create_kit(payload: KitCreate):
+    kit_number = ids.next_value("KIT")
 
-@app.get("/kits", response_model=List[KitOut])
-def list_kits(db: Session = Depends(get_db)):
-    kits = db.query(KitModel).all()
-    return [KitOut(
-        id=k.id,
-        qr_code=k.qr_code,
-        clinic_id=k.clinic_id,
-        status=k.status
-    ) for k in kits]
+    def write(db: Session):
+        kit = KitModel(
+            id=ids.format("KIT", kit_number),
+            qr_code=f"QR-{kit_number:04d}",
+            clinic_id=payload.clinic_id,
+            status="Allocated"
+        )
+        db.add(kit)
+        search_index.index_rows(db, "kits", [{"id": kit.id, "qr_code": kit.qr_code}])
+        return KitOut(
+            id=kit.id,
+            qr_code=kit.qr_code,
+            clinic_id=kit.clinic_id,
+            status=kit.status
+        )
+    return writes.submit(write)
+
+@app.post("/kits:batch", response_model=BatchResult)
+def create_kits_batch(payload: KitBatchCreate, mode: BatchMode = "atomic", db: Session = Depends(get_db)):
+    """Allocate many kits with one ID block reservation and one INSERT"""
+    check_batch_size(len(payload.kits))
+    numbers = ids.take("KIT", len(payload.kits))
+    rows = [
+        {
+            "id": ids.format("KIT", number),
+            "qr_code": f"QR-{number:04d}",
+            "clinic_id": kit.clinic_id,
+            "status": "Allocated"
+        }
+        for kit, number in zip(payload.kits, numbers)
+    ]
+    results = [BatchRowResult(row=i, id=r["id"], qr_code=r["qr_code"]) for i, r in enumerate(rows)]
+    return commit_batch(db, KitModel, rows, results, mode)
+
+@app.get("/kits", response_model=Page)
+async def list_kits(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    clinic_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    filters = created_range(KitModel.created_at, created_from, created_to)
+    if status:
+        filters.append(KitModel.status.in_(split_values(status)))
+    if clinic_id:
+        filters.append(KitModel.clinic_id == clinic_id)
+    return await paginate_async(db, {
+        "id": KitModel.id,
+        "qr_code": KitModel.qr_code,
+        "clinic_id": KitModel.clinic_id,
+        "status": KitModel.status
+    }, KitModel.created_at, KitModel.id, filters, limit, cursor, fields)
 
 @app.post("/samples", response_model=SampleOut)
-def create_sample(payload: SampleCreate, db: Session = Depends(get_db)):
-    # Verify kit exists
-    kit = db.query(KitModel).filter(KitModel.qr_code == payload.kit_qr).first()
-    if not kit:
-        raise HTTPException(status_code=404, detail="Kit not found")
-    
-    sample_count = db.query(SampleModel).count()
-    sample = SampleModel(
-        id=f"SAMP-{sample_count+1:05d}",
-        kit_qr=payload.kit_qr,
-        sample_type=payload.sample_type,
-        subject_pseudoid=payload.subject_pseudoid,
-        collection_datetime=payload.collection_datetime,
-        status="Received"
-    )
-    db.add(sample)
+def create_sample(payload: SampleCreate):
+    sample_id = ids.next_id("SAMP")
+
+    def write(db: Session):
+        # Verify kit exists
+        kit = db.query(KitModel.id).filter(KitModel.qr_code == payload.kit_qr).first()
+        if not kit:
+            raise HTTPException(status_code=404, detail="Kit not found")
+
+        sample = SampleModel(
+            id=sample_id,
+            kit_qr=payload.kit_qr,
+            sample_type=payload.sample_type,
+            subject_pseudoid=payload.subject_pseudoid,
+            collection_datetime=payload.collection_datetime,
+            status=sample_status.RECEIVED
+        )
+        db.add(sample)
+        sample_status.record_created(db, [sample_id])
+        search_index.index_rows(db, "samples", [{"id": sample_id, "subject_pseudoid": payload.subject_pseudoid}])
+        return SampleOut(
+            id=sample.id,
+            kit_qr=sample.kit_qr,
+            sample_type=sample.sample_type,
+            subject_pseudoid=sample.subject_pseudoid,
+            collection_datetime=sample.collection_datetime,
+            status=sample.status,
+            has_consent=False
+        )
+    return writes.submit(write)
+
+def accession_samples(db: Session, parsed: List[tuple], mode: str):
+    """Create samples from (row, SampleCreate or None, parse error or None) entries"""
+    check_batch_size(len(parsed))
+    qrs = {sample.kit_qr for _, sample, _ in parsed if sample is not None}
+    known_kits = set(db.scalars(select(KitModel.qr_code).where(KitModel.qr_code.in_(qrs)))) if qrs else set()
+
+    results = []
+    valid = []
+    for row, sample, error in parsed:
+        if sample is not None and sample.kit_qr not in known_kits:
+            error = f"Kit {sample.kit_qr} not found"
+        results.append(BatchRowResult(row=row, error=error))
+        if error is None:
+            valid.append((results[-1], sample))
+    if mode == "atomic" and len(valid) < len(parsed):
+        return commit_batch(db, SampleModel, [], results, mode)
+
+    sample_ids = ids.next_ids("SAMP", len(valid))
+    rows = []
+    for (result, sample), sample_id in zip(valid, sample_ids):
+        result.id = sample_id
+        rows.append({
+            "id": sample_id,
+            "kit_qr": sample.kit_qr,
+            "sample_type": sample.sample_type,
+            "subject_pseudoid": sample.subject_pseudoid,
+            "collection_datetime": sample.collection_datetime,
+            "status": sample_status.RECEIVED
+        })
+    if rows:
+        sample_status.record_created(db, [r["id"] for r in rows], reason="batch")
+    return commit_batch(db, SampleModel, rows, results, mode)
+
+@app.post("/samples:batch", response_model=BatchResult)
+def create_samples_batch(payload: SampleBatchCreate, mode: BatchMode = "atomic", db: Session = Depends(get_db)):
+    """Accession many samples: kit QRs checked in one query, IDs from one block, one INSERT"""
+    return accession_samples(db, [(i, sample, None) for i, sample in enumerate(payload.samples)], mode)
+
+MANIFEST_COLUMNS = ["kit_qr", "sample_type", "subject_pseudoid", "collection_datetime"]
+
+@app.post("/samples:manifest", response_model=BatchResult)
+def upload_sample_manifest(file: UploadFile = File(...), mode: BatchMode = "atomic", db: Session = Depends(get_db)):
+    """Accession samples from a CSV manifest (kit_qr, sample_type, subject_pseudoid, collection_datetime)"""
+    reader = csv.DictReader(open_text(file.file))
+    header = [h.strip().lower() for h in reader.fieldnames or []]
+    missing = [c for c in MANIFEST_COLUMNS if c not in header]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Manifest is missing column(s): {', '.join(missing)}")
+    reader.fieldnames = header
+
+    parsed = []
+    for record in reader:
+        if not any((v or "").strip() for v in record.values() if isinstance(v, str)):
+            continue
+        line = reader.line_num
+        try:
+            parsed.append((line, SampleCreate(**{c: (record.get(c) or "").strip() for c in MANIFEST_COLUMNS}), None))
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors())
+            parsed.append((line, None, errors))
+    return accession_samples(db, parsed, mode)
+
+@app.get("/samples", response_model=Page)
+async def list_samples(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    kit_qr: Optional[str] = None,
+    subject_pseudoid: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    filters = created_range(SampleModel.created_at, created_from, created_to)
+    if status:
+        filters.append(SampleModel.status.in_(split_values(status)))
+    if kit_qr:
+        filters.append(SampleModel.kit_qr == kit_qr)
+    if subject_pseudoid:
+        filters.append(SampleModel.subject_pseudoid == subject_pseudoid)
+    has_consent = exists().where(ConsentModel.sample_id == SampleModel.id)
+    return await paginate_async(db, {
+        "id": SampleModel.id,
+        "kit_qr": SampleModel.kit_qr,
+        "sample_type": SampleModel.sample_type,
+        "subject_pseudoid": SampleModel.subject_pseudoid,
+        "collection_datetime": SampleModel.collection_datetime,
+        "status": SampleModel.status,
+        "has_consent": has_consent
+    }, SampleModel.created_at, SampleModel.id, filters, limit, cursor, fields)
+
+@app.post("/samples:transition")
+def transition_samples(payload: SampleTransition, db: Session = Depends(get_db)):
+    """Move samples to a status where the state machine allows it (e.g. release from Hold for QA)"""
+    if payload.status not in sample_status.TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown status {payload.status}. Valid: {', '.join(sample_status.STATUSES)}")
+    moved = sample_status.transition(db, payload.sample_ids, payload.status, payload.reason or "manual")
     db.commit()
-    return SampleOut(
-        id=sample.id,
-        kit_qr=sample.kit_qr,
-        sample_type=sample.sample_type,
-        subject_pseudoid=sample.subject_pseudoid,
-        collection_datetime=sample.collection_datetime,
-        status=sample.status
+    moved_set = set(moved)
+    return {
+        "status": payload.status,
+        "allowed_from": sorted(sample_status.allowed_from(payload.status)),
+        "moved": [sid for sid in payload.sample_ids if sid in moved_set],
+        "skipped": [sid for sid in payload.sample_ids if sid not in moved_set]
+    }
+
+@app.get("/samples/{sample_id}/history", response_model=List[StatusChange])
+def get_sample_history(sample_id: str, db: Session = Depends(get_db)):
+    """Append-only status history of one sample, oldest first"""
+    changes = sample_status.history(db, sample_id)
+    if not changes and db.get(SampleModel, sample_id) is None:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    return changes
+
+# Chain of custody: sample -> aliquots -> plate wells -> BeadChip run -> genotype metrics.
+# One outer-joined query; each hop is an indexed lookup, so the cost is per
+# matched sample rather than per table size.
+LINEAGE_COLUMNS = {
+    "sample_id": SampleModel.id,
+    "subject_pseudoid": SampleModel.subject_pseudoid,
+    "sample_type": SampleModel.sample_type,
+    "status": SampleModel.status,
+    "collection_datetime": SampleModel.collection_datetime,
+    "kit_id": KitModel.id,
+    "kit_qr": SampleModel.kit_qr,
+    "clinic_id": KitModel.clinic_id,
+    "consent_id": ConsentModel.id,
+    "consent_date": ConsentModel.consent_date,
+    "aliquot_id": AliquotModel.id,
+    "aliquot_label": AliquotModel.label,
+    "extraction_batch_id": AliquotModel.extraction_batch_id,
+    "aliquot_qc_flag": AliquotModel.qc_flag,
+    "plate_id": PlateWellModel.plate_id,
+    "plate_name": PlateModel.name,
+    "well": PlateWellModel.well,
+    "sentrix_barcode": PlateWellModel.sentrix_barcode,
+    "sentrix_position": PlateWellModel.sentrix_position,
+    "run_id": RunModel.id,
+    "run_name": RunModel.run_name,
+    "run_date": RunModel.run_date,
+    "run_status": RunModel.status,
+    "call_rate": GenotypeMetricsModel.call_rate,
+    "dish_qc": GenotypeMetricsModel.dish_qc,
+    "heterozygosity": GenotypeMetricsModel.heterozygosity,
+    "sex_call": GenotypeMetricsModel.sex_call,
+    "metrics_qc_flag": GenotypeMetricsModel.qc_flag,
+    "qc_threshold_version": GenotypeMetricsModel.qc_threshold_version,
+}
+
+def lineage_query(identifiers: List[str]):
+    """Custody rows for samples whose ID, subject pseudo-ID or kit QR is in ``identifiers``"""
+    return (
+        select(*[column.label(name) for name, column in LINEAGE_COLUMNS.items()])
+        .select_from(SampleModel)
+        .outerjoin(KitModel, KitModel.qr_code == SampleModel.kit_qr)
+        .outerjoin(ConsentModel, ConsentModel.sample_id == SampleModel.id)
+        .outerjoin(AliquotModel, AliquotModel.sample_id == SampleModel.id)
+        .outerjoin(PlateWellModel, PlateWellModel.aliquot_id == AliquotModel.id)
+        .outerjoin(PlateModel, PlateModel.id == PlateWellModel.plate_id)
+        .outerjoin(BeadChipModel, BeadChipModel.barcode == PlateWellModel.sentrix_barcode)
+        .outerjoin(RunModel, RunModel.id == BeadChipModel.run_id)
+        .outerjoin(GenotypeMetricsModel, (GenotypeMetricsModel.sample_id == SampleModel.id)
+                   & (GenotypeMetricsModel.run_id == RunModel.id))
+        .where(or_(
+            SampleModel.id.in_(identifiers),
+            SampleModel.subject_pseudoid.in_(identifiers),
+            SampleModel.kit_qr.in_(identifiers),
+        ))
+        .order_by(SampleModel.id, AliquotModel.id, PlateWellModel.plate_id, RunModel.run_date)
     )
 
-@app.get("/samples", response_model=List[SampleOut])
-def list_samples(db: Session = Depends(get_db)):
-    samples = db.query(SampleModel).all()
-    return [SampleOut(
-        id=s.id,
-        kit_qr=s.kit_qr,
-        sample_type=s.sample_type,
-        subject_pseudoid=s.subject_pseudoid,
-        collection_datetime=s.collection_datetime,
-        status=s.status,
-        has_consent=s.consent is not None
-    ) for s in samples]
+def build_lineage(rows) -> Dict[str, Lineage]:
+    """Nest flat custody rows into one Lineage per sample, in query order"""
+    samples: Dict[str, Lineage] = {}
+    aliquots: Dict[str, LineageAliquot] = {}
+    seen_wells = set()
+    for r in rows:
+        sample = samples.get(r.sample_id)
+        if sample is None:
+            sample = samples[r.sample_id] = Lineage(
+                sample_id=r.sample_id, subject_pseudoid=r.subject_pseudoid, sample_type=r.sample_type,
+                status=r.status, collection_datetime=r.collection_datetime, kit_id=r.kit_id, kit_qr=r.kit_qr,
+                clinic_id=r.clinic_id, consent_id=r.consent_id, consent_date=r.consent_date,
+            )
+        if r.aliquot_id is None:
+            continue
+        aliquot = aliquots.get(r.aliquot_id)
+        if aliquot is None:
+            aliquot = aliquots[r.aliquot_id] = LineageAliquot(
+                id=r.aliquot_id, label=r.aliquot_label, extraction_batch_id=r.extraction_batch_id,
+                qc_flag=r.aliquot_qc_flag,
+            )
+            sample.aliquots.append(aliquot)
+        # A second consent row repeats every well; keep each (aliquot, plate, well, run) once
+        well_key = (r.aliquot_id, r.plate_id, r.well, r.run_id)
+        if r.plate_id is None or well_key in seen_wells:
+            continue
+        seen_wells.add(well_key)
+        aliquot.wells.append(LineageWell(
+            plate_id=r.plate_id, plate_name=r.plate_name, well=r.well,
+            sentrix_barcode=r.sentrix_barcode, sentrix_position=r.sentrix_position,
+            run=LineageRun(id=r.run_id, run_name=r.run_name, run_date=r.run_date, status=r.run_status)
+            if r.run_id else None,
+            metrics=LineageMetrics(
+                call_rate=r.call_rate, dish_qc=r.dish_qc, heterozygosity=r.heterozygosity,
+                sex_call=r.sex_call, qc_flag=r.metrics_qc_flag, qc_threshold_version=r.qc_threshold_version,
+            ) if r.call_rate is not None or r.metrics_qc_flag is not None else None,
+        ))
+    return samples
 
-@app.post("/consents")
-def create_consent(payload: ConsentCreate, db: Session = Depends(get_db)):
-    consent_count = db.query(ConsentModel).count()
-    consent = ConsentModel(
-        id=f"CONS-{consent_count+1:04d}",
-        sample_id=payload.sample_id,
-        consent_type=payload.consent_type,
-        consent_date=payload.consent_date
+@app.get("/lineage/{identifier}", response_model=List[Lineage])
+async def get_lineage(identifier: str, db: AsyncSession = Depends(get_async_db)):
+    """Custody chain for a sample ID, subject pseudo-ID or kit QR (all samples it resolves to)"""
+    samples = build_lineage((await db.execute(lineage_query([identifier]))).all())
+    if not samples:
+        raise HTTPException(status_code=404, detail=f"No sample, subject or kit {identifier}")
+    return list(samples.values())
+
+@app.post("/lineage:batch", response_model=LineageBatchOut)
+async def get_lineage_batch(payload: LineageBatchIn, db: AsyncSession = Depends(get_async_db)):
+    """Custody chains for many identifiers in one query; unmatched identifiers are listed"""
+    identifiers = list(dict.fromkeys(payload.identifiers))
+    check_batch_size(len(identifiers))
+    samples = build_lineage((await db.execute(lineage_query(identifiers))).all()) if identifiers else {}
+    wanted = set(identifiers)
+    results: Dict[str, List[Lineage]] = {}
+    for sample in samples.values():
+        for key in {sample.sample_id, sample.subject_pseudoid, sample.kit_qr} & wanted:
+            results.setdefault(key, []).append(sample)
+    return LineageBatchOut(
+        results={i: results[i] for i in identifiers if i in results},
+        unknown=[i for i in identifiers if i not in results],
     )
-    db.add(consent)
-    
-    # Update sample status to Accessioned
-    sample = db.query(SampleModel).filter(SampleModel.id == payload.sample_id).first()
-    if sample:
-        sample.status = "Accessioned"
-    
-    db.commit()
-    return {"id": consent.id, "sample_id": consent.sample_id}
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=search_index.MIN_QUERY_LENGTH),
+    entity_type: Optional[str] = Query(None, alias="type"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Kits, samples, aliquots, plates and runs by ID, QR, pseudo-ID, label, name or Sentrix barcode.
+
+    Exact and prefix matches rank first, then substrings, then matches within
+    one or two typos (``type=sample,kit`` restricts the entity types).
+    """
+    entities = split_values(entity_type)
+    unknown = sorted(set(entities) - set(search_index.ENTITIES))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown type {', '.join(unknown)}; expected one of {', '.join(search_index.ENTITIES)}")
+    hits = await db.run_sync(search_index.search, q, entities, limit)
+    return {"query": q, "results": hits}
+
+@app.get("/events")
+async def stream_events(
+    request: Request,
+    topic: Optional[str] = None,
+    run_id: Optional[str] = None,
+    plate_id: Optional[str] = None,
+    after: Optional[int] = Query(None, ge=0),
+):
+    """Server-sent events for sample status, QC flag, run and PRS job changes.
+
+    ``topic`` (``sample.status``, or a prefix such as ``run``), ``run_id`` and
+    ``plate_id`` filter the stream. A reconnecting EventSource sends
+    ``Last-Event-ID`` (or pass ``after``) and gets the events it missed first.
+    """
+    topics = split_values(topic)
+    unknown = [t for t in topics if not any(events.topic_matches(known, [t]) for known in events.TOPICS)]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topic {', '.join(unknown)}; expected one of {', '.join(events.TOPICS)}")
+    cursor = after
+    if cursor is None and request.headers.get("last-event-id"):
+        try:
+            cursor = int(request.headers["last-event-id"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an event ID")
+    subscription = events.Filter(topics, split_values(run_id), split_values(plate_id))
+    return StreamingResponse(
+        event_bus.stream(subscription, cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/consents")
+def create_consent(payload: ConsentCreate):
+    consent_id = ids.next_id("CONS")
+
+    def write(db: Session):
+        db.add(ConsentModel(
+            id=consent_id,
+            sample_id=payload.sample_id,
+            consent_type=payload.consent_type,
+            consent_date=payload.consent_date
+        ))
+        sample_status.transition(db, [payload.sample_id], sample_status.ACCESSIONED, f"consent {consent_id}")
+        return {"id": consent_id, "sample_id": payload.sample_id}
+    return writes.submit(write)
 
 @app.post("/extractions")
 def create_extraction(payload: ExtractionCreate, db: Session = Depends(get_db)):
     # Check consent gate for all samples
-    missing_consent = []
-    for sample_id in payload.sample_ids:
-        sample = db.query(SampleModel).filter(SampleModel.id == sample_id).first()
-        if sample:
-            consent = db.query(ConsentModel).filter(ConsentModel.sample_id == sample_id).first()
-            if not consent:
-                missing_consent.append(sample_id)
-    
-    if missing_consent:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Consent required: sample(s) {', '.join(missing_consent)} missing Consent. Attach via /consents before extraction."
-        )
-    
-    batch_count = db.query(ExtractionBatchModel).count()
+    gate = ConsentGate(db).check_samples(payload.sample_ids)
+    gate.require_consent("extraction")
+
     batch = ExtractionBatchModel(
-        id=f"EXT-{batch_count+1:04d}",
+        id=ids.next_id("EXT"),
         batch_date=datetime.utcnow()
     )
     db.add(batch)
-    
+
+    # Number new aliquots after each sample's existing ones (one grouped count)
+    known = [sid for sid in payload.sample_ids if sid in gate.sample_ids]
+    aliquot_counts = dict(db.execute(
+        select(AliquotModel.sample_id, func.count(AliquotModel.id))
+        .where(AliquotModel.sample_id.in_(set(known)))
+        .group_by(AliquotModel.sample_id)
+    ).all()) if known else {}
+
+    now = datetime.utcnow()
     aliquots = []
-    for sample_id in payload.sample_ids:
-        sample = db.query(SampleModel).filter(SampleModel.id == sample_id).first()
-        if sample:
-            sample.status = "Extraction"
-            aliquot_count = db.query(AliquotModel).filter(AliquotModel.sample_id == sample_id).count()
-            aliquot = AliquotModel(
-                id=f"{sample_id}-A{aliquot_count+1:02d}",
-                sample_id=sample_id,
-                extraction_batch_id=batch.id,
-                label=f"Aliquot {aliquot_count+1}"
-            )
-            db.add(aliquot)
-            aliquots.append({
-                "id": aliquot.id,
-                "sample_id": aliquot.sample_id,
-                "label": aliquot.label
-            })
-    
+    rows = []
+    for sample_id in known:
+        aliquot_count = aliquot_counts.get(sample_id, 0)
+        aliquot_counts[sample_id] = aliquot_count + 1
+        aliquot = {
+            "id": f"{sample_id}-A{aliquot_count+1:02d}",
+            "sample_id": sample_id,
+            "label": f"Aliquot {aliquot_count+1}"
+        }
+        aliquots.append(aliquot)
+        rows.append({**aliquot, "extraction_batch_id": batch.id, "created_at": now})
+    if rows:
+        db.flush()
+        db.execute(insert(AliquotModel), rows)
+        aggregates.bump(db, aggregates.ALIQUOT_QC, {"Pending": len(rows)})
+        search_index.index_rows(db, "aliquots", rows)
+        sample_status.transition(db, known, sample_status.EXTRACTION, f"extraction {batch.id}")
+
     db.commit()
-    return {"batch_id": batch.id, "aliquots": aliquots}
-
-@app.get("/aliquots", response_model=List[AliquotOut])
-def list_aliquots(db: Session = Depends(get_db)):
-    aliquots = db.query(AliquotModel).all()
-    return [AliquotOut(
-        id=a.id,
-        sample_id=a.sample_id,
-        label=a.label,
-        qc_flag=a.qc_flag
-    ) for a in aliquots]
+    return {"batch_id": batch.id, "aliquots": aliquots, "unknown_sample_ids": gate.unknown}
+
+@app.get("/aliquots", response_model=Page)
+async def list_aliquots(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    sample_id: Optional[str] = None,
+    extraction_batch_id: Optional[str] = None,
+    qc_flag: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    filters = created_range(AliquotModel.created_at, created_from, created_to)
+    if sample_id:
+        filters.append(AliquotModel.sample_id == sample_id)
+    if extraction_batch_id:
+        filters.append(AliquotModel.extraction_batch_id == extraction_batch_id)
+    if qc_flag:
+        filters.append(AliquotModel.qc_flag.in_(split_values(qc_flag)))
+    return await paginate_async(db, {
+        "id": AliquotModel.id,
+        "sample_id": AliquotModel.sample_id,
+        "label": AliquotModel.label,
+        "qc_flag": AliquotModel.qc_flag
+    }, AliquotModel.created_at, AliquotModel.id, filters, limit, cursor, fields)
 
 @app.post("/extractions/qc")
-def submit_dna_qc(qcs: List[DNAQCIn], db: Session = Depends(get_db)):
-    results = []
-    for qc in qcs:
-        # Calculate QC flag
-        qc_flag = "Pass"
-        if qc.concentration < DNA_MIN_CONC:
-            if qc.concentration >= DNA_MIN_CONC * 0.7:
-                qc_flag = "Warn"
-            else:
-                qc_flag = "Fail"
-        elif not (A260_280_MIN <= qc.a260_280 <= A260_280_MAX):
-            qc_flag = "Warn" if abs(qc.a260_280 - 1.9) <= 0.3 else "Fail"
-        elif qc.a260_230 < A260_230_MIN:
-            qc_flag = "Warn" if qc.a260_230 >= A260_230_MIN * 0.9 else "Fail"
-        
-        # Save QC data
-        qc_count = db.query(DNAQCModel).count()
-        dna_qc = DNAQCModel(
-            id=f"QC-{qc_count+1:05d}",
-            aliquot_id=qc.aliquot_id,
-            concentration=qc.concentration,
-            a260_280=qc.a260_280,
-            a260_230=qc.a260_230,
-            qc_flag=qc_flag
-        )
-        db.add(dna_qc)
-        
-        # Update aliquot and sample status
-        aliquot = db.query(AliquotModel).filter(AliquotModel.id == qc.aliquot_id).first()
-        if aliquot:
-            aliquot.qc_flag = qc_flag
-            sample = db.query(SampleModel).filter(SampleModel.id == aliquot.sample_id).first()
-            if sample:
-                if qc_flag in ["Pass", "Warn"]:
-                    sample.status = "DNA Ready"
-                else:
-                    sample.status = "Hold for QA"
-        
-        results.append(DNAQCResult(aliquot_id=qc.aliquot_id, qc_flag=qc_flag))
+def submit_dna_qc(qcs: List[DNAQCIn], profile: Optional[str] = None, idempotency_key: Optional[str] = Header(None),
+                  db: Session = Depends(get_db)):
+    """Record DNA QC, one row per aliquot: re-submitted aliquots are updated, unchanged ones not written"""
+    rules = resolve_rules(profile)
+    scope = "extractions/qc"
+    digest = idempotency.payload_hash([qc.model_dump() for qc in qcs], scope, rules.key)
+    replay = upload_receipt(db, "/extractions/qc", scope, digest, idempotency_key)
+    if replay is not None:
+        return replay
+    
+    # Resolve every referenced aliquot (and its sample) in one IN query
+    aliquot_ids = {qc.aliquot_id for qc in qcs}
+    aliquot_rows = db.query(
+        AliquotModel.id, AliquotModel.sample_id, AliquotModel.extraction_batch_id, AliquotModel.qc_flag
+    ).filter(AliquotModel.id.in_(aliquot_ids)).all() if aliquot_ids else []
+    sample_by_aliquot = {a.id: a.sample_id for a in aliquot_rows}
     
+    # Classify the whole batch
+    flags = rules.dna(
+        [qc.concentration for qc in qcs],
+        [qc.a260_280 for qc in qcs],
+        [qc.a260_230 for qc in qcs]
+    ).tolist()
+    
+    unknown_aliquot_ids = sorted(aliquot_ids - sample_by_aliquot.keys())
+    # Later rows win when an aliquot appears more than once
+    latest = {qc.aliquot_id: (qc, flag) for qc, flag in zip(qcs, flags) if qc.aliquot_id in sample_by_aliquot}
+    
+    # Upsert on aliquot_id, writing only new and changed measurements
+    existing = {row.aliquot_id: row for row in db.execute(
+        select(DNAQCModel.id, DNAQCModel.aliquot_id, DNAQCModel.concentration, DNAQCModel.a260_280,
+               DNAQCModel.a260_230, DNAQCModel.qc_flag)
+        .where(DNAQCModel.aliquot_id.in_(latest))
+    )} if latest else {}
+    inserts, updates = [], []
+    for aliquot_id, (qc, flag) in latest.items():
+        row = {"aliquot_id": aliquot_id, "concentration": qc.concentration, "a260_280": qc.a260_280,
+               "a260_230": qc.a260_230, "qc_flag": flag}
+        old = existing.get(aliquot_id)
+        if old is None:
+            inserts.append(row)
+        elif any(getattr(old, k) != v for k, v in row.items()):
+            updates.append(dict(row, id=old.id))
+    if inserts:
+        now = datetime.utcnow()
+        db.execute(insert(DNAQCModel), [
+            dict(row, id=qc_id, created_at=now) for qc_id, row in zip(ids.next_ids("QC", len(inserts)), inserts)
+        ])
+    if updates:
+        db.execute(update(DNAQCModel), updates)
+    
+    # Aliquots (and their samples) follow only flags that changed
+    current = {a.id: a.qc_flag for a in aliquot_rows}
+    aliquot_flags = {a: flag for a, (qc, flag) in latest.items() if current[a] != flag}
+    for flag in set(aliquot_flags.values()):
+        flagged = [a for a, f in aliquot_flags.items() if f == flag]
+        db.execute(update(AliquotModel).where(AliquotModel.id.in_(flagged)).values(qc_flag=flag))
+        events.publish(db, events.ALIQUOT_QC, {"qc_flag": flag, **events.id_list(flagged)})
+    if aliquot_flags:
+        aggregates.move(db, aggregates.EXTRACTION_QC, [
+            (a.extraction_batch_id, a.qc_flag, aliquot_flags[a.id]) for a in aliquot_rows if a.id in aliquot_flags
+        ])
+        aggregates.move(db, aggregates.ALIQUOT_QC, [
+            ("", a.qc_flag or "Pending", aliquot_flags[a.id]) for a in aliquot_rows if a.id in aliquot_flags
+        ])
+        sample_status.transition_each(db, {
+            sample_by_aliquot[a]: sample_status.DNA_READY if flag in ["Pass", "Warn"] else sample_status.HOLD_FOR_QA
+            for a, flag in aliquot_flags.items()
+        }, "dna_qc")
+    
+    results = [DNAQCResult(
+        aliquot_id=qc.aliquot_id,
+        qc_flag=flag,
+        recorded=qc.aliquot_id in sample_by_aliquot
+    ) for qc, flag in zip(qcs, flags)]
+    response = {
+        "qcs": results,
+        "unknown_aliquot_ids": unknown_aliquot_ids,
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "unchanged": len(latest) - len(inserts) - len(updates)
+    }
+    store_receipt(db, scope, digest, idempotency_key, response, complete=not unknown_aliquot_ids)
     db.commit()
-    return {"qcs": results}
+    return response
+
+def plan_plate(db: Session, payload: PlateCreate) -> PlateLayout:
+    """Build (or take) the plate's wells and validate them against the plate and existing plates"""
+    fmt = plate_layout.PLATE_FORMATS[payload.plate_format]
+    seed = None
+    if payload.assign:
+        spec = payload.assign
+        seed = spec.seed
+        if spec.order == "random" and seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        try:
+            wells = plate_layout.assign(
+                fmt, spec.aliquot_ids, spec.beadchip_barcodes, spec.order,
+                [c.model_dump() for c in spec.controls], seed
+            )
+        except ValueError as e:
+            return PlateLayout(plate_format=fmt.name, seed=seed, wells=[], errors=[str(e)])
+    else:
+        wells = payload.wells
+    wells, errors = plate_layout.validate_wells(fmt, wells)
+
+    # Sentrix positions and aliquots already used on other plates, in one indexed query
+    barcodes = {w["sentrix_barcode"] for w in wells if w.get("sentrix_barcode")}
+    aliquot_ids = {w["aliquot_id"] for w in wells if w.get("aliquot_id")}
+    if barcodes or aliquot_ids:
+        existing = db.execute(
+            select(PlateWellModel.plate_id, PlateWellModel.aliquot_id,
+                   PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position)
+            .where(or_(PlateWellModel.sentrix_barcode.in_(barcodes), PlateWellModel.aliquot_id.in_(aliquot_ids)))
+        ).all()
+        errors += plate_layout.collision_errors(wells, existing)
+    return PlateLayout(plate_format=fmt.name, seed=seed, wells=wells, errors=errors)
+
+@app.post("/plates:layout", response_model=PlateLayout)
+def preview_plate_layout(payload: PlateCreate, db: Session = Depends(get_db)):
+    """Validate (and auto-assign) a plate layout without creating the plate"""
+    return plan_plate(db, payload)
 
 @app.post("/plates", response_model=PlateOut)
 def create_plate(payload: PlateCreate, db: Session = Depends(get_db)):
+    layout = plan_plate(db, payload)
+    wells = layout.wells
+
     # Check consent gate for all aliquots
-    missing_consent = []
-    for well_data in payload.wells:
-        aliquot = db.query(AliquotModel).filter(AliquotModel.id == well_data["aliquot_id"]).first()
-        if aliquot:
-            consent = db.query(ConsentModel).filter(ConsentModel.sample_id == aliquot.sample_id).first()
-            if not consent:
-                missing_consent.append(aliquot.sample_id)
-    
-    if missing_consent:
-        unique_missing = list(set(missing_consent))
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Consent required: sample(s) {', '.join(unique_missing)} missing Consent. Attach via /consents before plating."
-        )
-    
-    # Check for uniqueness violations within this plate
-    sentrix_positions = {}
-    aliquot_wells = {}
-    
-    for well_data in payload.wells:
-        sentrix_key = (well_data["sentrix_barcode"], well_data["sentrix_position"])
-        aliquot_id = well_data["aliquot_id"]
-        well_pos = well_data["well"]
-        
-        if sentrix_key in sentrix_positions:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Duplicate Sentrix position {well_data['sentrix_position']} on plate"
-            )
-        sentrix_positions[sentrix_key] = well_pos
-        
-        if aliquot_id in aliquot_wells:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Aliquot {aliquot_id} already assigned to well {aliquot_wells[aliquot_id]}"
-            )
-        aliquot_wells[aliquot_id] = well_pos
-    
-    plate_count = db.query(PlateModel).count()
+    aliquot_gate = ConsentGate(db).check_aliquots([w["aliquot_id"] for w in wells if w.get("aliquot_id")])
+    aliquot_gate.require_consent("plating")
+
+    if layout.errors:
+        raise HTTPException(status_code=400, detail="; ".join(layout.errors[:MAX_REPORTED_ERRORS]))
+
+    # Wells of unknown aliquots are skipped (and reported), as unknown samples are by /extractions
+    if aliquot_gate.unknown:
+        unknown = set(aliquot_gate.unknown)
+        wells = [w for w in wells if w.get("aliquot_id") not in unknown]
+
     plate = PlateModel(
-        id=f"PLT-{plate_count+1:04d}",
-        name=payload.name
+        id=ids.next_id("PLT"),
+        name=payload.name,
+        plate_format=layout.plate_format,
+        wells_hash=samplesheet.wells_digest(payload.name, [
+            (w["well"], w["aliquot_id"], w["sentrix_barcode"], w["sentrix_position"]) for w in wells
+        ])
     )
     db.add(plate)
-    
-    for well_data in payload.wells:
-        well_count = db.query(PlateWellModel).count()
-        well = PlateWellModel(
-            id=f"WELL-{well_count+1:05d}",
-            plate_id=plate.id,
-            aliquot_id=well_data["aliquot_id"],
-            well=well_data["well"],
-            sentrix_barcode=well_data["sentrix_barcode"],
-            sentrix_position=well_data["sentrix_position"]
-        )
-        db.add(well)
-        
-        # Update sample status to Plated
-        aliquot = db.query(AliquotModel).filter(AliquotModel.id == well_data["aliquot_id"]).first()
-        if aliquot:
-            sample = db.query(SampleModel).filter(SampleModel.id == aliquot.sample_id).first()
-            if sample:
-                sample.status = "Plated"
-    
+
+    well_ids = ids.next_ids("WELL", len(wells))
+    now = datetime.utcnow()
+    db.flush()
+    if wells:
+        db.execute(insert(PlateWellModel), [
+            {
+                "id": well_id,
+                "plate_id": plate.id,
+                "aliquot_id": well_data["aliquot_id"],
+                "well": well_data["well"],
+                "sentrix_barcode": well_data["sentrix_barcode"],
+                "sentrix_position": well_data["sentrix_position"],
+                "created_at": now
+            }
+            for well_data, well_id in zip(wells, well_ids)
+        ])
+    search_index.index_rows(db, "plates", [{"id": plate.id, "name": plate.name}])
+    search_index.index_rows(db, "plate_wells", [{"plate_id": plate.id, **w} for w in wells])
+
+    # Update sample status to Plated (sample IDs come from the gate's memo)
+    sample_status.transition(db, aliquot_gate.sample_ids.values(), sample_status.PLATED, f"plate {plate.id}",
+                             plate_id=plate.id)
+    done = bool(wells) and not pending_plates(db, [plate.id])
+    aggregates.bump(db, aggregates.PLATE_STATUS, {"Done" if done else "Active": 1})
+    response_cache.invalidate(db, response_cache.PLATES)
+    events.publish(db, events.PLATE_CREATED, {"plate_id": plate.id, "name": plate.name, "well_count": len(wells)},
+                   plate_id=plate.id)
+
     db.commit()
     return PlateOut(
         id=plate.id,
         name=plate.name,
-        well_count=len(payload.wells)
+        well_count=len(wells),
+        unknown_aliquot_ids=aliquot_gate.unknown
     )
 
-@app.get("/plates", response_model=List[PlateOut])
-def list_plates(db: Session = Depends(get_db)):
-    plates = db.query(PlateModel).all()
-    return [PlateOut(
-        id=p.id,
-        name=p.name,
-        well_count=len(p.wells)
-    ) for p in plates]
+@app.get("/plates", response_model=Page)
+async def list_plates(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    name: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    key, etag, cached = await cache_lookup_async(request, await db.run_sync(response_cache.tag_versions, [response_cache.PLATES]))
+    if cached:
+        return cached
+    filters = created_range(PlateModel.created_at, created_from, created_to)
+    if name:
+        filters.append(PlateModel.name == name)
+    well_count = (
+        select(func.count(PlateWellModel.id))
+        .where(PlateWellModel.plate_id == PlateModel.id)
+        .scalar_subquery()
+    )
+    return await cache_store_async(key, etag, await paginate_async(db, {
+        "id": PlateModel.id,
+        "name": PlateModel.name,
+        "plate_format": PlateModel.plate_format,
+        "well_count": well_count
+    }, PlateModel.created_at, PlateModel.id, filters, limit, cursor, fields))
+
+# Rendered SampleSheets, keyed by the plates' wells_hash (see samplesheet.py)
+SAMPLESHEET_CACHE_SIZE = int(os.getenv("SAMPLESHEET_CACHE_SIZE", "256"))
+samplesheets = samplesheet.SamplesheetCache(SAMPLESHEET_CACHE_SIZE)
+
+if ("plates", "wells_hash") in new_columns:
+    # Digest the wells of plates created before wells_hash was stored
+    with SessionLocal() as db:
+        names = dict(db.execute(select(PlateModel.id, PlateModel.name)).all())
+        wells = {plate_id: [] for plate_id in names}
+        for row in db.execute(select(
+            PlateWellModel.plate_id, PlateWellModel.well, PlateWellModel.aliquot_id,
+            PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position
+        )):
+            wells.setdefault(row[0], []).append(row[1:])
+        if names:
+            db.execute(update(PlateModel), [
+                {"id": plate_id, "wells_hash": samplesheet.wells_digest(name, wells[plate_id])}
+                for plate_id, name in names.items()
+            ])
+            db.commit()
+
+async def stream_rows(query):
+    """Rows of ``query`` fetched as the response is sent, on a session of their own.
+
+    The request's session is closed before a StreamingResponse body runs.
+    """
+    async with AsyncSessionLocal() as db:
+        async for row in await db.stream(query):
+            yield row
+
+async def samplesheet_response(request: Request, key, digest: Optional[str], query):
+    """Serve a sheet from its ETag (304), the cache, or by streaming ``query``'s rows"""
+    sheet_date = datetime.now().date()
+    etag = samplesheet.etag(digest, sheet_date)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if samplesheet.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    body = samplesheets.get(key, etag)
+    if body is not None:
+        chunks = iter([body])
+    else:
+        chunks = samplesheets.stream(key, etag, samplesheet.render(stream_rows(query), sheet_date))
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8", headers=headers)
 
 @app.get("/plates/{plate_id}/samplesheet", response_class=PlainTextResponse)
-def get_samplesheet(plate_id: str, db: Session = Depends(get_db)):
-    plate = db.query(PlateModel).filter(PlateModel.id == plate_id).first()
+async def get_samplesheet(plate_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Illumina SampleSheet for one plate; supports If-None-Match"""
+    plate = (await db.execute(
+        select(PlateModel.name, PlateModel.wells_hash).where(PlateModel.id == plate_id)
+    )).first()
     if not plate:
         raise HTTPException(status_code=404, detail="Plate not found")
-    
-    # Generate Illumina SampleSheet format
-    samplesheet = "[Header]\n"
-    samplesheet += f"Date,{datetime.now().strftime('%m/%d/%Y')}\n"
-    samplesheet += f"Workflow,GenerateFASTQ\n"
-    samplesheet += f"Application,FASTQ Only\n"
-    samplesheet += f"Instrument Type,iScan\n"
-    samplesheet += f"Assay,Infinium Global Screening Array-24 v3.0\n"
-    samplesheet += f"Index Adapters,Illumina Infinium\n\n"
-    samplesheet += "[Manifests]\n"
-    samplesheet += "A,GSA-24v3-0_A1.bpm\n\n"
-    samplesheet += "[Data]\n"
-    samplesheet += "Sample_ID,SentrixBarcode_A,SentrixPosition_A,Sample_Plate,Sample_Well\n"
-    
-    for well in plate.wells:
-        aliquot = db.query(AliquotModel).filter(AliquotModel.id == well.aliquot_id).first()
-        if aliquot:
-            sample_id = aliquot.sample_id
-            samplesheet += f"{sample_id},{well.sentrix_barcode},{well.sentrix_position},{plate.name},{well.well}\n"
-    
-    return samplesheet
+    query = (
+        select(AliquotModel.sample_id, PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position,
+               PlateModel.name, PlateWellModel.well)
+        .join(AliquotModel, AliquotModel.id == PlateWellModel.aliquot_id)
+        .join(PlateModel, PlateModel.id == PlateWellModel.plate_id)
+        .where(PlateWellModel.plate_id == plate_id)
+        .order_by(PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position, PlateWellModel.well)
+    )
+    return await samplesheet_response(request, ("plate", plate_id), plate.wells_hash, query)
+
+@app.get("/runs/{run_id}/samplesheet", response_class=PlainTextResponse)
+async def get_run_samplesheet(run_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """One SampleSheet covering every plate with wells on the run's BeadChips"""
+    if await db.get(RunModel, run_id) is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    on_run = (
+        select(PlateWellModel.plate_id)
+        .join(BeadChipModel, BeadChipModel.barcode == PlateWellModel.sentrix_barcode)
+        .where(BeadChipModel.run_id == run_id)
+    )
+    plates = (await db.execute(
+        select(PlateModel.id, PlateModel.wells_hash).where(PlateModel.id.in_(on_run))
+    )).all()
+    query = (
+        select(AliquotModel.sample_id, PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position,
+               PlateModel.name, PlateWellModel.well)
+        .join(AliquotModel, AliquotModel.id == PlateWellModel.aliquot_id)
+        .join(PlateModel, PlateModel.id == PlateWellModel.plate_id)
+        .join(BeadChipModel, BeadChipModel.barcode == PlateWellModel.sentrix_barcode)
+        .where(BeadChipModel.run_id == run_id)
+        .order_by(PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position)
+    )
+    digest = samplesheet.combined_digest([(p.id, p.wells_hash) for p in plates])
+    return await samplesheet_response(request, ("run", run_id), digest, query)
+
+def pending_plates(db: Session, plate_ids: Optional[List[str]] = None) -> set:
+    """Plates (of ``plate_ids``, or all) with a well whose BeadChip is not on a Completed run"""
+    completed_barcodes = (
+        select(BeadChipModel.barcode)
+        .join(RunModel, RunModel.id == BeadChipModel.run_id)
+        .where(RunModel.status == "Completed")
+    )
+    query = select(PlateWellModel.plate_id).where(PlateWellModel.sentrix_barcode.not_in(completed_barcodes)).distinct()
+    if plate_ids is not None:
+        query = query.where(PlateWellModel.plate_id.in_(plate_ids))
+    return set(db.scalars(query))
+
+def complete_run(db: Session, run: RunModel):
+    """Mark a run Completed and retire the plates it finishes from the active count"""
+    if run.status == "Completed":
+        return
+    aggregates.move(db, aggregates.RUN_STATUS, [("", run.status, "Completed")])
+    response_cache.invalidate(db, response_cache.RUNS)
+    events.publish(db, events.RUN_STATUS, {"run_id": run.id, "status": "Completed"}, run_id=run.id)
+    run.status = "Completed"
+    db.flush()
+    plate_ids = list(db.scalars(
+        select(PlateWellModel.plate_id)
+        .join(BeadChipModel, BeadChipModel.barcode == PlateWellModel.sentrix_barcode)
+        .where(BeadChipModel.run_id == run.id)
+        .distinct()
+    ))
+    done = len(plate_ids) - len(pending_plates(db, plate_ids)) if plate_ids else 0
+    aggregates.bump(db, aggregates.PLATE_STATUS, {"Active": -done, "Done": done})
 
 @app.post("/runs", response_model=RunOut)
 def create_run(payload: RunCreate, db: Session = Depends(get_db)):
-    run_count = db.query(RunModel).count()
     run = RunModel(
-        id=f"RUN-{run_count+1:04d}",
+        id=ids.next_id("RUN"),
         run_name=payload.run_name,
         run_date=payload.run_date,
         status="Created"
     )
     db.add(run)
     
-    for barcode in payload.beadchip_barcodes:
-        chip_count = db.query(BeadChipModel).count()
+    chip_ids = ids.next_ids("CHIP", len(payload.beadchip_barcodes))
+    for barcode, chip_id in zip(payload.beadchip_barcodes, chip_ids):
         chip = BeadChipModel(
-            id=f"CHIP-{chip_count+1:04d}",
+            id=chip_id,
             run_id=run.id,
             barcode=barcode
         )
         db.add(chip)
+    aggregates.bump(db, aggregates.RUN_STATUS, {run.status: 1})
+    response_cache.invalidate(db, response_cache.RUNS)
+    events.publish(db, events.RUN_STATUS, {"run_id": run.id, "status": run.status, "run_name": run.run_name},
+                   run_id=run.id)
+    search_index.index_rows(db, "runs", [{"id": run.id, "run_name": run.run_name}])
+    search_index.index_rows(db, "beadchips", [{"run_id": run.id, "barcode": b} for b in payload.beadchip_barcodes])
     
     db.commit()
     return RunOut(
@@ -603,71 +1527,347 @@ def create_run(payload: RunCreate, db: Session = Depends(get_db)):
         beadchip_count=len(payload.beadchip_barcodes)
     )
 
-@app.get("/runs", response_model=List[RunOut])
-def list_runs(db: Session = Depends(get_db)):
-    runs = db.query(RunModel).all()
-    return [RunOut(
-        id=r.id,
-        run_name=r.run_name,
-        run_date=r.run_date,
-        status=r.status,
-        beadchip_count=len(r.beadchips)
-    ) for r in runs]
+@app.get("/runs", response_model=Page)
+async def list_runs(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    run_date_from: Optional[datetime] = None,
+    run_date_to: Optional[datetime] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    key, etag, cached = await cache_lookup_async(request, await db.run_sync(response_cache.tag_versions, [response_cache.RUNS]))
+    if cached:
+        return cached
+    filters = created_range(RunModel.created_at, created_from, created_to)
+    filters += created_range(RunModel.run_date, run_date_from, run_date_to)
+    if status:
+        filters.append(RunModel.status.in_(split_values(status)))
+    beadchip_count = (
+        select(func.count(BeadChipModel.id))
+        .where(BeadChipModel.run_id == RunModel.id)
+        .scalar_subquery()
+    )
+    return await cache_store_async(key, etag, await paginate_async(db, {
+        "id": RunModel.id,
+        "run_name": RunModel.run_name,
+        "run_date": RunModel.run_date,
+        "status": RunModel.status,
+        "beadchip_count": beadchip_count
+    }, RunModel.created_at, RunModel.id, filters, limit, cursor, fields))
+
+default_rules = qc_profiles.compiled()
+if ("genotype_metrics", "qc_flag") in new_columns:
+    # Band metrics stored before qc_flag was persisted, in one statement
+    with engine.begin() as conn:
+        conn.execute(
+            update(GenotypeMetricsModel)
+            .where(GenotypeMetricsModel.qc_flag.is_(None))
+            .values(
+                qc_flag=default_rules.genotype_sql(GenotypeMetricsModel.call_rate, GenotypeMetricsModel.dish_qc),
+                qc_threshold_version=default_rules.key
+            )
+        )
+
+METRIC_FIELDS = ("call_rate", "dish_qc", "heterozygosity", "sex_call", "sex_concordance", "qc_flag", "qc_threshold_version")
+
+def upsert_metrics(db: Session, run_id: str, rows: List[Dict[str, Any]]):
+    """Insert or update banded metrics rows keyed on (run_id, sample_id), later rows winning;
+    unchanged rows are not written. Returns the rows written with their previous qc_flag,
+    and the inserted/updated/unchanged counts."""
+    latest = {r["sample_id"]: r for r in rows}
+    existing = {row.sample_id: row for row in db.execute(
+        select(GenotypeMetricsModel.id, GenotypeMetricsModel.sample_id,
+               *[getattr(GenotypeMetricsModel, f) for f in METRIC_FIELDS])
+        .where(GenotypeMetricsModel.run_id == run_id, GenotypeMetricsModel.sample_id.in_(latest))
+    )} if latest else {}
+    inserts, updates, written = [], [], []
+    for sample_id, r in latest.items():
+        values = {f: r[f] for f in METRIC_FIELDS}
+        old = existing.get(sample_id)
+        if old is None:
+            inserts.append(dict(values, run_id=run_id, sample_id=sample_id))
+            written.append((r, None))
+        elif any(getattr(old, f) != v for f, v in values.items()):
+            updates.append(dict(values, id=old.id))
+            written.append((r, old.qc_flag))
+    if inserts:
+        now = datetime.utcnow()
+        db.execute(insert(GenotypeMetricsModel), [dict(row, created_at=now) for row in inserts])
+    if updates:
+        db.execute(update(GenotypeMetricsModel), updates)
+    aggregates.move(db, aggregates.RUN_QC, [(run_id, old, r["qc_flag"]) for r, old in written])
+    counts = {"inserted": len(inserts), "updated": len(updates), "unchanged": len(latest) - len(written)}
+    return written, counts
+
+def genotype_targets(written) -> Dict[str, str]:
+    """Sample status for the written metrics rows whose flag changed"""
+    return {
+        r["sample_id"]: sample_status.GENOTYPED if r["qc_flag"] in ["Pass", "Warn"] else sample_status.HOLD_FOR_QA
+        for r, old in written if r["qc_flag"] != old
+    }
+
+def analyze_run(db: Session, run_id: str) -> Dict[str, Any]:
+    """Recompute and store a run's outlier analytics from its metrics and Sentrix layout"""
+    placed = (
+        select(AliquotModel.sample_id, PlateWellModel.plate_id, PlateModel.plate_format, PlateWellModel.well,
+               PlateWellModel.sentrix_barcode, PlateWellModel.sentrix_position)
+        .join(PlateWellModel, PlateWellModel.aliquot_id == AliquotModel.id)
+        .join(PlateModel, PlateModel.id == PlateWellModel.plate_id)
+        .join(BeadChipModel, BeadChipModel.barcode == PlateWellModel.sentrix_barcode)
+        .where(BeadChipModel.run_id == run_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(GenotypeMetricsModel.sample_id, GenotypeMetricsModel.call_rate, GenotypeMetricsModel.heterozygosity,
+               GenotypeMetricsModel.sex_call, GenotypeMetricsModel.sex_concordance, placed.c.plate_id,
+               placed.c.plate_format, placed.c.well, placed.c.sentrix_barcode, placed.c.sentrix_position)
+        .outerjoin(placed, placed.c.sample_id == GenotypeMetricsModel.sample_id)
+        .where(GenotypeMetricsModel.run_id == run_id)
+        .order_by(GenotypeMetricsModel.id)
+    ).all()
+    columns = dict(zip(run_analytics.COLUMNS, zip(*rows))) if rows else {c: () for c in run_analytics.COLUMNS}
+    result = run_analytics.analyze(run_id, columns)
+    run_analytics.store(db, run_id, result)
+    events.publish(db, events.RUN_ANALYTICS, {
+        "run_id": run_id, "samples": result["samples"], "outliers": len(result["outliers"])
+    }, run_id=run_id)
+    return result
 
 @app.post("/runs/{run_id}/metrics")
-def upload_metrics(run_id: str, metrics: List[MetricsIn], db: Session = Depends(get_db)):
+def upload_metrics(run_id: str, metrics: List[MetricsIn], profile: Optional[str] = None,
+                   idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    rules = resolve_rules(profile)
+    scope = metrics_scope(run_id)
+    digest = idempotency.payload_hash([m.model_dump() for m in metrics], scope, rules.key)
+    replay = upload_receipt(db, "/runs/{run_id}/metrics", scope, digest, idempotency_key)
+    if replay is not None:
+        return replay
     run = db.query(RunModel).filter(RunModel.id == run_id).first()
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
-    processed = 0
-    qc_results = []
+    flags = rules.genotype([m.call_rate for m in metrics], [m.dish_qc for m in metrics]).tolist()
+    written, counts = upsert_metrics(db, run_id, [
+        dict(metric.model_dump(), qc_flag=qc_flag, qc_threshold_version=rules.key)
+        for metric, qc_flag in zip(metrics, flags)
+    ])
+    if written:
+        events.publish(db, events.RUN_QC, {"run_id": run_id, "metrics": len(metrics), **counts,
+                                           "summary": Counter(flags)}, run_id=run_id)
+        analyze_run(db, run_id)
+
+    # Update sample status based on QC (later rows win for repeated samples)
+    sample_status.transition_each(db, genotype_targets(written), f"run {run_id}", run_id=run_id)
+
+    processed = len(metrics)
+    qc_results = [{
+        "sample_id": metric.sample_id,
+        "qc_flag": qc_flag,
+        "call_rate": metric.call_rate,
+        "dish_qc": metric.dish_qc
+    } for metric, qc_flag in zip(metrics, flags)]
+
+    complete_run(db, run)
+    response = {
+        "run_id": run_id, 
+        "metrics_processed": processed,
+        **counts,
+        "qc_results": qc_results
+    }
+    store_receipt(db, scope, digest, idempotency_key, response)
+    db.commit()
+    return response
+
+@app.post("/runs/{run_id}/metrics/file")
+def upload_metrics_file(run_id: str, file: UploadFile = File(...), profile: Optional[str] = None,
+                        idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Import a CSV/TSV or GenomeStudio metrics file in committed chunks (upserted like JSON uploads)
+
+    A file that turns out to be malformed part-way through returns 400 with
+    the chunks that were already committed; the run is completed and
+    analysed for them as for a full upload.
+    """
+    rules = resolve_rules(profile)
+    scope = metrics_scope(run_id)
+    digest = idempotency.file_hash(file.file, scope, rules.key)
+    replay = upload_receipt(db, "/runs/{run_id}/metrics/file", scope, digest, idempotency_key)
+    if replay is not None:
+        return replay
+    run = db.query(RunModel).filter(RunModel.id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
     
-    for metric in metrics:
-        # Updated genotype QC banding rules
-        if metric.call_rate < 0.97 or metric.dish_qc < DISHQC_MIN:
-            qc_flag = "Fail"
-        elif 0.97 <= metric.call_rate < CALLRATE_MIN and metric.dish_qc >= DISHQC_MIN:
-            qc_flag = "Warn"
-        elif metric.call_rate >= CALLRATE_MIN and metric.dish_qc >= DISHQC_MIN:
-            qc_flag = "Pass"
-        else:
-            qc_flag = "Fail"  # fallback
-        
-        # Save metrics
-        genotype_metric = GenotypeMetricsModel(
-            run_id=run_id,
-            sample_id=metric.sample_id,
-            call_rate=metric.call_rate,
-            dish_qc=metric.dish_qc,
-            heterozygosity=metric.heterozygosity,
-            sex_call=metric.sex_call,
-            sex_concordance=metric.sex_concordance
-        )
-        db.add(genotype_metric)
-        
-        # Update sample status based on QC
-        sample = db.query(SampleModel).filter(SampleModel.id == metric.sample_id).first()
-        if sample:
-            if qc_flag in ["Pass", "Warn"]:
-                sample.status = "Genotyped"
-            else:
-                sample.status = "Hold for QA"
-        
-        qc_results.append({
-            "sample_id": metric.sample_id,
-            "qc_flag": qc_flag,
-            "call_rate": metric.call_rate,
-            "dish_qc": metric.dish_qc
+    try:
+        file_format, rows = iter_metrics(file.file)
+    except MetricsFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    totals = {"Pass": 0, "Warn": 0, "Fail": 0}
+    chunks = []
+    errors = []
+    unknown_sample_ids = []
+    rows_read = 0
+    
+    try:
+        for chunk_no, chunk in enumerate(chunked(rows, METRICS_CHUNK_ROWS), start=1):
+            rows_read += len(chunk)
+            valid = []
+            chunk_errors = 0
+            for line_no, row, error in chunk:
+                if error:
+                    chunk_errors += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": line_no, "error": error})
+                else:
+                    valid.append(row)
+            
+            # One IN query per chunk instead of one lookup per row
+            known = {sid for (sid,) in db.query(SampleModel.id).filter(
+                SampleModel.id.in_({r["sample_id"] for r in valid})
+            )} if valid else set()
+            unknown = [r["sample_id"] for r in valid if r["sample_id"] not in known]
+            unknown_sample_ids.extend(unknown[:MAX_REPORTED_ERRORS - len(unknown_sample_ids)])
+            valid = [r for r in valid if r["sample_id"] in known]
+            
+            counts = {"Pass": 0, "Warn": 0, "Fail": 0}
+            flags = rules.genotype([r["call_rate"] for r in valid], [r["dish_qc"] for r in valid]).tolist()
+            for r, qc_flag in zip(valid, flags):
+                r["qc_flag"] = qc_flag
+                r["qc_threshold_version"] = rules.key
+                counts[qc_flag] += 1
+            
+            written, upserted = upsert_metrics(db, run_id, valid)
+            if written:
+                events.publish(db, events.RUN_QC, {"run_id": run_id, "metrics": len(valid), **upserted,
+                                                   "summary": counts}, run_id=run_id)
+                sample_status.transition_each(db, genotype_targets(written), f"run {run_id}", run_id=run_id)
+            db.commit()
+            
+            for flag, n in counts.items():
+                totals[flag] += n
+            chunks.append({
+                "chunk": chunk_no,
+                "rows": len(chunk),
+                **upserted,
+                "errors": chunk_errors,
+                "unknown_samples": len(unknown),
+                **counts
+            })
+    except MetricsFileError as e:
+        if not chunks:
+            raise HTTPException(status_code=400, detail=str(e))
+        failure = e
+    else:
+        failure = None
+    
+    # Also for a file that failed part-way: the committed chunks complete and re-analyse the run
+    metrics_processed = sum(c["inserted"] + c["updated"] + c["unchanged"] for c in chunks)
+    if metrics_processed:
+        complete_run(db, run)
+    if any(c["inserted"] or c["updated"] for c in chunks):
+        analyze_run(db, run_id)
+    if failure is not None:
+        db.commit()
+        raise HTTPException(status_code=400, detail={
+            "error": str(failure),
+            "rows_committed": rows_read,
+            "committed_chunks": chunks,
+            "unknown_sample_ids": unknown_sample_ids
         })
-        processed += 1
+    response = {
+        "run_id": run_id,
+        "format": file_format,
+        "rows_read": rows_read,
+        "metrics_processed": metrics_processed,
+        "summary": totals,
+        "chunks": chunks,
+        "errors": errors,
+        "unknown_sample_ids": unknown_sample_ids
+    }
+    store_receipt(db, scope, digest, idempotency_key, response,
+                  complete=not any(c["unknown_samples"] for c in chunks))
+    db.commit()
+    return response
+
+@app.get("/runs/{run_id}/analytics")
+async def get_run_analytics(run_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Outlier analytics stored by the run's last metrics upload"""
+    stored = await db.run_sync(run_analytics.read, run_id)
+    if stored is None:
+        if await db.get(RunModel, run_id) is None:
+            raise HTTPException(status_code=404, detail="Run not found")
+        raise HTTPException(status_code=404, detail="No analytics for this run; upload metrics or rebuild them")
+    return Response(stored, media_type="application/json")
+
+@app.post("/runs/{run_id}/analytics:rebuild")
+def rebuild_run_analytics(run_id: str, db: Session = Depends(get_db)):
+    """Recompute a run's analytics (runs uploaded before analytics existed, or after plate changes)"""
+    if db.get(RunModel, run_id) is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    result = analyze_run(db, run_id)
+    db.commit()
+    return result
+
+@app.post("/runs/{run_id}/qc/reband")
+def reband_run(run_id: str, profile: Optional[str] = None, db: Session = Depends(get_db)):
+    """Re-band all stored metrics of a run against a QC profile in one pass"""
+    run = db.query(RunModel).filter(RunModel.id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    rules = resolve_rules(profile)
     
-    run.status = "Completed"
+    rows = db.execute(
+        select(GenotypeMetricsModel.id, GenotypeMetricsModel.sample_id, GenotypeMetricsModel.call_rate,
+               GenotypeMetricsModel.dish_qc, GenotypeMetricsModel.qc_flag)
+        .where(GenotypeMetricsModel.run_id == run_id)
+        .order_by(GenotypeMetricsModel.id)
+    ).all()
+    if not rows:
+        return {"run_id": run_id, "profile": rules.key, "metrics": 0, "changed": 0, "summary": {}}
+    
+    metric_ids, sample_ids, call_rates, dish_qcs, old_flags = zip(*rows)
+    flags = rules.genotype(call_rates, dish_qcs)
+    changed = np.flatnonzero(flags != np.asarray(old_flags, dtype=object))
+    
+    db.execute(
+        update(GenotypeMetricsModel)
+        .where(GenotypeMetricsModel.run_id == run_id)
+        .values(qc_threshold_version=rules.key)
+    )
+    # The last upload's receipt no longer describes the run's flags
+    idempotency.forget(db, metrics_scope(run_id))
+    if len(changed):
+        db.execute(update(GenotypeMetricsModel), [
+            {"id": metric_ids[i], "qc_flag": str(flags[i])} for i in changed
+        ])
+        aggregates.move(db, aggregates.RUN_QC, [(run_id, old_flags[i], str(flags[i])) for i in changed])
+        events.publish(db, events.RUN_QC, {
+            "run_id": run_id, "profile": rules.key, "changed": len(changed),
+            **events.id_list([sample_ids[i] for i in changed]),
+        }, run_id=run_id)
+        # Only samples still at the genotyping stage follow their new flag
+        targets = {
+            sample_ids[i]: sample_status.GENOTYPED if flags[i] in ("Pass", "Warn") else sample_status.HOLD_FOR_QA
+            for i in changed
+        }
+        sample_status.transition_each(
+            db, targets, f"reband {rules.key}", only_from=[sample_status.GENOTYPED, sample_status.HOLD_FOR_QA],
+            run_id=run_id,
+        )
     db.commit()
+    
+    values, counts = np.unique(flags, return_counts=True)
     return {
-        "run_id": run_id, 
-        "metrics_processed": processed,
-        "qc_results": qc_results
+        "run_id": run_id,
+        "profile": rules.key,
+        "metrics": len(rows),
+        "changed": int(len(changed)),
+        "summary": {str(v): int(c) for v, c in zip(values, counts)}
     }
 
 @app.post("/runs/{run_id}/prs_package", response_model=PRSJobOut)
@@ -677,73 +1877,28 @@ def create_prs_package(run_id: str, payload: PRSJobCreate, db: Session = Depends
         raise HTTPException(status_code=404, detail="Run not found")
     
     # Check for eligible samples (Pass/Warn only)
-    metrics = db.query(GenotypeMetricsModel).filter(GenotypeMetricsModel.run_id == run_id).all()
-    eligible_metrics = []
-    
-    for m in metrics:
-        # Apply same QC banding logic to determine if Pass/Warn
-        if m.call_rate < 0.97 or m.dish_qc < DISHQC_MIN:
-            qc_flag = "Fail"
-        elif 0.97 <= m.call_rate < CALLRATE_MIN and m.dish_qc >= DISHQC_MIN:
-            qc_flag = "Warn"
-        elif m.call_rate >= CALLRATE_MIN and m.dish_qc >= DISHQC_MIN:
-            qc_flag = "Pass"
-        else:
-            qc_flag = "Fail"
-            
-        if qc_flag in ["Pass", "Warn"]:
-            eligible_metrics.append((m, qc_flag))
-    
-    if not eligible_metrics:
+    eligible = db.query(exists().where(
+        GenotypeMetricsModel.run_id == run_id,
+        GenotypeMetricsModel.qc_flag.in_(["Pass", "Warn"])
+    )).scalar()
+    if not eligible:
         raise HTTPException(
             status_code=400, 
             detail="No Pass/Warn samples available for PRS"
         )
     
-    job_count = db.query(PRSJobModel).count()
+    # Package generation runs on the job workers; the job commits with the PRS record
     job = PRSJobModel(
-        id=f"PRS-{job_count+1:04d}",
+        id=ids.next_id("PRS"),
         run_id=run_id,
         job_name=payload.job_name,
-        status="Processing"
+        status="Queued"
     )
     db.add(job)
-    db.commit()
-    
-    # Simulate package creation (in real system, this would be async)
-    output_dir = Path(f"/tmp/prs_output/{job.id}")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Create samples.tsv (only eligible samples)
-    samples_file = output_dir / "samples.tsv"
-    with open(samples_file, "w") as f:
-        f.write("sample_id\tsubject_pseudoid\tstatus\tfinal_qc_flag\n")
-        for m, qc_flag in eligible_metrics:
-            sample = db.query(SampleModel).filter(SampleModel.id == m.sample_id).first()
-            if sample:
-                f.write(f"{sample.id}\t{sample.subject_pseudoid}\t{sample.status}\t{qc_flag}\n")
-    
-    # Create metrics.tsv (only eligible samples)
-    metrics_file = output_dir / "metrics.tsv"
-    with open(metrics_file, "w") as f:
-        f.write("sample_id\tcall_rate\tdish_qc\theterozygosity\tsex_call\tfinal_qc_flag\n")
-        for m, qc_flag in eligible_metrics:
-            f.write(f"{m.sample_id}\t{m.call_rate}\t{m.dish_qc}\t{m.heterozygosity or 'NA'}\t{m.sex_call or 'NA'}\t{qc_flag}\n")
-    
-    # Create manifest.md
-    manifest_file = output_dir / "manifest.md"
-    with open(manifest_file, "w") as f:
-        f.write(f"# PRS Package Manifest\n\n")
-        f.write(f"Job ID: {job.id}\n")
-        f.write(f"Run ID: {run_id}\n")
-        f.write(f"Created: {datetime.utcnow().isoformat()}\n")
-        f.write(f"Total Samples: {len(metrics)}\n")
-        f.write(f"Eligible Samples (Pass/Warn): {len(eligible_metrics)}\n")
-        f.write(f"Pass: {sum(1 for _, qc in eligible_metrics if qc == 'Pass')}\n")
-        f.write(f"Warn: {sum(1 for _, qc in eligible_metrics if qc == 'Warn')}\n")
-    
-    job.status = "Completed"
-    job.output_path = str(output_dir)
+    aggregates.bump(db, aggregates.PRS_STATUS, {job.status: 1})
+    response_cache.invalidate(db, response_cache.PRS_JOBS)
+    events.publish(db, events.PRS_JOB_STATUS, {"job_id": job.id, "run_id": run_id, "status": job.status}, run_id=run_id)
+    job_queue.enqueue(db, "prs_package", prs_jobs.HANDLER, {"job_id": job.id}, ref=job.id)
     db.commit()
     
     return PRSJobOut(
@@ -754,13 +1909,180 @@ def create_prs_package(run_id: str, payload: PRSJobCreate, db: Session = Depends
         output_path=job.output_path
     )
 
-@app.get("/prs_jobs", response_model=List[PRSJobOut])
-def list_prs_jobs(db: Session = Depends(get_db)):
-    jobs = db.query(PRSJobModel).all()
-    return [PRSJobOut(
-        id=j.id,
-        run_id=j.run_id,
-        job_name=j.job_name,
-        status=j.status,
-        output_path=j.output_path
-    ) for j in jobs]
\ No newline at end of file
+@app.get("/prs_jobs/{job_id}", response_model=PRSJobStatus)
+async def get_prs_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = await db.get(PRSJobModel, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="PRS job not found")
+    queued = await db.run_sync(job_queue.job_for_ref, job.id)
+    return PRSJobStatus(
+        id=job.id,
+        run_id=job.run_id,
+        job_name=job.job_name,
+        status=job.status,
+        output_path=job.output_path,
+        attempts=queued["attempts"] if queued else 0,
+        error=queued["error"] if queued else None
+    )
+
+@app.get("/prs_jobs", response_model=Page)
+async def list_prs_jobs(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    run_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    key, etag, cached = await cache_lookup_async(request, await db.run_sync(response_cache.tag_versions, [response_cache.PRS_JOBS]))
+    if cached:
+        return cached
+    filters = created_range(PRSJobModel.created_at, created_from, created_to)
+    if status:
+        filters.append(PRSJobModel.status.in_(split_values(status)))
+    if run_id:
+        filters.append(PRSJobModel.run_id == run_id)
+    return await cache_store_async(key, etag, await paginate_async(db, {
+        "id": PRSJobModel.id,
+        "run_id": PRSJobModel.run_id,
+        "job_name": PRSJobModel.job_name,
+        "status": PRSJobModel.status,
+        "output_path": PRSJobModel.output_path
+    }, PRSJobModel.created_at, PRSJobModel.id, filters, limit, cursor, fields))
+
+@app.get("/prs_jobs/{job_id}/package")
+def download_prs_package(job_id: str, db: Session = Depends(get_db)):
+    """Stream a completed PRS package as a tar archive"""
+    job = db.query(PRSJobModel).filter(PRSJobModel.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="PRS job not found")
+    if job.status != "Completed" or not job.output_path or not Path(job.output_path).is_dir():
+        raise HTTPException(status_code=409, detail=f"PRS package {job_id} is not available (status {job.status})")
+    return StreamingResponse(
+        stream_tar(Path(job.output_path), job.id),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{job.id}.tar"'}
+    )
+
+def rebuild_stats(db: Session):
+    """Recompute every dashboard counter from the base tables"""
+    counts = {
+        aggregates.SAMPLE_STATUS: {("", s): n for s, n in db.execute(
+            select(SampleModel.status, func.count()).group_by(SampleModel.status))},
+        aggregates.RUN_STATUS: {("", s): n for s, n in db.execute(
+            select(RunModel.status, func.count()).group_by(RunModel.status))},
+        aggregates.PRS_STATUS: {("", s): n for s, n in db.execute(
+            select(PRSJobModel.status, func.count()).group_by(PRSJobModel.status))},
+        aggregates.RUN_QC: {(r, f): n for r, f, n in db.execute(
+            select(GenotypeMetricsModel.run_id, GenotypeMetricsModel.qc_flag, func.count())
+            .where(GenotypeMetricsModel.qc_flag.is_not(None))
+            .group_by(GenotypeMetricsModel.run_id, GenotypeMetricsModel.qc_flag))},
+        aggregates.EXTRACTION_QC: {(b, f): n for b, f, n in db.execute(
+            select(AliquotModel.extraction_batch_id, AliquotModel.qc_flag, func.count())
+            .where(AliquotModel.qc_flag.is_not(None))
+            .group_by(AliquotModel.extraction_batch_id, AliquotModel.qc_flag))},
+        aggregates.ALIQUOT_QC: {("", f or "Pending"): n for f, n in db.execute(
+            select(AliquotModel.qc_flag, func.count()).group_by(AliquotModel.qc_flag))},
+    }
+
+    plates = db.scalar(select(func.count(PlateModel.id)))
+    done = len(set(db.scalars(select(PlateWellModel.plate_id).distinct())) - pending_plates(db))
+    counts[aggregates.PLATE_STATUS] = {("", "Active"): plates - done, ("", "Done"): done}
+
+    # Turnaround from receipt to each sample's first move to Genotyped
+    history = sample_status.status_history
+    first_genotyped = (
+        select(history.c.sample_id, func.min(history.c.changed_at).label("genotyped_at"))
+        .where(history.c.to_status == sample_status.GENOTYPED)
+        .group_by(history.c.sample_id)
+        .subquery()
+    )
+    histogram, total = aggregates.turnaround_deltas(
+        (genotyped_at - created_at).total_seconds()
+        for created_at, genotyped_at in db.execute(
+            select(SampleModel.created_at, first_genotyped.c.genotyped_at)
+            .join(first_genotyped, first_genotyped.c.sample_id == SampleModel.id)
+            .where(SampleModel.created_at.is_not(None))
+        )
+    )
+    counts[aggregates.TURNAROUND] = {("", b): n for b, n in histogram.items()}
+    counts[aggregates.TURNAROUND_SECONDS] = {("", "sum"): total}
+    aggregates.replace(db, counts)
+
+if search_missing:
+    # Index the entities created before the search index existed
+    with engine.begin() as conn:
+        search_index.rebuild(conn)
+
+with engine.connect() as conn:
+    # Databases counted before the lab-wide aliquot QC counter existed
+    aliquots_uncounted = not aggregates.read(conn, aggregates.ALIQUOT_QC) and conn.scalar(select(AliquotModel.id).limit(1)) is not None
+
+if stats_missing or duplicates_removed or aliquots_uncounted:
+    # Counters start from the existing rows of databases created before stat_counts
+    # (or are recounted after duplicate uploads were removed)
+    with SessionLocal() as db:
+        rebuild_stats(db)
+        db.commit()
+
+def read_stats(db: Session, run_ids: Optional[List[str]] = None, batch_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    def lab_wide(metric):
+        return aggregates.read(db, metric, [""]).get("", {})
+
+    by_status = lab_wide(aggregates.SAMPLE_STATUS)
+    aliquots = lab_wide(aggregates.ALIQUOT_QC)
+    runs = lab_wide(aggregates.RUN_STATUS)
+    plates = lab_wide(aggregates.PLATE_STATUS)
+    prs_jobs = lab_wide(aggregates.PRS_STATUS)
+    histogram = lab_wide(aggregates.TURNAROUND)
+    genotyped = sum(histogram.values())
+    total_seconds = lab_wide(aggregates.TURNAROUND_SECONDS).get("sum", 0)
+    return {
+        "samples": {"total": sum(by_status.values()), "by_status": by_status},
+        "aliquots": {"total": sum(aliquots.values()), "by_qc_flag": aliquots},
+        "plates": {"total": sum(plates.values()), "active": plates.get("Active", 0)},
+        "runs": {"total": sum(runs.values()), "by_status": runs},
+        "prs_jobs": {"total": sum(prs_jobs.values()), "by_status": prs_jobs},
+        "qc": {
+            "runs": aggregates.read(db, aggregates.RUN_QC, run_ids),
+            "extraction_batches": aggregates.read(db, aggregates.EXTRACTION_QC, batch_ids),
+        },
+        "turnaround": {
+            "samples": genotyped,
+            "mean_hours": round(total_seconds / genotyped / 3600, 1) if genotyped else None,
+            "histogram": [{"bucket": b, "count": histogram.get(b, 0)} for b in aggregates.TURNAROUND_BUCKETS],
+        },
+    }
+
+@app.get("/stats")
+async def get_stats(run_id: Optional[str] = None, extraction_batch_id: Optional[str] = None,
+                    db: AsyncSession = Depends(get_async_db)):
+    """Dashboard counters (maintained on write), optionally limited to some runs / extraction batches"""
+    return await db.run_sync(
+        read_stats,
+        split_values(run_id) if run_id else None,
+        split_values(extraction_batch_id) if extraction_batch_id else None
+    )
+
+@app.get("/dashboard/stats")
+async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
+    """Summary cards of the web dashboard"""
+    stats = await db.run_sync(read_stats, [], [])
+    runs = stats["runs"]["by_status"]
+    prs_jobs = stats["prs_jobs"]["by_status"]
+    return {
+        "samples": {"total": stats["samples"]["total"], "byStatus": stats["samples"]["by_status"]},
+        "plates": stats["plates"],
+        "runs": {"total": stats["runs"]["total"], "inProgress": stats["runs"]["total"] - runs.get("Completed", 0)},
+        "prsJobs": {"total": stats["prs_jobs"]["total"], "pending": prs_jobs.get("Queued", 0) + prs_jobs.get("Processing", 0)},
+    }
+
+@app.post("/stats:rebuild")
+def rebuild_stats_endpoint(db: Session = Depends(get_db)):
+    """Recompute the counters from the base tables (after manual data fixes)"""
+    rebuild_stats(db)
+    db.commit()
+    return read_stats(db)
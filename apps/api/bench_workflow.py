@@ -0,0 +1,492 @@
+"""End-to-end workflow benchmark against a seeded database.
+
+A template SQLite database is seeded once with synthetic history
+(``--samples`` samples spread over ``--runs`` completed runs, plus a
+fraction still in intake/extraction), then each client count runs in a
+fresh process on a copy of it: every client repeatedly takes ``--batch``
+new samples through kit -> sample -> consent -> extraction -> DNA QC ->
+plate -> run -> SampleSheet -> metrics -> PRS package, with dashboard and
+list reads in between, through the ASGI app in-process (sync endpoints run
+on the threadpool as they do under uvicorn). Queued PRS packages are built
+at the end.
+
+    python bench_workflow.py --samples 10000 --runs 100 --clients 1 8 --rounds 5
+    python bench_workflow.py --baseline bench_baseline.json           # exit 1 on regression
+    python bench_workflow.py --write-baseline bench_baseline.json
+    python bench_workflow.py --url http://localhost:8000 --clients 16  # a running server
+
+Per endpoint it reports calls, errors, throughput, p50/p99 latency and SQL
+statements per call (``X-Query-Count``; start a server under test with
+``QUERY_COUNT_HEADER=true``). Statement counts are compared against the
+baseline closely, latency and throughput with ``--tolerance`` (p50 for
+endpoints called at least ``MIN_TIMED_CALLS`` times, p99 from
+``MIN_P99_CALLS``); timings in a baseline are only meaningful on the
+machine that wrote it.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+SEED_CHUNK_ROWS = 50000
+# Endpoints called fewer times than this are compared on SQL counts and errors only
+MIN_TIMED_CALLS = 20
+# Below this many calls p99 is just the slowest call; only p50 is compared
+MIN_P99_CALLS = 100
+# Latency changes smaller than this are noise whatever the tolerance
+MIN_LATENCY_DELTA_MS = 10
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class Recorder:
+    """Latency and SQL statement count per named endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name, request, expect=(200,)):
+        start = time.perf_counter()
+        response = await request
+        self.latencies[name].append(time.perf_counter() - start)
+        if "x-query-count" in response.headers:
+            self.statements[name].append(int(response.headers["x-query-count"]))
+        if response.status_code not in expect:
+            self.errors[name] += 1
+            raise RuntimeError(f"{name} -> {response.status_code}: {response.text[:200]}")
+        return response
+
+    def record(self, name, seconds, statements=None):
+        self.latencies[name].append(seconds)
+        if statements is not None:
+            self.statements[name].append(statements)
+
+    def summary(self, elapsed):
+        out = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[name])
+            statements = self.statements[name]
+            out[name] = {
+                "calls": len(latencies),
+                "errors": self.errors[name],
+                "per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+                "p50_ms": round(1000 * _percentile(latencies, 0.5), 2) if latencies else None,
+                "p99_ms": round(1000 * _percentile(latencies, 0.99), 2) if latencies else None,
+                "sql_mean": round(sum(statements) / len(statements), 2) if statements else None,
+                "sql_max": max(statements) if statements else None,
+            }
+        return out
+
+
+# Seeding
+
+def seed(samples: int, runs: int, in_progress: float, rng_seed: int) -> dict:
+    """Insert synthetic history directly with Core executemany (IDs continue from it)."""
+    import numpy as np
+    from sqlalchemy import insert
+
+    import app
+    import plate_layout
+    import sample_status
+    import samplesheet
+
+    rng = np.random.default_rng(rng_seed)
+    now = datetime.utcnow()
+    fmt = plate_layout.PLATE_FORMATS["96"]
+    well_order = fmt.order("column_major")
+    rules = app.default_rules
+    done = samples - int(samples * in_progress)
+    counts = defaultdict(int)
+
+    def insert_rows(conn, model, rows):
+        table = getattr(model, "__table__", model)
+        for i in range(0, len(rows), SEED_CHUNK_ROWS):
+            conn.execute(insert(table), rows[i:i + SEED_CHUNK_ROWS])
+        counts[table.name] += len(rows)
+
+    def intake_rows(numbers, stages, created):
+        """kits, samples, consents, extraction batches, aliquots and DNA QC for sample ``numbers``"""
+        rows = defaultdict(list)
+        statuses = [sample_status.RECEIVED, sample_status.ACCESSIONED, sample_status.EXTRACTION, sample_status.DNA_READY]
+        concentration = rng.uniform(25, 80, len(numbers))
+        batch_id = None
+        for i, (n, stage, at) in enumerate(zip(numbers.tolist(), stages.tolist(), created)):
+            sid = f"SAMP-{n:05d}"
+            rows["kits"].append({"id": f"KIT-{n:04d}", "qr_code": f"QR-{n:04d}", "clinic_id": f"BENCH-{n % 10}",
+                                 "status": "Allocated", "created_at": at})
+            rows["samples"].append({"id": sid, "kit_qr": f"QR-{n:04d}", "sample_type": "Saliva",
+                                    "subject_pseudoid": f"SUBJ-{n:07d}", "collection_datetime": at - timedelta(days=1),
+                                    "status": statuses[min(stage, 3)], "created_at": at})
+            if stage >= 1:
+                consent_no = counts["consents"] + len(rows["consents"]) + 1
+                rows["consents"].append({"id": f"CONS-{consent_no:04d}", "sample_id": sid, "consent_type": "General",
+                                         "consent_date": at, "created_at": at})
+            if stage >= 2:
+                if batch_id is None or len(rows["aliquots"]) % fmt.size == 0:
+                    batch_id = f"EXT-{counts['extraction_batches'] + len(rows['extraction_batches']) + 1:04d}"
+                    rows["extraction_batches"].append({"id": batch_id, "batch_date": at, "created_at": at})
+                rows["aliquots"].append({"id": f"{sid}-A01", "sample_id": sid, "extraction_batch_id": batch_id,
+                                         "label": "Aliquot 1", "qc_flag": None, "created_at": at})
+            if stage >= 3:
+                rows["dna_qc"].append({"aliquot_id": f"{sid}-A01", "concentration": float(concentration[i]),
+                                       "a260_280": 1.9, "a260_230": 2.0, "created_at": at})
+        if rows["dna_qc"]:
+            flags = rules.dna([r["concentration"] for r in rows["dna_qc"]], [1.9] * len(rows["dna_qc"]),
+                              [2.0] * len(rows["dna_qc"])).tolist()
+            by_aliquot = {}
+            for k, (row, flag) in enumerate(zip(rows["dna_qc"], flags)):
+                row.update(id=f"QC-{counts['dna_qc'] + k + 1:05d}", qc_flag=flag)
+                by_aliquot[row["aliquot_id"]] = flag
+            for aliquot in rows["aliquots"]:
+                aliquot["qc_flag"] = by_aliquot.get(aliquot["id"])
+        return rows
+
+    def write_intake(conn, rows):
+        for model in (app.KitModel, app.SampleModel, app.ConsentModel, app.ExtractionBatchModel,
+                      app.AliquotModel, app.DNAQCModel):
+            insert_rows(conn, model, rows[model.__tablename__])
+
+    # Completed runs: every sample went all the way through
+    per_run = np.array_split(np.arange(1, done + 1), max(runs, 1))
+    chip_no = 0
+    for run_index, numbers in enumerate(per_run):
+        if not len(numbers):
+            continue
+        run_at = now - timedelta(days=float(rng.uniform(1, 60)))
+        created = [run_at - timedelta(days=float(d)) for d in rng.uniform(2, 30, len(numbers))]
+        rows = intake_rows(numbers, np.full(len(numbers), 4), created)
+        run_id = f"RUN-{run_index + 1:04d}"
+        rows["runs"].append({"id": run_id, "run_name": f"Bench run {run_index + 1}", "run_date": run_at,
+                             "status": "Completed", "created_at": run_at})
+        for start in range(0, len(numbers), fmt.size):
+            plate_numbers = numbers[start:start + fmt.size]
+            plate_id = f"PLT-{counts['plates'] + len(rows['plates']) + 1:04d}"
+            ranks = np.arange(len(plate_numbers))
+            barcodes = [f"{200000000000 + chip_no + k}" for k in range(math.ceil(len(plate_numbers) / plate_layout.BEADCHIP_SIZE))]
+            chip_no += len(barcodes)
+            wells = [(fmt.well_name(int(well_order[r])), f"SAMP-{n:05d}-A01", barcodes[r // plate_layout.BEADCHIP_SIZE],
+                      plate_layout.sentrix_position(r % plate_layout.BEADCHIP_SIZE))
+                     for r, n in zip(ranks.tolist(), plate_numbers.tolist())]
+            name = f"BENCH-P{counts['plates'] + len(rows['plates']) + 1}"
+            rows["plates"].append({"id": plate_id, "name": name, "plate_format": fmt.name,
+                                   "wells_hash": samplesheet.wells_digest(name, wells), "created_at": run_at})
+            for well, aliquot_id, barcode, position in wells:
+                rows["plate_wells"].append({"id": f"WELL-{counts['plate_wells'] + len(rows['plate_wells']) + 1:05d}",
+                                            "plate_id": plate_id, "aliquot_id": aliquot_id, "well": well,
+                                            "sentrix_barcode": barcode, "sentrix_position": position, "created_at": run_at})
+            rows["beadchips"].extend({"id": f"CHIP-{counts['beadchips'] + len(rows['beadchips']) + 1:04d}",
+                                      "run_id": run_id, "barcode": b, "created_at": run_at} for b in barcodes)
+
+        call_rates = np.clip(rng.normal(0.99, 0.008, len(numbers)), 0.9, 1.0)
+        dish_qcs = np.clip(rng.normal(0.9, 0.05, len(numbers)), 0.5, 1.0)
+        flags = rules.genotype(call_rates, dish_qcs).tolist()
+        sexes = rng.choice(["M", "F"], len(numbers)).tolist()
+        heterozygosity = rng.normal(0.3, 0.02, len(numbers))
+        for i, n in enumerate(numbers.tolist()):
+            sid = f"SAMP-{n:05d}"
+            genotyped = flags[i] in ("Pass", "Warn")
+            rows["samples"][i]["status"] = sample_status.GENOTYPED if genotyped else sample_status.HOLD_FOR_QA
+            rows["genotype_metrics"].append({"run_id": run_id, "sample_id": sid, "call_rate": float(call_rates[i]),
+                                             "dish_qc": float(dish_qcs[i]), "heterozygosity": float(heterozygosity[i]),
+                                             "sex_call": sexes[i], "sex_concordance": "Match", "qc_flag": flags[i],
+                                             "qc_threshold_version": rules.key, "created_at": run_at})
+            if genotyped:
+                rows["history"].append({"sample_id": sid, "from_status": sample_status.PLATED,
+                                        "to_status": sample_status.GENOTYPED, "reason": f"run {run_id}",
+                                        "changed_at": run_at})
+        rows["prs_jobs"].append({"id": f"PRS-{run_index + 1:04d}", "run_id": run_id, "job_name": f"Bench {run_id}",
+                                 "status": "Completed", "created_at": run_at})
+
+        with app.engine.begin() as conn:
+            write_intake(conn, rows)
+            for model in (app.PlateModel, app.PlateWellModel, app.RunModel, app.BeadChipModel,
+                          app.GenotypeMetricsModel, app.PRSJobModel):
+                insert_rows(conn, model, rows[model.__tablename__])
+            insert_rows(conn, sample_status.status_history, rows["history"])
+
+    # Samples still in intake / extraction / DNA QC
+    pending = np.arange(done + 1, samples + 1)
+    for start in range(0, len(pending), SEED_CHUNK_ROWS):
+        numbers = pending[start:start + SEED_CHUNK_ROWS]
+        created = [now - timedelta(days=float(d)) for d in rng.uniform(0, 3, len(numbers))]
+        with app.engine.begin() as conn:
+            write_intake(conn, intake_rows(numbers, rng.integers(0, 4, len(numbers)), created))
+
+    with app.SessionLocal() as db:
+        app.rebuild_stats(db)
+        db.commit()
+    return dict(counts)
+
+
+# Load
+
+async def _client(http, client_no: int, rounds: int, batch: int, rec: Recorder):
+    for round_no in range(rounds):
+        try:
+            sample_ids = []
+            for _ in range(batch):
+                kit = (await rec.call("POST /kits", http.post("/kits", json={"clinic_id": "BENCH"}))).json()
+                sample = (await rec.call("POST /samples", http.post("/samples", json={
+                    "kit_qr": kit["qr_code"],
+                    "sample_type": "Saliva",
+                    "subject_pseudoid": f"LOAD-{client_no}",
+                    "collection_datetime": "2025-01-01T00:00:00",
+                }))).json()
+                await rec.call("POST /consents", http.post("/consents", json={"sample_id": sample["id"]}))
+                sample_ids.append(sample["id"])
+
+            extraction = (await rec.call("POST /extractions", http.post("/extractions", json={"sample_ids": sample_ids}))).json()
+            aliquot_ids = [a["id"] for a in extraction["aliquots"]]
+            await rec.call("POST /extractions/qc", http.post("/extractions/qc", json=[
+                {"aliquot_id": a, "concentration": 40.0, "a260_280": 1.9, "a260_230": 2.0} for a in aliquot_ids
+            ]))
+
+            chips = math.ceil(batch / 24)
+            barcodes = [f"9{client_no:03d}{round_no:04d}{k:04d}" for k in range(chips)]
+            plate = (await rec.call("POST /plates", http.post("/plates", json={
+                "name": f"LOAD-{client_no}-{round_no}",
+                "plate_format": "96" if batch <= 96 else "384",
+                "assign": {"aliquot_ids": aliquot_ids, "beadchip_barcodes": barcodes},
+            }))).json()
+            run = (await rec.call("POST /runs", http.post("/runs", json={
+                "run_name": f"LOAD-{client_no}-{round_no}", "beadchip_barcodes": barcodes
+            }))).json()
+            await rec.call("GET /plates/{plate_id}/samplesheet", http.get(f"/plates/{plate['id']}/samplesheet"))
+            await rec.call("GET /runs/{run_id}/samplesheet", http.get(f"/runs/{run['id']}/samplesheet"))
+            await rec.call("POST /runs/{run_id}/metrics", http.post(f"/runs/{run['id']}/metrics", json=[
+                {"sample_id": sid, "call_rate": 0.985 + 0.0005 * (i % 20), "dish_qc": 0.9, "heterozygosity": 0.3,
+                 "sex_call": "F"} for i, sid in enumerate(sample_ids)
+            ]))
+            job = (await rec.call("POST /runs/{run_id}/prs_package", http.post(
+                f"/runs/{run['id']}/prs_package", json={"job_name": f"LOAD-{client_no}-{round_no}"}
+            ))).json()
+            await rec.call("GET /prs_jobs/{job_id}", http.get(f"/prs_jobs/{job['id']}"))
+
+            # What the dashboard and list pages load
+            await rec.call("GET /dashboard/stats", http.get("/dashboard/stats"))
+            await rec.call("GET /stats", http.get(f"/stats?run_id={run['id']}"))
+            await rec.call("GET /samples", http.get("/samples?limit=100&status=Genotyped"))
+            await rec.call("GET /runs", http.get("/runs?limit=100"))
+            await rec.call("GET /plates", http.get("/plates?limit=100"))
+        except RuntimeError:
+            continue
+
+
+async def _load(http, clients: int, rounds: int, batch: int, rec: Recorder) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(http, c, rounds, batch, rec) for c in range(clients)])
+    return time.perf_counter() - start
+
+
+def _build_packages(rec: Recorder) -> float:
+    """Run the queued PRS jobs in this process, timing each one."""
+    import app
+    import job_queue
+    import query_stats
+
+    start = time.perf_counter()
+    while True:
+        job_start = time.perf_counter()
+        with query_stats.count_queries() as queries:
+            ran = job_queue.run_one(app.engine, "bench")
+        if not ran:
+            return time.perf_counter() - start
+        rec.record("job prs_package", time.perf_counter() - job_start, queries.count)
+
+
+def _worker(clients: int, rounds: int, batch: int) -> dict:
+    import httpx
+    import app
+
+    rec = Recorder()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            return await _load(http, clients, rounds, batch, rec)
+
+    elapsed = asyncio.run(run())
+    app.writes.stop()
+    build_elapsed = _build_packages(rec)
+    endpoints = rec.summary(elapsed)
+    if "job prs_package" in endpoints:
+        endpoints["job prs_package"]["per_second"] = round(endpoints["job prs_package"]["calls"] / build_elapsed, 1)
+    samples = len(rec.latencies["POST /samples"])
+    return {
+        "clients": clients,
+        "rounds": rounds,
+        "batch": batch,
+        "seconds": round(elapsed, 3),
+        "samples_per_second": round(samples / elapsed, 1) if elapsed else None,
+        "errors": sum(rec.errors.values()),
+        "endpoints": endpoints,
+    }
+
+
+def _remote(url: str, clients: int, rounds: int, batch: int) -> dict:
+    import httpx
+
+    rec = Recorder()
+
+    async def run():
+        async with httpx.AsyncClient(base_url=url, timeout=None) as http:
+            return await _load(http, clients, rounds, batch, rec)
+
+    elapsed = asyncio.run(run())
+    return {
+        "clients": clients,
+        "rounds": rounds,
+        "batch": batch,
+        "seconds": round(elapsed, 3),
+        "samples_per_second": round(len(rec.latencies["POST /samples"]) / elapsed, 1) if elapsed else None,
+        "errors": sum(rec.errors.values()),
+        "endpoints": rec.summary(elapsed),
+    }
+
+
+def _subprocess(env: dict, *args) -> dict:
+    out = subprocess.run(
+        [sys.executable, __file__, *args],
+        env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if out.returncode != 0:
+        sys.stderr.write(out.stderr)
+        raise SystemExit(f"benchmark worker failed: {' '.join(args)}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+# Baseline comparison
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """Regressions of ``results`` against a baseline written by ``--write-baseline``."""
+    expected = {r["clients"]: r for r in baseline["results"]}
+    problems = []
+    for result in results:
+        base = expected.get(result["clients"])
+        if base is None:
+            continue
+        if result["samples_per_second"] and base["samples_per_second"] \
+                and result["samples_per_second"] < base["samples_per_second"] * (1 - tolerance):
+            problems.append(f"{result['clients']} client(s): {result['samples_per_second']} samples/s "
+                            f"(baseline {base['samples_per_second']})")
+        for name, now in result["endpoints"].items():
+            was = base["endpoints"].get(name)
+            if was is None:
+                continue
+            where = f"{result['clients']} client(s) {name}"
+            if now["errors"] > was["errors"]:
+                problems.append(f"{where}: {now['errors']} errors (baseline {was['errors']})")
+            if now["sql_mean"] is not None and was["sql_mean"] is not None and now["sql_mean"] > was["sql_mean"] * 1.1 + 0.5:
+                problems.append(f"{where}: {now['sql_mean']} SQL statements per call (baseline {was['sql_mean']})")
+            if min(now["calls"], was["calls"]) < MIN_TIMED_CALLS:
+                continue
+            keys = ("p50_ms", "p99_ms") if min(now["calls"], was["calls"]) >= MIN_P99_CALLS else ("p50_ms",)
+            for key in keys:
+                if now[key] is not None and was[key] is not None and now[key] > max(was[key] * (1 + tolerance), was[key] + MIN_LATENCY_DELTA_MS):
+                    problems.append(f"{where}: {key} {now[key]} (baseline {was[key]})")
+            if now["per_second"] and was["per_second"] and now["per_second"] < was["per_second"] * (1 - tolerance):
+                problems.append(f"{where}: {now['per_second']}/s (baseline {was['per_second']}/s)")
+    return problems
+
+
+def _print(results: list, seeded: dict):
+    if seeded:
+        print("seeded: " + ", ".join(f"{k}={v}" for k, v in sorted(seeded.items())))
+    for r in results:
+        print(f"\n{r['clients']} client(s), {r['rounds']} round(s) x {r['batch']} samples: "
+              f"{r['seconds']} s, {r['samples_per_second']} samples/s, {r['errors']} errors")
+        print(f"  {'endpoint':<36}{'calls':>7}{'errors':>7}{'per s':>9}{'p50 ms':>9}{'p99 ms':>9}{'sql':>7}{'sql max':>8}")
+        for name, e in r["endpoints"].items():
+            print(f"  {name:<36}{e['calls']:>7}{e['errors']:>7}{str(e['per_second']):>9}{str(e['p50_ms']):>9}"
+                  f"{str(e['p99_ms']):>9}{str(e['sql_mean']):>7}{str(e['sql_max']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=10000, help="samples to seed before the load")
+    parser.add_argument("--runs", type=int, default=100, help="completed runs the seeded samples are spread over")
+    parser.add_argument("--in-progress", type=float, default=0.1, help="fraction of seeded samples still before plating")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--rounds", type=int, default=5, help="workflow rounds per client")
+    parser.add_argument("--batch", type=int, default=24, help="samples per round (24 = one BeadChip)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="drive a running server instead of the in-process app (no seeding)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--baseline", help="compare against this baseline; exit 1 on regression")
+    parser.add_argument("--write-baseline", help="write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed latency / throughput change vs baseline")
+    parser.add_argument("--seed-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_worker:
+        print(json.dumps(seed(args.samples, args.runs, args.in_progress, args.seed)))
+        return
+    if args.worker:
+        print(json.dumps(_worker(args.clients[0], args.rounds, args.batch)))
+        return
+
+    seeded = {}
+    if args.url:
+        results = [_remote(args.url, clients, args.rounds, args.batch) for clients in args.clients]
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            base_env = {**os.environ, "PRS_WORKERS": "0", "QUERY_COUNT_HEADER": "true"}
+            template = os.path.join(tmp, "seed.db")
+            seeded = _subprocess(
+                {**base_env, "DATABASE_URL": f"sqlite:///{template}"}, "--seed-worker",
+                "--samples", str(args.samples), "--runs", str(args.runs),
+                "--in-progress", str(args.in_progress), "--seed", str(args.seed),
+            )
+            results = []
+            for clients in args.clients:
+                db_path = os.path.join(tmp, f"bench-{clients}.db")
+                shutil.copyfile(template, db_path)
+                results.append(_subprocess(
+                    {**base_env, "DATABASE_URL": f"sqlite:///{db_path}", "PRS_OUTPUT_DIR": os.path.join(tmp, f"prs-{clients}")},
+                    "--worker", "--clients", str(clients), "--rounds", str(args.rounds), "--batch", str(args.batch),
+                ))
+                os.remove(db_path)
+
+    report = {
+        "config": {k: getattr(args, k) for k in ("samples", "runs", "in_progress", "rounds", "batch", "seed", "url")},
+        "seeded": seeded,
+        "results": results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print(results, seeded)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differs = [k for k, v in baseline.get("config", {}).items() if report["config"].get(k) != v]
+        if differs:
+            print(f"warning: baseline was written with different {', '.join(differs)}", file=sys.stderr)
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
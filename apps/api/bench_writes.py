@@ -0,0 +1,121 @@
+"""Write throughput of small accessioning requests under concurrent clients.
+
+Each configuration runs in a fresh process against a fresh SQLite file:
+``N`` concurrent clients each create a kit, a sample for it and a consent,
+through the ASGI app in-process (sync endpoints run on the threadpool as
+they do under uvicorn).
+
+    python bench_writes.py --clients 1 8 32 --rounds 50
+
+Configurations compared:
+
+- ``baseline``: SQLite defaults (rollback journal, synchronous=FULL), no write queue
+- ``pragmas``: WAL + synchronous=NORMAL + cache/mmap/busy timeout
+- ``pragmas+queue``: pragmas plus the group-commit write queue
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIGS = {
+    "baseline": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_MMAP_SIZE": "",
+        "SQLITE_CACHE_SIZE_KB": "",
+        "SQLITE_BUSY_TIMEOUT_MS": "30000",  # without it the baseline simply errors out
+        "WRITE_QUEUE": "false",
+    },
+    "pragmas": {"WRITE_QUEUE": "false"},
+    "pragmas+queue": {"WRITE_QUEUE": "true"},
+}
+
+
+async def _client(http, rounds: int, latencies: list, errors: list):
+    for _ in range(rounds):
+        start = time.perf_counter()
+        r = await http.post("/kits", json={"clinic_id": "BENCH"})
+        if r.status_code != 200:
+            errors.append(r.status_code)
+            continue
+        r = await http.post("/samples", json={
+            "kit_qr": r.json()["qr_code"],
+            "sample_type": "Saliva",
+            "subject_pseudoid": "BENCH",
+            "collection_datetime": "2025-01-01T00:00:00",
+        })
+        if r.status_code != 200:
+            errors.append(r.status_code)
+            continue
+        r = await http.post("/consents", json={"sample_id": r.json()["id"]})
+        if r.status_code != 200:
+            errors.append(r.status_code)
+        latencies.append(time.perf_counter() - start)
+
+
+async def _load(clients: int, rounds: int) -> dict:
+    import httpx
+    import app
+
+    latencies: list = []
+    errors: list = []
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[_client(http, rounds, latencies, errors) for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+    app.writes.stop()
+    latencies.sort()
+    writes = 3 * len(latencies)
+    return {
+        "clients": clients,
+        "writes": writes,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "writes_per_second": round(writes / elapsed, 1),
+        "p50_ms": round(1000 * latencies[len(latencies) // 2], 1) if latencies else None,
+        "p99_ms": round(1000 * latencies[int(len(latencies) * 0.99)], 1) if latencies else None,
+        "group_commits": app.writes.commits,
+    }
+
+
+def _run_config(name: str, clients: int, rounds: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, **CONFIGS[name], "DATABASE_URL": f"sqlite:///{tmp}/bench.db", "PRS_WORKERS": "0"}
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", "--clients", str(clients), "--rounds", str(rounds)],
+            env=env, capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    return {"config": name, **json.loads(out.stdout.strip().splitlines()[-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=50, help="kit+sample+consent rounds per client")
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(_load(args.clients[0], args.rounds))))
+        return
+
+    results = [_run_config(name, clients, args.rounds) for clients in args.clients for name in args.configs]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'config':<15}{'clients':>8}{'writes':>8}{'errors':>8}{'writes/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'commits':>9}")
+    for r in results:
+        print(f"{r['config']:<15}{r['clients']:>8}{r['writes']:>8}{r['errors']:>8}{r['writes_per_second']:>10}"
+              f"{r['p50_ms']:>9}{r['p99_ms']:>9}{r['group_commits']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Engine construction for the sync and async database layers.
+
+Both engines share one pool configuration:
+
+- ``DB_POOL_SIZE`` / ``DB_MAX_OVERFLOW``: persistent and burst connections
+- ``DB_POOL_TIMEOUT``: seconds to wait for a free connection
+- ``DB_POOL_RECYCLE``: seconds after which a connection is replaced
+- ``DB_POOL_PRE_PING``: test connections before handing them out
+- ``DB_STATEMENT_TIMEOUT_MS``: abort statements running longer than this
+  (``statement_timeout`` on Postgres; a progress handler on sync SQLite
+  connections, where aiosqlite connections are not covered)
+
+The async engine uses aiosqlite for ``sqlite://`` URLs and asyncpg for
+``postgresql://`` URLs.
+
+SQLite connections get a production pragma profile on connect (set a
+variable to an empty string to leave that pragma at SQLite's default):
+
+- ``SQLITE_JOURNAL_MODE`` (WAL): readers no longer block the writer
+- ``SQLITE_SYNCHRONOUS`` (NORMAL): fsync at checkpoints, not every commit
+- ``SQLITE_MMAP_SIZE`` (256 MiB) and ``SQLITE_CACHE_SIZE_KB`` (64 MiB)
+- ``SQLITE_BUSY_TIMEOUT_MS`` (5000): wait for the write lock instead of
+  failing with ``database is locked``
+
+``upsert`` is the one INSERT ... ON CONFLICT DO UPDATE used by the side
+tables (counters, cache tags, upload receipts, run analytics); other
+dialects fall back to UPDATE, then INSERT where nothing matched.
+"""
+import os
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+from sqlalchemy import Table, create_engine, event, insert, literal, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+SQLITE_CACHE_SIZE_KB = os.getenv("SQLITE_CACHE_SIZE_KB", "65536")
+SQLITE_PRAGMAS = [
+    ("journal_mode", os.getenv("SQLITE_JOURNAL_MODE", "WAL")),
+    ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),
+    ("mmap_size", os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    ("cache_size", f"-{SQLITE_CACHE_SIZE_KB}" if SQLITE_CACHE_SIZE_KB else ""),  # negative = KiB
+    ("busy_timeout", os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    ("temp_store", "MEMORY"),
+]
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _pool_kwargs(url: str) -> dict:
+    if is_sqlite(url) and make_url(url).database in (None, "", ":memory:"):
+        return {}  # in-memory SQLite uses a single shared connection
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _install_sqlite_pragmas(engine: Engine):
+    pragmas = [(name, value) for name, value in SQLITE_PRAGMAS if value]
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _install_sqlite_statement_timeout(engine: Engine, timeout_ms: int):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        deadline = record.info["statement_deadline"] = [None]
+        dbapi_conn.set_progress_handler(
+            lambda: 1 if deadline[0] is not None and time.monotonic() > deadline[0] else 0,
+            10000,
+        )
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.connection.info.get("statement_deadline")
+        if deadline is not None:
+            deadline[0] = time.monotonic() + timeout_ms / 1000
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.connection.info.get("statement_deadline")
+        if deadline is not None:
+            deadline[0] = None
+
+
+def make_engine(url: str) -> Engine:
+    connect_args = {}
+    if is_sqlite(url):
+        connect_args["check_same_thread"] = False
+    elif DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    engine = create_engine(url, connect_args=connect_args, **_pool_kwargs(url))
+    if is_sqlite(url):
+        _install_sqlite_pragmas(engine)
+        if DB_STATEMENT_TIMEOUT_MS:
+            _install_sqlite_statement_timeout(engine, DB_STATEMENT_TIMEOUT_MS)
+    return engine
+
+
+def make_async_engine(url: str) -> AsyncEngine:
+    connect_args = {}
+    kwargs = _pool_kwargs(url)
+    if is_sqlite(url):
+        if kwargs:
+            # aiosqlite defaults to NullPool (a new connection per checkout)
+            kwargs["poolclass"] = AsyncAdaptedQueuePool
+    elif DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    engine = create_async_engine(async_url(url), connect_args=connect_args, **kwargs)
+    if is_sqlite(url):
+        _install_sqlite_pragmas(engine.sync_engine)
+    return engine
+
+
+def dialect_name(conn) -> str:
+    """Dialect of a Connection or Session."""
+    bind = conn if hasattr(conn, "dialect") else conn.get_bind()
+    return bind.dialect.name
+
+
+class _Proposed:
+    """The row being inserted, as bound values; stands in for ``excluded`` without ON CONFLICT."""
+
+    def __init__(self, table: Table, row: Mapping[str, Any]):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, name: str):
+        return literal(self._row[name], self._table.c[name].type)
+
+    def __getattr__(self, name: str):
+        return self[name]
+
+
+def upsert(conn, table: Table, keys: Sequence[str], rows: List[Dict[str, Any]],
+           set_: Optional[Callable[[Any], Mapping[str, Any]]] = None):
+    """Insert ``rows``, updating those whose ``keys`` columns already exist.
+
+    ``set_`` is given the proposed row (``excluded``) and returns the values
+    to set on conflict, e.g. ``lambda new: {"value": t.c.value + new.value}``;
+    by default every other column of the row is overwritten. ``conn`` is a
+    Connection or Session; the caller commits.
+    """
+    if not rows:
+        return
+    columns = [c for c in rows[0] if c not in keys]
+    set_ = set_ or (lambda new: {c: new[c] for c in columns})
+    dialect = dialect_name(conn)
+    if dialect in ("sqlite", "postgresql"):
+        ins = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(table)
+        conn.execute(ins.on_conflict_do_update(
+            index_elements=[table.c[k] for k in keys], set_=set_(ins.excluded)
+        ), rows)
+        return
+    for row in rows:
+        where = [table.c[k] == row[k] for k in keys]
+        if conn.execute(update(table).where(*where).values(set_(_Proposed(table, row)))).rowcount == 0:
+            conn.execute(insert(table), row)
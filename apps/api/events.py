@@ -0,0 +1,349 @@
+"""Change events for ``GET /events`` (server-sent events).
+
+Writers record an event in the same transaction as the change it
+describes, like the cache tags and dashboard counters:
+
+    events.publish(db, events.RUN_STATUS, {"run_id": run.id, "status": "Completed"}, run_id=run.id)
+
+so an event becomes visible exactly when its change commits, whichever
+process made it (API workers, PRS job workers), and never for a change that
+rolled back. The ``events`` table is also the replay log: its ``id`` is the
+SSE event ID, which a reconnecting EventSource sends back as
+``Last-Event-ID``.
+
+``EventBus`` fans events out inside one API process. A single poller task
+reads new rows (one indexed query per ``poll_interval`` while anyone is
+subscribed, none otherwise) and is woken right after local commits that
+published events, so an open but idle tab costs a parked coroutine and a
+heartbeat comment every ``heartbeat`` seconds. Each subscriber has a
+bounded queue: a client too slow to drain it is disconnected instead of
+buffered without limit, and replays what it missed when it reconnects. A
+cursor older than the retained events (or more than ``replay_limit``
+behind) gets a ``reset`` event instead, telling the client to refetch.
+
+Events are read in ID order, but on PostgreSQL IDs are taken at INSERT
+and become visible at COMMIT, so a transaction open for longer than
+``settle`` commits an event below the cursor. The poller remembers the
+IDs it stepped over and looks for them on every poll for ``late``
+seconds; one that shows up is delivered then, carrying the current
+cursor as its SSE ID so ``Last-Event-ID`` never moves backwards. (A
+client reconnecting in between replays it from the table if it is
+above its cursor.) SQLite commits one writer at a time, so its gaps are
+rolled-back IDs and are not tracked.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, delete, event, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("lims.events")
+
+SAMPLE_STATUS = "sample.status"
+ALIQUOT_QC = "aliquot.qc"
+PLATE_CREATED = "plate.created"
+RUN_STATUS = "run.status"
+RUN_QC = "run.qc"
+RUN_ANALYTICS = "run.analytics"
+PRS_JOB_STATUS = "prs_job.status"
+TOPICS = (SAMPLE_STATUS, ALIQUOT_QC, PLATE_CREATED, RUN_STATUS, RUN_QC, RUN_ANALYTICS, PRS_JOB_STATUS)
+
+MAX_EVENT_IDS = 500  # larger ID lists are replaced by a count; clients refetch
+MAX_LATE_IDS = 10000  # skipped IDs tracked at once; the oldest are given up first
+
+metadata = MetaData()
+
+events = Table(
+    "events",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("topic", String, nullable=False),
+    Column("run_id", String, nullable=True),
+    Column("plate_id", String, nullable=True),
+    Column("data", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_events_run_id", "run_id"),
+    Index("ix_events_plate_id", "plate_id"),
+    Index("ix_events_created_at", "created_at"),
+    sqlite_autoincrement=True,  # IDs are cursors: never reuse one after pruning
+)
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def id_list(ids: Sequence[str]) -> Dict:
+    """``{"ids": [...], "count": n}``, without the list when it is longer than MAX_EVENT_IDS."""
+    ids = list(ids)
+    return {"ids": ids if len(ids) <= MAX_EVENT_IDS else None, "count": len(ids)}
+
+
+def publish(conn, topic: str, data: Dict, run_id: Optional[str] = None, plate_id: Optional[str] = None):
+    """Record an event; ``conn`` is a Connection or Session, the caller commits."""
+    conn.execute(insert(events).values(
+        topic=topic, run_id=run_id, plate_id=plate_id, data=json.dumps(data, default=str),
+        created_at=datetime.utcnow(),
+    ))
+    if isinstance(conn, Session):
+        conn.info["events_published"] = True  # see EventBus.watch_commits
+
+
+def topic_matches(topic: str, wanted: Sequence[str]) -> bool:
+    """``run`` selects ``run.status`` and ``run.qc``; ``run.qc`` only itself."""
+    return not wanted or any(topic == w or topic.startswith(w + ".") for w in wanted)
+
+
+class Filter:
+    def __init__(self, topics: Sequence[str] = (), run_ids: Sequence[str] = (), plate_ids: Sequence[str] = ()):
+        self.topics = list(topics)
+        self.run_ids = set(run_ids)
+        self.plate_ids = set(plate_ids)
+
+    def matches(self, row) -> bool:
+        if self.run_ids and row["run_id"] not in self.run_ids:
+            return False
+        if self.plate_ids and row["plate_id"] not in self.plate_ids:
+            return False
+        return topic_matches(row["topic"], self.topics)
+
+    def where(self) -> list:
+        clauses = []
+        if self.run_ids:
+            clauses.append(events.c.run_id.in_(sorted(self.run_ids)))
+        if self.plate_ids:
+            clauses.append(events.c.plate_id.in_(sorted(self.plate_ids)))
+        return clauses
+
+
+def format_event(row, event_id: Optional[int] = None) -> str:
+    """SSE text of an event row; ``event_id`` overrides the ID line (late events keep the cursor)."""
+    created_at = row["created_at"]
+    data = {"topic": row["topic"], "run_id": row["run_id"], "plate_id": row["plate_id"],
+            "created_at": created_at.isoformat() if created_at else None, **json.loads(row["data"])}
+    return f"id: {row['id'] if event_id is None else event_id}\nevent: {row['topic']}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def format_control(name: str, data: Dict, event_id: Optional[int] = None) -> str:
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class _Subscriber:
+    def __init__(self, filter: Filter, queue_size: int):
+        self.filter = filter
+        self.queue: "asyncio.Queue" = asyncio.Queue(queue_size)
+        self.lagged = False
+
+
+class EventBus:
+    def __init__(self, engine: AsyncEngine, poll_interval: float = 1.0, heartbeat: float = 15.0,
+                 queue_size: int = 256, replay_limit: int = 1000, retention: float = 86400.0,
+                 settle: float = 2.0, late: float = 600.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.replay_limit = replay_limit
+        self.retention = retention
+        self.settle = settle  # how long an ID gap may stay open (uncommitted writer) before it is skipped
+        self.late = late  # how long skipped IDs are looked for afterwards
+        self.track_late = engine.dialect.name != "sqlite"
+        self.late_delivered = 0
+        self._late: Dict[int, float] = {}  # skipped ID -> monotonic deadline
+        self.delivered = 0
+        self.dropped = 0
+        self._subscribers: List[_Subscriber] = []
+        self._cursor = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def watch_commits(self, session_factory):
+        """Wake the poller after commits of ``session_factory`` sessions that published events."""
+        def after_commit(session):
+            if session.info.pop("events_published", False):
+                self.wake()
+        event.listen(session_factory, "after_commit", after_commit)
+
+    def wake(self):
+        """Thread-safe: poll now instead of at the next interval."""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run(), name="lims-events")
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._loop = None
+
+    async def _latest_id(self) -> int:
+        async with self.engine.connect() as conn:
+            return (await conn.execute(select(func.max(events.c.id)))).scalar() or 0
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval if self._subscribers else 60.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # With nobody listening there is nothing to read; the next
+                # subscriber starts from the latest event
+                if self._subscribers and await self._poll():
+                    # A full page: let subscribers drain their queues before the next one
+                    await asyncio.sleep(0.01)
+                    self._wakeup.set()
+                if time.monotonic() - self._pruned_at > 60:
+                    await self._prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Polling the events table failed")
+
+    async def _poll(self) -> bool:
+        """Deliver new events; True if there may be more to read."""
+        page = self.queue_size
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(
+                select(events).where(events.c.id > self._cursor).order_by(events.c.id).limit(page)
+            )).mappings().all()
+            late = []
+            if self._late:
+                now = time.monotonic()
+                self._late = {i: deadline for i, deadline in self._late.items() if deadline > now}
+                late = (await conn.execute(
+                    select(events).where(events.c.id.in_(sorted(self._late))).order_by(events.c.id)
+                )).mappings().all() if self._late else []
+        for row in late:
+            del self._late[row["id"]]
+            self.late_delivered += 1
+            self._deliver({**row, "late": True})
+        settled = datetime.utcnow() - timedelta(seconds=self.settle)
+        for row in rows:
+            # IDs are taken at INSERT but become visible at COMMIT; on PostgreSQL a
+            # later ID can commit first, so wait briefly for a gap to fill
+            if row["id"] != self._cursor + 1:
+                if row["created_at"] > settled:
+                    self.wake_later()
+                    return False
+                if self.track_late:
+                    self._skip(range(self._cursor + 1, row["id"]))
+            self._cursor = row["id"]
+            self._deliver(row)
+        return len(rows) == page
+
+    def _skip(self, ids: range):
+        """Look for ``ids`` (still uncommitted, or rolled back) for ``late`` seconds."""
+        deadline = time.monotonic() + self.late
+        for i in ids[-MAX_LATE_IDS:]:
+            self._late[i] = deadline
+        while len(self._late) > MAX_LATE_IDS:
+            del self._late[next(iter(self._late))]
+
+    def wake_later(self):
+        if self._loop is not None:
+            self._loop.call_later(self.poll_interval / 4, self.wake)
+
+    def _deliver(self, row):
+        for sub in list(self._subscribers):
+            if sub.lagged or not sub.filter.matches(row):
+                continue
+            try:
+                sub.queue.put_nowait(row)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Disconnect rather than buffer without limit; the client
+                # reconnects with its Last-Event-ID and replays from the table
+                sub.lagged = True
+                self.dropped += 1
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(None)
+
+    async def _prune(self):
+        self._pruned_at = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(events).where(events.c.created_at < cutoff))
+
+    async def _replay(self, filter: Filter, after: int):
+        """Events after ``after`` matching ``filter``, or None when they are no longer all retained."""
+        async with self.engine.connect() as conn:
+            oldest = (await conn.execute(select(func.min(events.c.id)))).scalar()
+            if oldest is None or after < oldest - 1:
+                return None  # pruned
+            rows = (await conn.execute(
+                select(events).where(events.c.id > after, events.c.id <= self._cursor, *filter.where())
+                .order_by(events.c.id).limit(self.replay_limit + 1)
+            )).mappings().all()
+        rows = [r for r in rows if filter.matches(r)]
+        return None if len(rows) > self.replay_limit else rows
+
+    async def stream(self, filter: Filter, after: Optional[int] = None) -> AsyncIterator[str]:
+        """SSE text for one client: replay after ``after``, then live events and heartbeats."""
+        await self.start()
+        sub = _Subscriber(filter, self.queue_size)
+        if not self._subscribers:
+            self._cursor = await self._latest_id()
+        self._subscribers.append(sub)
+        try:
+            yield f"retry: {int(self.poll_interval * 3000)}\n\n"
+            last = self._cursor
+            replayed: Optional[list] = []
+            replayed_ids = set()
+            if after is not None and after < last:
+                replayed = await self._replay(filter, after)
+            elif after is not None and after > last:
+                # Issued by a process whose poller is ahead of ours, or by another database
+                if after <= await self._latest_id():
+                    last = after
+                else:
+                    replayed = None
+            if replayed is None:
+                yield format_control("reset", {"reason": "cursor outside the replay window; refetch"}, last)
+            for row in replayed or []:
+                last = max(last, row["id"])
+                replayed_ids.add(row["id"])
+                yield format_event(row)
+            yield format_control("ready", {"cursor": last}, last)
+            while True:
+                try:
+                    row = await asyncio.wait_for(sub.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if row is None:
+                    return  # lagged: end the response, the client reconnects and replays
+                if row["id"] > last:
+                    last = row["id"]
+                    yield format_event(row)
+                elif row.get("late") and row["id"] not in replayed_ids:
+                    yield format_event(row, last)
+        finally:
+            self._subscribers.remove(sub)
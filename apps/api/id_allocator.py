@@ -0,0 +1,180 @@
+"""Block-reserving ID allocator for human-readable LIMS identifiers.
+
+IDs such as ``KIT-0001`` or ``SAMP-00042`` are built from a per-prefix
+sequence. Each process reserves a block of values (``ID_BLOCK_SIZE``) in a
+single short transaction and then hands them out from memory, so allocating
+an ID is constant-time and never scans the entity tables. Values are unique
+across processes; IDs are not guaranteed to be gap-free.
+"""
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, cast, func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+metadata = MetaData()
+
+id_sequences = Table(
+    "id_sequences",
+    metadata,
+    Column("prefix", String, primary_key=True),
+    Column("next_value", Integer, nullable=False),
+)
+
+
+class SequenceBackend:
+    """Reserves blocks of sequence values for a prefix.
+
+    A backend is always asked for blocks of the same size, which lets the
+    Postgres backend map a prefix onto a native sequence.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def create(self):
+        pass
+
+    def check(self, prefix: str, size: int):
+        """Raise if values for ``prefix`` cannot be reserved in blocks of ``size``."""
+
+    def reserve(self, prefix: str, size: int, seed: Callable[[Connection], int]) -> int:
+        """Reserve ``size`` values and return the first one.
+
+        ``seed`` returns the last value already in use; it is only called the
+        first time a prefix is seen.
+        """
+        raise NotImplementedError
+
+
+class SQLiteSequenceBackend(SequenceBackend):
+    """Sequence rows in ``id_sequences`` bumped with ``UPDATE ... RETURNING``."""
+
+    def create(self):
+        metadata.create_all(bind=self.engine)
+
+    def reserve(self, prefix: str, size: int, seed: Callable[[Connection], int]) -> int:
+        with self.engine.begin() as conn:
+            exists = conn.execute(
+                select(id_sequences.c.prefix).where(id_sequences.c.prefix == prefix)
+            ).first()
+            if not exists:
+                conn.execute(
+                    text("INSERT OR IGNORE INTO id_sequences (prefix, next_value) VALUES (:prefix, :start)"),
+                    {"prefix": prefix, "start": seed(conn) + 1},
+                )
+            end = conn.execute(
+                text(
+                    "UPDATE id_sequences SET next_value = next_value + :size "
+                    "WHERE prefix = :prefix RETURNING next_value"
+                ),
+                {"prefix": prefix, "size": size},
+            ).scalar_one()
+        return end - size
+
+
+class PostgresSequenceBackend(SequenceBackend):
+    """Native sequences incrementing by the block size, one per prefix.
+
+    A block is the values between two ``nextval`` calls, so the sequence's
+    increment must equal the block size. ``check`` refuses to start when
+    an existing sequence was created with another ``ID_BLOCK_SIZE``:
+    altering it while processes with the old size still run would hand
+    out overlapping blocks.
+    """
+
+    def _sequence_name(self, prefix: str) -> str:
+        return "id_seq_" + "".join(c if c.isalnum() else "_" for c in prefix.lower())
+
+    def check(self, prefix: str, size: int):
+        name = self._sequence_name(prefix)
+        with self.engine.connect() as conn:
+            increment = conn.execute(
+                text("SELECT increment_by FROM pg_sequences WHERE schemaname = current_schema() AND sequencename = :name"),
+                {"name": name},
+            ).scalar()
+        if increment is not None and increment != size:
+            raise RuntimeError(
+                f"Sequence {name} increments by {increment} but ID_BLOCK_SIZE is {size}. Set ID_BLOCK_SIZE={increment}, "
+                f"or stop every API process and run ALTER SEQUENCE {name} INCREMENT BY {size}"
+            )
+
+    def reserve(self, prefix: str, size: int, seed: Callable[[Connection], int]) -> int:
+        name = self._sequence_name(prefix)
+        with self.engine.begin() as conn:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                conn.execute(text(
+                    f"CREATE SEQUENCE IF NOT EXISTS {name} "
+                    f"START WITH {seed(conn) + 1} INCREMENT BY {size}"
+                ))
+            return conn.execute(text(f"SELECT nextval('{name}')")).scalar_one()
+
+
+def backend_for(engine: Engine) -> SequenceBackend:
+    if engine.dialect.name == "postgresql":
+        return PostgresSequenceBackend(engine)
+    return SQLiteSequenceBackend(engine)
+
+
+class IdAllocator:
+    """Hands out sequence values per prefix from locally reserved blocks."""
+
+    def __init__(self, engine: Engine, block_size: int = 1000, backend: Optional[SequenceBackend] = None):
+        self.engine = engine
+        self.block_size = block_size
+        self.backend = backend or backend_for(engine)
+        self.backend.create()
+        self._lock = threading.Lock()
+        self._blocks: Dict[str, Tuple[int, int]] = {}  # prefix -> (next, end)
+        self._formats: Dict[str, Tuple[int, Any]] = {}
+
+    def register(self, prefix: str, width: int, seed_column=None):
+        """Declare a prefix, its zero-padding width and the ID column it feeds.
+
+        When the prefix has no sequence yet it starts after the highest
+        ``{prefix}-N`` already in ``seed_column``, so databases created
+        before the allocator keep their numbering. The highest value, not
+        the row count: rows may have been deleted (upload deduplication).
+        """
+        self._formats[prefix] = (width, seed_column)
+        self.backend.check(prefix, self.block_size)
+
+    def _refill(self, prefix: str) -> Tuple[int, int]:
+        _, column = self._formats.get(prefix, (0, None))
+
+        def seed(conn: Connection) -> int:
+            if column is None:
+                return 0
+            suffix = cast(func.substr(column, len(prefix) + 2), Integer)
+            return conn.execute(
+                select(func.coalesce(func.max(suffix), 0)).where(column.like(f"{prefix}-%"))
+            ).scalar_one()
+
+        start = self.backend.reserve(prefix, self.block_size, seed)
+        return start, start + self.block_size
+
+    def take(self, prefix: str, n: int = 1) -> List[int]:
+        """Return ``n`` unused sequence values for ``prefix``."""
+        values: List[int] = []
+        with self._lock:
+            while len(values) < n:
+                start, end = self._blocks.get(prefix, (0, 0))
+                if start >= end:
+                    start, end = self._refill(prefix)
+                count = min(end - start, n - len(values))
+                values.extend(range(start, start + count))
+                self._blocks[prefix] = (start + count, end)
+        return values
+
+    def format(self, prefix: str, value: int) -> str:
+        width = self._formats.get(prefix, (4, None))[0]
+        return f"{prefix}-{value:0{width}d}"
+
+    def next_value(self, prefix: str) -> int:
+        return self.take(prefix, 1)[0]
+
+    def next_id(self, prefix: str) -> str:
+        return self.format(prefix, self.next_value(prefix))
+
+    def next_ids(self, prefix: str, n: int) -> List[str]:
+        return [self.format(prefix, v) for v in self.take(prefix, n)]
@@ -0,0 +1,128 @@
+"""Receipts that make metrics and QC re-uploads idempotent.
+
+Scanner retries and re-imports post the same payload again. Each upload
+endpoint hashes its payload together with the target and QC profile it is
+applied under, and stores a receipt (hash + JSON response) in the
+transaction that applies it:
+
+    digest = idempotency.payload_hash(rows, scope, rules.key)
+    stored = idempotency.lookup(db, scope, digest, idempotency_key)
+    ...
+    idempotency.record(db, scope, digest, response, idempotency_key)
+
+* The scope receipt (``runs/RUN-0001/metrics``, ``extractions/qc``) holds
+  the payload last applied to that target. Posting it again returns the
+  stored response after one primary-key read and writes nothing. Writers
+  that change the same rows another way (re-banding a run) ``forget`` the
+  scope, so an older response is never replayed over their changes.
+  An upload that skipped IDs not known yet (``unknown_aliquot_ids``,
+  ``unknown_sample_ids``) leaves no scope receipt: posted again once
+  those IDs exist, it is applied instead of replayed.
+* An ``Idempotency-Key`` receipt holds one client request for ``ttl``
+  seconds. A retry with the same key gets the original response even if
+  other uploads happened in between; the same key with a different
+  payload raises ``KeyReuseError``.
+
+A payload that misses both is applied as an upsert that writes only the
+rows that changed, so a re-import after an unrelated upload is cheap too.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional
+
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, Text, delete, select
+from sqlalchemy.engine import Engine
+
+from database import upsert
+
+metadata = MetaData()
+
+upload_receipts = Table(
+    "upload_receipts",
+    metadata,
+    Column("key", String, primary_key=True),  # scope, or scope + "#" + Idempotency-Key
+    Column("content_hash", String, nullable=False),
+    Column("response", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=True),  # None for scope receipts
+    Index("ix_upload_receipts_expires_at", "expires_at"),
+)
+
+
+class KeyReuseError(Exception):
+    pass
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def _key(scope: str, idempotency_key: str) -> str:
+    return f"{scope}#{idempotency_key}"
+
+
+def payload_hash(payload, *context: str) -> str:
+    """SHA-256 of a JSON-serialisable payload and the context it is applied under."""
+    digest = hashlib.sha256()
+    for part in context:
+        digest.update(part.encode() + b"\0")
+    digest.update(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode())
+    return digest.hexdigest()
+
+
+def file_hash(file: BinaryIO, *context: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of an uploaded file and its context; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    for part in context:
+        digest.update(part.encode() + b"\0")
+    for block in iter(lambda: file.read(block_size), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def lookup(conn, scope: str, content_hash: str, idempotency_key: Optional[str] = None) -> Optional[str]:
+    """The stored response for this payload, or None if it has to be applied."""
+    keys = [scope] + ([_key(scope, idempotency_key)] if idempotency_key else [])
+    rows = {row.key: row for row in conn.execute(
+        select(upload_receipts.c.key, upload_receipts.c.content_hash, upload_receipts.c.response,
+               upload_receipts.c.expires_at)
+        .where(upload_receipts.c.key.in_(keys))
+    )}
+    if idempotency_key:
+        row = rows.get(_key(scope, idempotency_key))
+        if row is not None and row.expires_at > datetime.utcnow():
+            if row.content_hash != content_hash:
+                raise KeyReuseError(f"Idempotency-Key {idempotency_key} was already used with a different payload")
+            return row.response
+    row = rows.get(scope)
+    if row is not None and row.content_hash == content_hash:
+        return row.response
+    return None
+
+
+def record(conn, scope: str, content_hash: str, response: str, idempotency_key: Optional[str] = None,
+           ttl: float = 86400.0, complete: bool = True):
+    """Store the receipt(s) of an applied upload; ``conn`` is a Connection or Session, the caller commits.
+
+    ``complete=False`` (rows were skipped for unknown IDs) stores only the
+    ``Idempotency-Key`` receipt and drops the scope receipt.
+    """
+    now = datetime.utcnow()
+    rows = []
+    if complete:
+        rows.append({"key": scope, "content_hash": content_hash, "response": response, "created_at": now,
+                     "expires_at": None})
+    else:
+        forget(conn, scope)
+    if idempotency_key:
+        rows.append({"key": _key(scope, idempotency_key), "content_hash": content_hash, "response": response,
+                     "created_at": now, "expires_at": now + timedelta(seconds=ttl)})
+        conn.execute(delete(upload_receipts).where(upload_receipts.c.expires_at < now))
+    upsert(conn, upload_receipts, ("key",), rows)
+
+
+def forget(conn, scope: str):
+    """Drop the scope receipt after its rows were changed by something other than an upload."""
+    conn.execute(delete(upload_receipts).where(upload_receipts.c.key == scope))
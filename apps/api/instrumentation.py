@@ -0,0 +1,326 @@
+"""Request instrumentation: Prometheus metrics, Server-Timing and a slow-request profiler.
+
+``MetricsMiddleware`` wraps the ASGI app and records, per route template
+(``/runs/{run_id}/metrics``, not the concrete path):
+
+- request latency
+- SQL statements and time spent in them (via ``query_stats``)
+- request and response body sizes
+- requests in flight
+
+``Registry.render`` produces the Prometheus text format for ``GET /metrics``;
+gauges can be callbacks read at scrape time (threadpool and write queue
+depth, connection pool usage).
+
+``SlowRequestProfiler`` samples the stacks of all busy threads while
+requests are in flight and, for requests slower than its threshold, writes
+the samples as folded stacks (``frame;frame;frame count``), the input
+format of flamegraph.pl and speedscope. Samples are process-wide, so with
+concurrent requests a dump also shows what the other requests were doing.
+"""
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import query_stats
+
+logger = logging.getLogger("lims.instrumentation")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class ValueMetric(Metric):
+    """One value per label set, either kept here or read from ``fn`` at scrape time."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                logger.exception("Metric %s failed", self.name)
+                return
+            yield f"{self.name} {_format_value(value)}"
+            return
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class CounterMetric(ValueMetric):
+    kind = "counter"
+
+
+class GaugeMetric(ValueMetric):
+    kind = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last = +Inf), sum]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(round(total, 6))}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (),
+                fn: Optional[Callable[[], float]] = None) -> CounterMetric:
+        return self._add(CounterMetric(name, help, labelnames, fn))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              fn: Optional[Callable[[], float]] = None) -> GaugeMetric:
+        return self._add(GaugeMetric(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float]) -> HistogramMetric:
+        return self._add(HistogramMetric(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+class RequestMetrics:
+    """The per-request series recorded by ``MetricsMiddleware``."""
+
+    def __init__(self, registry: Registry, prefix: str = "lims"):
+        route = ("method", "route")
+        self.duration = registry.histogram(
+            f"{prefix}_http_request_duration_seconds", "Request latency until the response is sent",
+            route + ("status",), LATENCY_BUCKETS)
+        self.statements = registry.histogram(
+            f"{prefix}_http_request_db_statements", "SQL statements executed per request", route, STATEMENT_BUCKETS)
+        self.db_seconds = registry.histogram(
+            f"{prefix}_http_request_db_seconds", "Time spent executing SQL per request", route, LATENCY_BUCKETS)
+        self.request_bytes = registry.histogram(
+            f"{prefix}_http_request_size_bytes", "Request body size", route, SIZE_BUCKETS)
+        self.response_bytes = registry.histogram(
+            f"{prefix}_http_response_size_bytes", "Response body size", route, SIZE_BUCKETS)
+        self.in_flight = registry.gauge(f"{prefix}_http_requests_in_flight", "Requests being handled")
+
+
+def _folded_stack(frame, thread_name: str) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "socket.py", "base_events.py"}
+
+
+def _is_idle(frame) -> bool:
+    """Threads parked on a lock, queue or selector (idle workers, the event loop waiting)."""
+    return os.path.basename(frame.f_code.co_filename) in IDLE_FILES
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold: float, interval: float = 0.005, output_dir: str = "/tmp/lims_profiles",
+                 max_stacks: int = 5000):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = Path(output_dir)
+        self.max_stacks = max_stacks
+        self.dumps = 0
+        self._active: List[Counter] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> Counter:
+        samples: Counter = Counter()
+        with self._lock:
+            self._active.append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lims-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def finish(self, samples: Counter, duration: float, name: str) -> Optional[Path]:
+        with self._lock:
+            self._active.remove(samples)
+            if not self._active:
+                self._wake.clear()
+        if duration < self.threshold or not samples:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_")
+        path = self.output_dir / f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{slug}-{int(duration * 1000)}ms.folded"
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in samples.most_common()))
+        self.dumps += 1
+        logger.warning("Slow request %s took %.0f ms; stacks written to %s", name, duration * 1000, path)
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [
+                _folded_stack(frame, names.get(ident, str(ident)))
+                for ident, frame in sys._current_frames().items()
+                if ident != own and not _is_idle(frame)
+            ]
+            with self._lock:
+                for samples in self._active:
+                    for stack in stacks:
+                        if stack in samples or len(samples) < self.max_stacks:
+                            samples[stack] += 1
+            time.sleep(self.interval)
+
+
+class MetricsMiddleware:
+    """ASGI middleware feeding ``RequestMetrics`` (and optional Server-Timing / X-Query-Count headers)."""
+
+    def __init__(self, app, metrics: RequestMetrics, server_timing: bool = False,
+                 query_count_header: bool = False, profiler: Optional[SlowRequestProfiler] = None,
+                 unprofiled_paths: Sequence[str] = ()):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.query_count_header = query_count_header
+        self.profiler = profiler
+        self.unprofiled_paths = frozenset(unprofiled_paths)  # long-lived streams, slow by design
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = [500]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def instrumented_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                if self.server_timing:
+                    app_ms = (time.perf_counter() - start) * 1000
+                    headers.append((b"server-timing", (
+                        f'app;dur={app_ms:.1f}, db;dur={queries.seconds * 1000:.1f};desc="{queries.count} statements"'
+                    ).encode()))
+                if self.query_count_header:
+                    headers.append((b"x-query-count", str(queries.count).encode()))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight.inc()
+        profile = self.profiler is not None and scope["path"] not in self.unprofiled_paths
+        samples = self.profiler.start() if profile else None
+        try:
+            with query_stats.count_queries() as queries:
+                await self.app(scope, counting_receive, instrumented_send)
+        finally:
+            duration = time.perf_counter() - start
+            self.metrics.in_flight.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            labels = (scope["method"], route)
+            m = self.metrics
+            m.duration.observe(labels + (str(status[0]),), duration)
+            m.statements.observe(labels, queries.count)
+            m.db_seconds.observe(labels, queries.seconds)
+            m.request_bytes.observe(labels, sizes["request"])
+            m.response_bytes.observe(labels, sizes["response"])
+            if samples is not None:
+                self.profiler.finish(samples, duration, f"{scope['method']} {route}")
@@ -0,0 +1,307 @@
+"""Database-backed background job queue with a process worker pool.
+
+Jobs live in the ``jobs`` table of the LIMS database, which acts as the
+broker: producers insert rows in their own transaction, and worker
+processes claim them with an atomic ``UPDATE ... RETURNING``. A job that
+raises is retried with exponential backoff until ``max_attempts`` is
+reached, then marked Failed. While a handler runs, its worker refreshes
+the job's ``locked_at`` every ``JOB_HEARTBEAT_INTERVAL`` seconds; a job
+whose lock is older than ``JOB_LOCK_TIMEOUT`` (its worker crashed) is
+reclaimed if it has attempts left, and marked Failed otherwise.
+
+Handlers are referenced as ``"module:function"`` strings and called as
+``handler(payload, ctx)`` inside the worker process. Workers import only
+the handler's module, so it should not do work at import time. A handler
+may set ``handler.on_abandoned(payload, ctx)``, called when its job is
+failed because the worker of its last attempt stopped heartbeating.
+
+Workers normally run inside the API process (see ``app.lifespan``); with
+several API processes set ``PRS_WORKERS=0`` and run them separately:
+
+    python job_queue.py --workers 2
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import (
+    Column, DateTime, Index, Integer, MetaData, String, Table, Text, bindparam, insert, select, text
+)
+from sqlalchemy.engine import Connection, Engine
+
+from database import make_engine
+
+logger = logging.getLogger("lims.jobs")
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", str(JOB_LOCK_TIMEOUT / 3)))
+
+QUEUED = "Queued"
+PROCESSING = "Processing"
+COMPLETED = "Completed"
+FAILED = "Failed"
+
+metadata = MetaData()
+
+jobs = Table(
+    "jobs",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("kind", String, nullable=False),
+    Column("handler", String, nullable=False),
+    Column("ref", String, nullable=True),  # ID of the entity the job works on
+    Column("payload", Text, nullable=False),
+    Column("status", String, nullable=False, default=QUEUED),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("max_attempts", Integer, nullable=False, default=JOB_MAX_ATTEMPTS),
+    Column("error", Text, nullable=True),
+    Column("run_after", DateTime, nullable=False),
+    Column("locked_by", String, nullable=True),
+    Column("locked_at", DateTime, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Index("ix_jobs_status_run_after", "status", "run_after"),
+    Index("ix_jobs_ref", "ref"),
+)
+
+
+class JobContext:
+    """What a handler knows about the job it is running."""
+
+    def __init__(self, job_id: int, ref: Optional[str], attempt: int, max_attempts: int, engine: Engine):
+        self.job_id = job_id
+        self.ref = ref
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+        self.engine = engine
+
+    @property
+    def is_last_attempt(self) -> bool:
+        return self.attempt >= self.max_attempts
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def enqueue(conn, kind: str, handler: str, payload: Dict[str, Any], ref: Optional[str] = None,
+            max_attempts: int = JOB_MAX_ATTEMPTS) -> None:
+    """Add a job using ``conn`` (a Connection or Session), so it commits with the caller's transaction."""
+    now = datetime.utcnow()
+    conn.execute(insert(jobs).values(
+        kind=kind,
+        handler=handler,
+        ref=ref,
+        payload=json.dumps(payload),
+        status=QUEUED,
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=now,
+        created_at=now,
+        updated_at=now,
+    ))
+
+
+def job_for_ref(conn, ref: str) -> Optional[dict]:
+    row = conn.execute(
+        select(jobs).where(jobs.c.ref == ref).order_by(jobs.c.id.desc()).limit(1)
+    ).mappings().first()
+    return dict(row) if row else None
+
+
+def claim(conn: Connection, worker_id: str) -> Optional[dict]:
+    """Atomically move the oldest runnable job to Processing and return it."""
+    now = datetime.utcnow()
+    row = conn.execute(text(
+        "UPDATE jobs SET status = :processing, attempts = attempts + 1, "
+        "locked_by = :worker, locked_at = :now, updated_at = :now "
+        "WHERE id = ("
+        "  SELECT id FROM jobs"
+        "  WHERE (status = :queued AND run_after <= :now)"
+        "     OR (status = :processing AND locked_at < :stale AND attempts < max_attempts)"
+        "  ORDER BY id LIMIT 1"
+        ") AND (status = :queued OR (locked_at < :stale AND attempts < max_attempts)) "
+        "RETURNING id, handler, ref, payload, attempts, max_attempts"
+    ).bindparams(bindparam("now", type_=DateTime), bindparam("stale", type_=DateTime)), {
+        "processing": PROCESSING,
+        "queued": QUEUED,
+        "worker": worker_id,
+        "now": now,
+        "stale": now - timedelta(seconds=JOB_LOCK_TIMEOUT),
+    }).mappings().first()
+    return dict(row) if row else None
+
+
+def abandon_stale(engine: Engine) -> List[dict]:
+    """Fail the jobs whose worker stopped heartbeating during their last attempt."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        abandoned = [dict(row) for row in conn.execute(text(
+            "UPDATE jobs SET status = :failed, error = :error, locked_by = NULL, locked_at = NULL, "
+            "updated_at = :now "
+            "WHERE status = :processing AND locked_at < :stale AND attempts >= max_attempts "
+            "RETURNING id, handler, ref, payload, attempts, max_attempts"
+        ).bindparams(bindparam("now", type_=DateTime), bindparam("stale", type_=DateTime)), {
+            "failed": FAILED,
+            "processing": PROCESSING,
+            "error": f"Worker stopped responding (no heartbeat for {JOB_LOCK_TIMEOUT} s) on the last attempt",
+            "now": now,
+            "stale": now - timedelta(seconds=JOB_LOCK_TIMEOUT),
+        }).mappings()]
+    for job in abandoned:
+        logger.error("Job %s (%s) abandoned on attempt %s", job["id"], job["ref"], job["attempts"])
+        hook = getattr(_resolve(job["handler"]), "on_abandoned", None)
+        if hook is not None:
+            ctx = JobContext(job["id"], job["ref"], job["attempts"], job["max_attempts"], engine)
+            try:
+                hook(json.loads(job["payload"]), ctx)
+            except Exception:
+                logger.exception("on_abandoned of job %s failed", job["id"])
+    return abandoned
+
+
+def _finish(engine: Engine, job: dict, worker_id: str, error: Optional[str]):
+    now = datetime.utcnow()
+    values = {"updated_at": now, "locked_by": None, "locked_at": None, "error": error}
+    if error is None:
+        values["status"] = COMPLETED
+    elif job["attempts"] < job["max_attempts"]:
+        values["status"] = QUEUED
+        values["run_after"] = now + timedelta(seconds=2 ** job["attempts"])
+    else:
+        values["status"] = FAILED
+    with engine.begin() as conn:
+        # A job reclaimed from this worker (missed heartbeats) belongs to its new worker
+        conn.execute(jobs.update().where(jobs.c.id == job["id"], jobs.c.locked_by == worker_id).values(**values))
+
+
+def _resolve(handler: str):
+    module_name, func_name = handler.split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class Heartbeat:
+    """Refreshes a claimed job's ``locked_at`` from a thread while its handler runs."""
+
+    def __init__(self, engine: Engine, job_id: int, worker_id: str, interval: float = JOB_HEARTBEAT_INTERVAL):
+        self.engine = engine
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(
+                        jobs.update()
+                        .where(jobs.c.id == self.job_id, jobs.c.locked_by == self.worker_id)
+                        .values(locked_at=datetime.utcnow())
+                    )
+            except Exception:
+                logger.exception("Heartbeat of job %s failed", self.job_id)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_one(engine: Engine, worker_id: str) -> bool:
+    """Claim and run a single job; return False when the queue is empty."""
+    with engine.begin() as conn:
+        job = claim(conn, worker_id)
+    if job is None:
+        return False
+    ctx = JobContext(job["id"], job["ref"], job["attempts"], job["max_attempts"], engine)
+    try:
+        with Heartbeat(engine, job["id"], worker_id):
+            _resolve(job["handler"])(json.loads(job["payload"]), ctx)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed on attempt %s", job["id"], job["ref"], job["attempts"])
+        _finish(engine, job, worker_id, f"{type(e).__name__}: {e}")
+    else:
+        _finish(engine, job, worker_id, None)
+    return True
+
+
+def _worker_main(database_url: str, worker_id: str, stop):
+    engine = make_engine(database_url)
+    next_sweep = 0.0
+    while not stop.is_set():
+        try:
+            if time.monotonic() >= next_sweep:
+                abandon_stale(engine)
+                next_sweep = time.monotonic() + JOB_HEARTBEAT_INTERVAL
+            if not run_one(engine, worker_id):
+                stop.wait(JOB_POLL_INTERVAL)
+        except Exception:
+            logger.exception("Worker %s could not poll the job table", worker_id)
+            stop.wait(JOB_POLL_INTERVAL)
+
+
+class WorkerPool:
+    """A fixed number of worker processes polling the job table.
+
+    The pool size is the concurrency limit: at most ``workers`` jobs run at
+    once per pool.
+    """
+
+    def __init__(self, database_url: str, workers: int):
+        self.database_url = database_url
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        for i in range(self.workers):
+            worker_id = f"{os.getpid()}-{i}"
+            p = self._ctx.Process(
+                target=_worker_main,
+                args=(self.database_url, worker_id, self._stop),
+                name=f"lims-job-worker-{i}",
+                daemon=True,
+            )
+            p.start()
+            self._processes.append(p)
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for p in self._processes:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._processes = []
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run LIMS background job workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PRS_WORKERS", "2")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    url = os.getenv("DATABASE_URL", "sqlite:///./lims.db")
+    create_tables(make_engine(url))
+    pool = WorkerPool(url, args.workers)
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,220 @@
+"""Incremental parsers for genotype metrics files.
+
+Supported inputs (see docs/METRICS_IMPORT_FORMATS.md):
+
+- CSV / TSV with ``sample_id, call_rate, dish_qc`` and optional
+  ``heterozygosity, sex_call, sex_concordance`` columns
+- GenomeStudio sample table exports (``Sample ID``, ``Call Rate``, ...)
+- GenomeStudio Final Reports (``[Header]`` ... ``[Data]`` per-SNP rows),
+  aggregated to per-sample call rate and heterozygosity
+
+Files are read line by line from a binary stream, so memory use does not
+grow with the number of rows (Final Reports keep one counter per sample).
+"""
+import codecs
+import csv
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+FORMAT_CSV = "csv"
+FORMAT_TSV = "tsv"
+FORMAT_GS_SAMPLES = "genomestudio_samples"
+FORMAT_GS_FINAL_REPORT = "genomestudio_final_report"
+
+# Canonical field -> accepted header spellings (compared case-insensitively)
+COLUMN_ALIASES = {
+    "sample_id": ["sample_id", "sample id", "sample_name", "sample name"],
+    "call_rate": ["call_rate", "call rate", "callrate"],
+    "dish_qc": ["dish_qc", "dish qc", "dishqc"],
+    "heterozygosity": ["heterozygosity", "het rate", "het_rate", "het"],
+    "sex_call": ["sex_call", "sex", "gender"],
+    "sex_concordance": ["sex_concordance", "sex concordance", "gender concordance"],
+}
+REQUIRED_COLUMNS = ["sample_id", "call_rate", "dish_qc"]
+
+FINAL_REPORT_ALLELE_COLUMNS = [
+    ("allele1 - top", "allele2 - top"),
+    ("allele1 - forward", "allele2 - forward"),
+    ("allele1 - ab", "allele2 - ab"),
+    ("allele1 - plus", "allele2 - plus"),
+]
+
+
+class MetricsFileError(ValueError):
+    """The file cannot be parsed as any supported metrics format."""
+
+
+# (line number, parsed row or None, error message or None)
+ParsedRow = Tuple[int, Optional[dict], Optional[str]]
+
+
+def open_text(binary) -> TextIO:
+    """Wrap a binary upload stream as text, tolerating a UTF-8 BOM."""
+    return codecs.getreader("utf-8-sig")(binary, errors="replace")
+
+
+def _map_columns(header: List[str]) -> Dict[str, int]:
+    normalized = [h.strip().lower() for h in header]
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for i, name in enumerate(normalized):
+            if name in aliases:
+                mapping[field] = i
+                break
+    return mapping
+
+
+def _parse_fraction(value: str, field: str, required: bool) -> Tuple[Optional[float], Optional[str]]:
+    value = value.strip()
+    if value == "" or value.upper() == "NA":
+        return None, f"{field} missing" if required else None
+    try:
+        number = float(value)
+    except ValueError:
+        return None, f"{field} is not a number: {value!r}"
+    # GenomeStudio reports rates as percentages in some exports
+    if field == "call_rate" and 1 < number <= 100:
+        number /= 100
+    if not 0 <= number <= 1:
+        return None, f"{field} out of range 0..1: {value}"
+    return number, None
+
+
+def parse_row(values: List[str], columns: Dict[str, int]) -> Tuple[Optional[dict], Optional[str]]:
+    def cell(field):
+        i = columns.get(field)
+        return values[i] if i is not None and i < len(values) else ""
+
+    sample_id = cell("sample_id").strip()
+    if not sample_id:
+        return None, "sample_id missing"
+    row = {"sample_id": sample_id}
+    for field in ["call_rate", "dish_qc", "heterozygosity"]:
+        number, error = _parse_fraction(cell(field), field, field in REQUIRED_COLUMNS)
+        if error:
+            return None, f"{sample_id}: {error}"
+        row[field] = number
+    row["sex_call"] = cell("sex_call").strip() or None
+    row["sex_concordance"] = cell("sex_concordance").strip() or None
+    return row, None
+
+
+def _iter_table(lines: Iterator[str], delimiter: str) -> Iterator[ParsedRow]:
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None:
+        raise MetricsFileError("File is empty")
+    columns = _map_columns(header)
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise MetricsFileError(f"Missing required column(s): {', '.join(missing)}")
+    try:
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            row, error = parse_row(values, columns)
+            yield reader.line_num, row, error
+    except csv.Error as e:
+        raise MetricsFileError(f"Line {reader.line_num}: {e}") from e
+
+
+def _iter_final_report(lines: Iterator[str]) -> Iterator[ParsedRow]:
+    # Skip the rest of the [Header] block (its first line was already read)
+    line_no = 1
+    for line in lines:
+        line_no += 1
+        if line.strip().lower().startswith("[data]"):
+            break
+    else:
+        raise MetricsFileError("Final Report has no [Data] section")
+
+    header_line = next(lines, "")
+    line_no += 1
+    delimiter = "\t" if "\t" in header_line else ","
+    header = [h.strip().lower() for h in next(csv.reader([header_line], delimiter=delimiter))]
+    if "sample id" not in header:
+        raise MetricsFileError("Final Report [Data] section has no 'Sample ID' column")
+    sample_col = header.index("sample id")
+    allele_cols = next(
+        ((header.index(a1), header.index(a2)) for a1, a2 in FINAL_REPORT_ALLELE_COLUMNS
+         if a1 in header and a2 in header),
+        None,
+    )
+    if allele_cols is None:
+        raise MetricsFileError("Final Report [Data] section has no Allele1/Allele2 columns")
+    extra = _map_columns(header)
+
+    # sample_id -> [snps, called, heterozygous, dish_qc]
+    counters: Dict[str, list] = {}
+    first_seen: Dict[str, int] = {}
+    try:
+        for values in csv.reader(lines, delimiter=delimiter):
+            line_no += 1
+            if len(values) <= max(sample_col, *allele_cols):
+                continue
+            sample_id = values[sample_col].strip()
+            c = counters.get(sample_id)
+            if c is None:
+                dish_col = extra.get("dish_qc")
+                dish_qc = values[dish_col] if dish_col is not None and dish_col < len(values) else ""
+                c = counters[sample_id] = [0, 0, 0, dish_qc]
+                first_seen[sample_id] = line_no
+            a1, a2 = values[allele_cols[0]].strip(), values[allele_cols[1]].strip()
+            c[0] += 1
+            if a1 not in ("-", "") and a2 not in ("-", ""):
+                c[1] += 1
+                if a1 != a2:
+                    c[2] += 1
+    except csv.Error as e:
+        raise MetricsFileError(f"Line {line_no + 1}: {e}") from e
+
+    for sample_id, (snps, called, het, dish_qc) in counters.items():
+        row = {
+            "sample_id": sample_id,
+            "call_rate": called / snps if snps else 0.0,
+            "heterozygosity": het / called if called else None,
+            "sex_call": None,
+            "sex_concordance": None,
+        }
+        number, error = _parse_fraction(dish_qc, "dish_qc", True)
+        if error:
+            yield first_seen[sample_id], None, f"{sample_id}: {error}"
+        else:
+            row["dish_qc"] = number
+            yield first_seen[sample_id], row, None
+
+
+def iter_metrics(binary) -> Tuple[str, Iterator[ParsedRow]]:
+    """Detect the format of ``binary`` and return (format, row iterator)."""
+    lines = iter(open_text(binary))
+    first = next(lines, "")
+    while first and not first.strip():
+        first = next(lines, "")
+    if not first:
+        raise MetricsFileError("File is empty")
+
+    if first.strip().lower().startswith("[header]"):
+        return FORMAT_GS_FINAL_REPORT, _iter_final_report(lines)
+
+    delimiter = "\t" if first.count("\t") > first.count(",") else ","
+    header = [h.strip().lower() for h in next(csv.reader([first], delimiter=delimiter))]
+    if "sample id" in header:
+        fmt = FORMAT_GS_SAMPLES
+    else:
+        fmt = FORMAT_TSV if delimiter == "\t" else FORMAT_CSV
+
+    def with_header():
+        yield first
+        yield from lines
+
+    return fmt, _iter_table(with_header(), delimiter)
+
+
+def chunked(rows: Iterator[ParsedRow], size: int) -> Iterator[List[ParsedRow]]:
+    chunk: List[ParsedRow] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
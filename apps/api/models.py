@@ -0,0 +1,177 @@
+"""SQLAlchemy models of the LIMS tables.
+
+Only declarations: importing this module opens no connection and changes
+no schema. ``app`` creates the tables and runs its startup migrations;
+job workers (see ``prs_jobs``) import the models without starting the API.
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import declarative_base, relationship
+
+Base = declarative_base()
+
+
+class KitModel(Base):
+    __tablename__ = "kits"
+    __table_args__ = (Index("ix_kits_created_at_id", "created_at", "id"),)
+    id = Column(String, primary_key=True)
+    qr_code = Column(String, unique=True, nullable=False)
+    clinic_id = Column(String, nullable=True)
+    status = Column(String, default="Allocated")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    samples = relationship("SampleModel", back_populates="kit")
+
+
+class SampleModel(Base):
+    __tablename__ = "samples"
+    __table_args__ = (
+        Index("ix_samples_created_at_id", "created_at", "id"),
+        Index("ix_samples_status", "status"),
+        Index("ix_samples_subject_pseudoid", "subject_pseudoid"),
+        Index("ix_samples_kit_qr", "kit_qr"),
+    )
+    id = Column(String, primary_key=True)
+    kit_qr = Column(String, ForeignKey("kits.qr_code"))
+    sample_type = Column(String)
+    subject_pseudoid = Column(String)
+    collection_datetime = Column(DateTime)
+    status = Column(String, default="Received")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    kit = relationship("KitModel", back_populates="samples")
+    consent = relationship("ConsentModel", back_populates="sample", uselist=False)
+    aliquots = relationship("AliquotModel", back_populates="sample")
+
+
+class ConsentModel(Base):
+    __tablename__ = "consents"
+    __table_args__ = (Index("ix_consents_sample_id", "sample_id"),)
+    id = Column(String, primary_key=True)
+    sample_id = Column(String, ForeignKey("samples.id"))
+    consent_type = Column(String)
+    consent_date = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sample = relationship("SampleModel", back_populates="consent")
+
+
+class ExtractionBatchModel(Base):
+    __tablename__ = "extraction_batches"
+    id = Column(String, primary_key=True)
+    batch_date = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    aliquots = relationship("AliquotModel", back_populates="extraction_batch")
+
+
+class AliquotModel(Base):
+    __tablename__ = "aliquots"
+    __table_args__ = (
+        Index("ix_aliquots_created_at_id", "created_at", "id"),
+        Index("ix_aliquots_sample_id", "sample_id"),
+    )
+    id = Column(String, primary_key=True)
+    sample_id = Column(String, ForeignKey("samples.id"))
+    extraction_batch_id = Column(String, ForeignKey("extraction_batches.id"))
+    label = Column(String)
+    qc_flag = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sample = relationship("SampleModel", back_populates="aliquots")
+    extraction_batch = relationship("ExtractionBatchModel", back_populates="aliquots")
+    dna_qc = relationship("DNAQCModel", back_populates="aliquot", uselist=False)
+    plate_wells = relationship("PlateWellModel", back_populates="aliquot")
+
+
+class DNAQCModel(Base):
+    __tablename__ = "dna_qc"
+    __table_args__ = (Index("ux_dna_qc_aliquot_id", "aliquot_id", unique=True),)
+    id = Column(String, primary_key=True)
+    aliquot_id = Column(String, ForeignKey("aliquots.id"))
+    concentration = Column(Float)
+    a260_280 = Column(Float)
+    a260_230 = Column(Float)
+    qc_flag = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    aliquot = relationship("AliquotModel", back_populates="dna_qc")
+
+
+class PlateModel(Base):
+    __tablename__ = "plates"
+    __table_args__ = (Index("ix_plates_created_at_id", "created_at", "id"),)
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    plate_format = Column(String, nullable=True)  # "96" / "384"; NULL for plates created before formats
+    wells_hash = Column(String, nullable=True)  # digest of name + wells, see samplesheet.wells_digest
+    created_at = Column(DateTime, default=datetime.utcnow)
+    wells = relationship("PlateWellModel", back_populates="plate")
+
+
+class PlateWellModel(Base):
+    __tablename__ = "plate_wells"
+    __table_args__ = (
+        Index("ix_plate_wells_plate_id", "plate_id"),
+        Index("ix_plate_wells_sentrix_barcode", "sentrix_barcode"),
+        Index("ix_plate_wells_aliquot_id", "aliquot_id"),
+    )
+    id = Column(String, primary_key=True)
+    plate_id = Column(String, ForeignKey("plates.id"))
+    aliquot_id = Column(String, ForeignKey("aliquots.id"))
+    well = Column(String)
+    sentrix_barcode = Column(String)
+    sentrix_position = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    plate = relationship("PlateModel", back_populates="wells")
+    aliquot = relationship("AliquotModel", back_populates="plate_wells")
+
+
+class RunModel(Base):
+    __tablename__ = "runs"
+    __table_args__ = (Index("ix_runs_created_at_id", "created_at", "id"),)
+    id = Column(String, primary_key=True)
+    run_name = Column(String)
+    run_date = Column(DateTime)
+    status = Column(String, default="Created")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    beadchips = relationship("BeadChipModel", back_populates="run")
+    metrics = relationship("GenotypeMetricsModel", back_populates="run")
+    prs_jobs = relationship("PRSJobModel", back_populates="run")
+
+
+class BeadChipModel(Base):
+    __tablename__ = "beadchips"
+    __table_args__ = (Index("ix_beadchips_run_id", "run_id"),)
+    id = Column(String, primary_key=True)
+    run_id = Column(String, ForeignKey("runs.id"))
+    barcode = Column(String, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    run = relationship("RunModel", back_populates="beadchips")
+
+
+class GenotypeMetricsModel(Base):
+    __tablename__ = "genotype_metrics"
+    __table_args__ = (
+        Index("ix_genotype_metrics_run_id_qc_flag", "run_id", "qc_flag"),
+        Index("ux_genotype_metrics_sample_id_run_id", "sample_id", "run_id", unique=True),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, ForeignKey("runs.id"))
+    sample_id = Column(String, ForeignKey("samples.id"))
+    call_rate = Column(Float)
+    dish_qc = Column(Float)
+    heterozygosity = Column(Float, nullable=True)
+    sex_call = Column(String, nullable=True)
+    sex_concordance = Column(String, nullable=True)
+    qc_flag = Column(String, nullable=True)
+    qc_threshold_version = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    run = relationship("RunModel", back_populates="metrics")
+
+
+class PRSJobModel(Base):
+    __tablename__ = "prs_jobs"
+    __table_args__ = (Index("ix_prs_jobs_created_at_id", "created_at", "id"),)
+    id = Column(String, primary_key=True)
+    run_id = Column(String, ForeignKey("runs.id"))
+    job_name = Column(String)
+    status = Column(String, default="Created")
+    output_path = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    run = relationship("RunModel", back_populates="prs_jobs")
@@ -0,0 +1,110 @@
+"""Keyset pagination and column projection for list endpoints.
+
+Pages are ordered by ``(created_at, id)`` and continued with an opaque
+cursor encoding the last row's key, so fetching page N costs the same as
+fetching page 1. Only the requested columns are selected.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(created_at: datetime, row_id: Any) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def split_values(value: Optional[str]) -> List[str]:
+    """Split a comma-separated filter value, e.g. ``status=Pass,Warn``"""
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+def parse_fields(fields: Optional[str], columns: Dict[str, Any]) -> List[str]:
+    if not fields:
+        return list(columns)
+    requested = split_values(fields)
+    unknown = [f for f in requested if f not in columns]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(columns)}"
+        )
+    return requested
+
+
+def _page_query(columns, created_col, id_col, filters, limit, cursor, fields):
+    names = parse_fields(fields, columns)
+    query = select(
+        *[columns[name].label(name) for name in names],
+        created_col.label("_created_at"),
+        id_col.label("_id"),
+    ).where(*filters)
+    if cursor:
+        after_created, after_id = decode_cursor(cursor)
+        query = query.where(tuple_(created_col, id_col) > tuple_(
+            literal(after_created, created_col.type), literal(after_id, id_col.type)
+        ))
+    return names, query.order_by(created_col, id_col).limit(limit + 1)
+
+
+def _page(names: List[str], rows, limit: int) -> Dict[str, Any]:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._created_at, rows[-1]._id)
+    return {
+        "items": [{name: getattr(row, name) for name in names} for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+
+def paginate(
+    db: Session,
+    columns: Dict[str, Any],
+    created_col,
+    id_col,
+    filters: List[Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Return ``{"items": [...], "next_cursor": ...}`` for one page.
+
+    ``columns`` maps output field names to column expressions; only those
+    named in ``fields`` (all by default) are selected.
+    """
+    names, query = _page_query(columns, created_col, id_col, filters, limit, cursor, fields)
+    return _page(names, db.execute(query).all(), limit)
+
+
+async def paginate_async(
+    db: AsyncSession,
+    columns: Dict[str, Any],
+    created_col,
+    id_col,
+    filters: List[Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, Any]:
+    """``paginate`` for an ``AsyncSession``."""
+    names, query = _page_query(columns, created_col, id_col, filters, limit, cursor, fields)
+    return _page(names, (await db.execute(query)).all(), limit)
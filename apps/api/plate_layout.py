@@ -0,0 +1,196 @@
+"""Plate and BeadChip geometry, layout validation and auto-assignment.
+
+A plate is modelled as a flat array of well indices (``row * cols + col``)
+and a 24-sample BeadChip as 12 rows x 2 columns of Sentrix positions
+(``R01C01`` .. ``R12C02``). Layouts are validated as NumPy arrays so a
+full 384-well plate costs a handful of vector operations:
+
+    fmt = PLATE_FORMATS["96"]
+    wells, errors = validate_wells(fmt, payload_wells)
+    errors += collision_errors(wells, existing_rows)
+
+``assign`` fills wells row-major, column-major or at random (seeded),
+keeping control aliquots on their pinned wells. Sentrix positions follow
+the physical plate-to-chip transfer: the k-th well in column-major order
+goes to chip ``k // 24``, position ``k % 24`` (chip positions also run
+column-major: R01C01..R12C01, then R01C02..R12C02).
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ROW_LETTERS = "ABCDEFGHIJKLMNOP"
+WELL_RE = re.compile(r"^([A-Pa-p])0?(\d{1,2})$")
+SENTRIX_RE = re.compile(r"^R(\d{2})C(\d{2})$")
+
+BEADCHIP_ROWS = 12
+BEADCHIP_COLS = 2
+BEADCHIP_SIZE = BEADCHIP_ROWS * BEADCHIP_COLS
+
+ORDERS = ("row_major", "column_major", "random")
+
+
+class PlateFormat:
+    def __init__(self, name: str, rows: int, cols: int):
+        self.name = name
+        self.rows = rows
+        self.cols = cols
+        self.size = rows * cols
+
+    def parse_well(self, name: str) -> Optional[int]:
+        """Well index of ``A1`` / ``A01`` style names, or None if not on this plate."""
+        m = WELL_RE.match(name.strip()) if isinstance(name, str) else None
+        if not m:
+            return None
+        row = ROW_LETTERS.index(m.group(1).upper())
+        col = int(m.group(2)) - 1
+        if row >= self.rows or not 0 <= col < self.cols:
+            return None
+        return row * self.cols + col
+
+    def well_name(self, index: int) -> str:
+        return f"{ROW_LETTERS[index // self.cols]}{index % self.cols + 1}"
+
+    def order(self, kind: str) -> np.ndarray:
+        """Well indices in row-major or column-major fill order."""
+        k = np.arange(self.size)
+        if kind == "column_major":
+            return (k % self.rows) * self.cols + k // self.rows
+        return k
+
+    def column_major_rank(self, wells: np.ndarray) -> np.ndarray:
+        """Position of each well index in column-major order."""
+        return (wells % self.cols) * self.rows + wells // self.cols
+
+
+PLATE_FORMATS: Dict[str, PlateFormat] = {
+    "96": PlateFormat("96", 8, 12),
+    "384": PlateFormat("384", 16, 24),
+}
+
+
+def sentrix_position(index: int) -> str:
+    return f"R{index % BEADCHIP_ROWS + 1:02d}C{index // BEADCHIP_ROWS + 1:02d}"
+
+
+def validate_wells(fmt: PlateFormat, wells: Sequence[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Check well names, Sentrix syntax and in-plate duplicates.
+
+    Returns the wells with normalized well names (``A01`` -> ``A1``) and a
+    list of error messages.
+    """
+    errors = []
+    normalized = []
+    indices = np.full(len(wells), -1)
+    for i, w in enumerate(wells):
+        missing = [k for k in ("well", "aliquot_id", "sentrix_barcode", "sentrix_position") if not w.get(k)]
+        if missing:
+            errors.append(f"Well entry {i} is missing {', '.join(missing)}")
+            normalized.append(dict(w))
+            continue
+        index = fmt.parse_well(w["well"])
+        if index is None:
+            errors.append(f"Invalid well {w['well']} for a {fmt.name}-well plate")
+        else:
+            indices[i] = index
+        if not SENTRIX_RE.match(w["sentrix_position"]):
+            errors.append(f"Invalid Sentrix position {w['sentrix_position']} (expected R##C##)")
+        normalized.append({**w, "well": fmt.well_name(index) if index is not None else w["well"]})
+
+    errors += _duplicates(indices[indices >= 0], lambda i: f"Well {fmt.well_name(i)} is used more than once")
+    # Entries missing a barcode or position were reported above; they do not collide
+    sentrix = np.array([f"{w['sentrix_barcode']} {w['sentrix_position']}" for w in normalized
+                        if w.get("sentrix_barcode") and w.get("sentrix_position")], dtype=object)
+    errors += _duplicates(sentrix, lambda key: f"Duplicate Sentrix position {key} on plate")
+    aliquots = np.array([w.get("aliquot_id") for w in normalized if w.get("aliquot_id")], dtype=object)
+    errors += _duplicates(aliquots, lambda a: f"Aliquot {a} is assigned to more than one well")
+    return normalized, errors
+
+
+def _duplicates(values: np.ndarray, message) -> List[str]:
+    if len(values) == 0:
+        return []
+    unique, counts = np.unique(values, return_counts=True)
+    return [message(v) for v in unique[counts > 1]]
+
+
+def collision_errors(wells: Sequence[Dict[str, str]], existing: Sequence[Tuple[str, str, str, str]]) -> List[str]:
+    """Sentrix positions or aliquots of ``wells`` already used on other plates.
+
+    ``existing`` holds (plate_id, aliquot_id, sentrix_barcode, sentrix_position)
+    rows fetched for the barcodes and aliquots of ``wells``.
+    """
+    used_sentrix = {(barcode, position): plate_id for plate_id, _, barcode, position in existing}
+    used_aliquots = {aliquot_id: plate_id for plate_id, aliquot_id, _, _ in existing}
+    errors = []
+    for w in wells:
+        plate_id = used_sentrix.get((w.get("sentrix_barcode"), w.get("sentrix_position")))
+        if plate_id:
+            errors.append(f"Sentrix {w['sentrix_barcode']} {w['sentrix_position']} is already used on plate {plate_id}")
+        plate_id = used_aliquots.get(w.get("aliquot_id"))
+        if plate_id:
+            errors.append(f"Aliquot {w['aliquot_id']} is already on plate {plate_id}")
+    return errors
+
+
+def assign(
+    fmt: PlateFormat,
+    aliquot_ids: Sequence[str],
+    beadchip_barcodes: Sequence[str],
+    order: str = "column_major",
+    controls: Sequence[Dict[str, Optional[str]]] = (),
+    seed: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Lay out ``aliquot_ids`` (and controls) on a plate and its BeadChips.
+
+    Controls with a ``well`` keep it; other controls are placed like
+    samples. Raises ``ValueError`` if the plate or the chips are too small.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order {order!r}; expected one of {', '.join(ORDERS)}")
+    taken = np.zeros(fmt.size, dtype=bool)
+    placed: List[Tuple[int, str]] = []
+    floating = []
+    for control in controls:
+        if control.get("well"):
+            index = fmt.parse_well(control["well"])
+            if index is None:
+                raise ValueError(f"Invalid control well {control['well']} for a {fmt.name}-well plate")
+            if taken[index]:
+                raise ValueError(f"Control well {fmt.well_name(index)} is used more than once")
+            taken[index] = True
+            placed.append((index, control["aliquot_id"]))
+        else:
+            floating.append(control["aliquot_id"])
+
+    to_place = list(aliquot_ids) + floating
+    if order == "random":
+        free = np.flatnonzero(~taken)
+        free = np.random.default_rng(seed).permutation(free)
+    else:
+        fill = fmt.order(order)
+        free = fill[~taken[fill]]
+    if len(to_place) > len(free):
+        raise ValueError(f"{len(to_place) + len(placed)} aliquots do not fit on a {fmt.name}-well plate")
+    placed += list(zip(free[:len(to_place)].tolist(), to_place))
+
+    wells = np.array([index for index, _ in placed], dtype=int)
+    ranks = fmt.column_major_rank(wells)
+    chips = ranks // BEADCHIP_SIZE
+    needed = int(chips.max()) + 1 if len(chips) else 0
+    if needed > len(beadchip_barcodes):
+        raise ValueError(f"Layout needs {needed} BeadChip barcode(s), {len(beadchip_barcodes)} given")
+    positions = ranks % BEADCHIP_SIZE
+
+    layout = [
+        {
+            "well": fmt.well_name(index),
+            "aliquot_id": aliquot_id,
+            "sentrix_barcode": beadchip_barcodes[chip],
+            "sentrix_position": sentrix_position(position),
+        }
+        for (index, aliquot_id), chip, position in zip(placed, chips.tolist(), positions.tolist())
+    ]
+    # Report in plate order (column-major), like the physical transfer
+    return [layout[i] for i in np.argsort(ranks, kind="stable")]
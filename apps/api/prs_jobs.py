@@ -0,0 +1,146 @@
+"""PRS package jobs, run by the job workers (see ``job_queue``).
+
+``build_prs_package`` is the job handler: it moves the PRS job through
+Processing to Completed (or back to Queued / Failed) and writes the
+package with ``PackageWriter``. Workers import this module, not ``app``,
+so a spawned worker does not run the API's startup migrations and
+backfills; it works on the engine its ``JobContext`` carries.
+"""
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import aggregates
+import events
+import job_queue
+import response_cache
+from models import GenotypeMetricsModel, PRSJobModel, SampleModel
+from prs_package import PackageWriter
+
+HANDLER = "prs_jobs:build_prs_package"
+
+PRS_OUTPUT_DIR = os.getenv("PRS_OUTPUT_DIR", "/tmp/prs_output")
+PRS_COMPRESSION = os.getenv("PRS_COMPRESSION", "gzip")  # gzip | zstd | none
+PRS_PARQUET = os.getenv("PRS_PARQUET", "false").lower() in ("1", "true", "yes")
+PRS_CHUNK_ROWS = int(os.getenv("PRS_CHUNK_ROWS", "5000"))
+
+
+def set_prs_status(db: Session, job: PRSJobModel, status: str):
+    aggregates.move(db, aggregates.PRS_STATUS, [("", job.status, status)])
+    response_cache.invalidate(db, response_cache.PRS_JOBS)
+    events.publish(db, events.PRS_JOB_STATUS, {"job_id": job.id, "run_id": job.run_id, "status": status},
+                   run_id=job.run_id)
+    job.status = status
+
+
+def build_prs_package(payload: Dict[str, Any], ctx: job_queue.JobContext):
+    """Job handler: write samples.tsv, metrics.tsv and manifest.md for a PRS job"""
+    db = Session(ctx.engine, autoflush=False)
+    try:
+        job = db.query(PRSJobModel).filter(PRSJobModel.id == payload["job_id"]).first()
+        if not job:
+            return
+        set_prs_status(db, job, "Processing")
+        db.commit()
+        try:
+            output_dir = write_prs_package(db, job)
+        except Exception:
+            db.rollback()
+            set_prs_status(db, job, "Failed" if ctx.is_last_attempt else "Queued")
+            db.commit()
+            raise
+        set_prs_status(db, job, "Completed")
+        job.output_path = str(output_dir)
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_abandoned(payload: Dict[str, Any], ctx: job_queue.JobContext):
+    """The worker died on the last attempt: fail the PRS job it left Processing"""
+    with Session(ctx.engine, autoflush=False) as db:
+        job = db.get(PRSJobModel, payload["job_id"])
+        if job is not None and job.status not in ("Completed", "Failed"):
+            set_prs_status(db, job, "Failed")
+            db.commit()
+
+
+build_prs_package.on_abandoned = mark_abandoned
+
+
+def write_prs_package(db: Session, job: PRSJobModel) -> Path:
+    run_id = job.run_id
+    output_dir = Path(PRS_OUTPUT_DIR) / job.id
+    package = PackageWriter(output_dir, PRS_COMPRESSION)
+    samples_out = package.table("samples.tsv", ["sample_id", "subject_pseudoid", "status", "final_qc_flag"])
+    metrics_out = package.table("metrics.tsv", ["sample_id", "call_rate", "dish_qc", "heterozygosity", "sex_call", "final_qc_flag"])
+    parquet_out = package.parquet("metrics.parquet", {
+        "sample_id": "string",
+        "call_rate": "float64",
+        "dish_qc": "float64",
+        "heterozygosity": "float64",
+        "sex_call": "string",
+        "final_qc_flag": "string"
+    }) if PRS_PARQUET else None
+    
+    # One joined query, streamed in chunks
+    rows = db.execute(
+        select(
+            GenotypeMetricsModel.sample_id,
+            GenotypeMetricsModel.call_rate,
+            GenotypeMetricsModel.dish_qc,
+            GenotypeMetricsModel.heterozygosity,
+            GenotypeMetricsModel.sex_call,
+            GenotypeMetricsModel.qc_flag,
+            SampleModel.id.label("known_sample_id"),
+            SampleModel.subject_pseudoid,
+            SampleModel.status
+        )
+        .outerjoin(SampleModel, SampleModel.id == GenotypeMetricsModel.sample_id)
+        # Eligible (Pass/Warn) rows come straight off the (run_id, qc_flag) index
+        .where(GenotypeMetricsModel.run_id == run_id, GenotypeMetricsModel.qc_flag.in_(["Pass", "Warn"]))
+        .execution_options(yield_per=PRS_CHUNK_ROWS)
+    )
+    
+    total = db.query(func.count(GenotypeMetricsModel.id)).filter(GenotypeMetricsModel.run_id == run_id).scalar()
+    counts = {"Pass": 0, "Warn": 0}
+    try:
+        for chunk in rows.partitions():
+            for m in chunk:
+                counts[m.qc_flag] += 1
+            
+            # samples.tsv and metrics.tsv (only eligible samples)
+            samples_out.write_rows(
+                (m.known_sample_id, m.subject_pseudoid, m.status, m.qc_flag)
+                for m in chunk if m.known_sample_id
+            )
+            metric_rows = [
+                (m.sample_id, m.call_rate, m.dish_qc, m.heterozygosity, m.sex_call, m.qc_flag)
+                for m in chunk
+            ]
+            metrics_out.write_rows(metric_rows)
+            if parquet_out:
+                parquet_out.write_rows(metric_rows)
+    finally:
+        package.close()
+    
+    # Create manifest.md
+    manifest = [
+        "# PRS Package Manifest\n",
+        f"Job ID: {job.id}",
+        f"Run ID: {run_id}",
+        f"Created: {datetime.utcnow().isoformat()}",
+        f"Total Samples: {total}",
+        f"Eligible Samples (Pass/Warn): {counts['Pass'] + counts['Warn']}",
+        f"Pass: {counts['Pass']}",
+        f"Warn: {counts['Warn']}",
+        "",
+        "## Checksums (SHA-256)\n",
+        *[f"{digest}  {name}" for name, digest in sorted(package.checksums.items())]
+    ]
+    package.write_text("manifest.md", "\n".join(manifest) + "\n")
+    return output_dir
@@ -0,0 +1,173 @@
+"""Streaming writer for PRS package files.
+
+Tables are written row batch by row batch through an optional compressor
+(gzip, or zstd when ``zstandard`` is installed), with the SHA-256 of each
+file's bytes computed as they are written. A metrics table can also be
+mirrored to Parquet when ``pyarrow`` is installed. ``stream_tar`` serves a
+finished package directory as an uncompressed tar stream, block by block.
+"""
+import gzip
+import hashlib
+import tarfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+COMPRESSION_SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class HashingFile:
+    """Binary file that tracks the SHA-256 and size of everything written."""
+
+    def __init__(self, path: Path):
+        self._f = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def readable(self) -> bool:
+        return False
+
+
+def _format(value) -> str:
+    return "NA" if value is None or value == "" else str(value)
+
+
+class TableWriter:
+    """A TSV file, optionally compressed, written in row batches."""
+
+    def __init__(self, path: Path, header: Sequence[str], compression: str):
+        self.path = path
+        self.raw = HashingFile(path)
+        if compression == "gzip":
+            # mtime=0 keeps the archive (and its checksum) reproducible
+            self._out = gzip.GzipFile(filename="", mode="wb", fileobj=self.raw, mtime=0)
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("PRS_COMPRESSION=zstd requires the 'zstandard' package")
+            self._out = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self._out = self.raw
+        self.rows = 0
+        self._write_lines(["\t".join(header)])
+
+    def _write_lines(self, lines: List[str]):
+        if lines:
+            self._out.write(("\n".join(lines) + "\n").encode())
+
+    def write_rows(self, rows: Iterable[Sequence]):
+        lines = ["\t".join(_format(v) for v in row) for row in rows]
+        self.rows += len(lines)
+        self._write_lines(lines)
+
+    def close(self) -> str:
+        if self._out is not self.raw:
+            self._out.close()
+        self.raw.close()
+        return self.raw.sha256.hexdigest()
+
+
+class ParquetWriter:
+    """Parquet mirror of a table, one row group per batch."""
+
+    def __init__(self, path: Path, columns: Dict[str, str]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("PRS_PARQUET=true requires the 'pyarrow' package")
+        self._pa = pa
+        self.columns = list(columns)
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in columns.items()])
+        self.raw = HashingFile(path)
+        self._writer = pq.ParquetWriter(self.raw, self.schema, compression="zstd")
+
+    def write_rows(self, rows: Sequence[Sequence]):
+        if rows:
+            data = {name: [row[i] for row in rows] for i, name in enumerate(self.columns)}
+            self._writer.write_table(self._pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self) -> str:
+        self._writer.close()
+        self.raw.close()
+        return self.raw.sha256.hexdigest()
+
+
+class PackageWriter:
+    """Collects the files of one package and their checksums."""
+
+    def __init__(self, output_dir: Path, compression: str = "gzip"):
+        if compression not in COMPRESSION_SUFFIX:
+            raise ValueError(f"Unknown PRS compression {compression!r}")
+        self.output_dir = output_dir
+        self.compression = compression
+        self.checksums: Dict[str, str] = {}
+        self._open: Dict[str, object] = {}
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    def table(self, name: str, header: Sequence[str]) -> TableWriter:
+        filename = name + COMPRESSION_SUFFIX[self.compression]
+        writer = TableWriter(self.output_dir / filename, header, self.compression)
+        self._open[filename] = writer
+        return writer
+
+    def parquet(self, name: str, columns: Dict[str, str]) -> ParquetWriter:
+        writer = ParquetWriter(self.output_dir / name, columns)
+        self._open[name] = writer
+        return writer
+
+    def close(self):
+        for filename, writer in self._open.items():
+            self.checksums[filename] = writer.close()
+        self._open = {}
+
+    def write_text(self, name: str, content: str):
+        (self.output_dir / name).write_text(content)
+
+
+def stream_tar(directory: Path, arcname: str) -> Iterator[bytes]:
+    """Yield a tar archive of ``directory``'s files without buffering whole files."""
+    for path in sorted(p for p in directory.iterdir() if p.is_file()):
+        info = tarfile.TarInfo(f"{arcname}/{path.name}")
+        stat = path.stat()
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(STREAM_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield b"\0" * padding
+    # End-of-archive marker: two zero blocks, padded to a full record
+    yield b"\0" * tarfile.RECORDSIZE
+
@@ -0,0 +1,214 @@
+"""QC banding rules compiled from versioned threshold profiles.
+
+A profile is a named set of thresholds (optionally tagged with an assay
+and clinic). Profiles are stored in ``qc_profiles`` and never edited in
+place: saving a profile under an existing name creates the next version,
+so every stored QC flag can name the exact thresholds (``name@version``)
+that produced it.
+
+``ProfileStore.compiled`` turns a profile into NumPy classifiers that band
+whole batches at once::
+
+    rules = store.compiled("default")          # or "name@version"
+    flags = rules.genotype(call_rates, dish_qcs)   # array of Pass/Warn/Fail
+"""
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, case, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+DEFAULT_PROFILE = "default"
+SAVE_ATTEMPTS = 5
+
+metadata = MetaData()
+
+qc_profiles = Table(
+    "qc_profiles",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("version", Integer, primary_key=True),
+    Column("assay", String, nullable=True),
+    Column("clinic_id", String, nullable=True),
+    Column("thresholds", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+
+class Thresholds(BaseModel):
+    dna_min_conc: float = 20
+    dna_warn_fraction: float = 0.7  # Warn if conc >= fraction * min
+    a260_280_min: float = 1.7
+    a260_280_max: float = 2.1
+    a260_280_target: float = 1.9
+    a260_280_warn_delta: float = 0.3  # Warn if |A260/280 - target| <= delta
+    a260_230_min: float = 1.8
+    a260_230_warn_fraction: float = 0.9
+    callrate_min: float = 0.98
+    callrate_fail: float = 0.97  # below this is Fail regardless of DishQC
+    dishqc_min: float = 0.82
+
+
+class ProfileIn(BaseModel):
+    name: str
+    assay: Optional[str] = None
+    clinic_id: Optional[str] = None
+    thresholds: Thresholds
+
+
+class Profile(ProfileIn):
+    version: int
+    created_at: datetime
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+
+class CompiledProfile:
+    """Vectorized Pass/Warn/Fail classifiers for one profile."""
+
+    def __init__(self, profile: Profile):
+        self.profile = profile
+        self.key = profile.key
+        self.t = profile.thresholds
+
+    def dna(self, concentration, a260_280, a260_230) -> np.ndarray:
+        t = self.t
+        conc = np.asarray(concentration, dtype=float)
+        r280 = np.asarray(a260_280, dtype=float)
+        r230 = np.asarray(a260_230, dtype=float)
+        conc_low = conc < t.dna_min_conc
+        r280_out = ~((t.a260_280_min <= r280) & (r280 <= t.a260_280_max))
+        r230_low = r230 < t.a260_230_min
+        # First matching condition wins, as in the original if/elif chain
+        return np.select(
+            [
+                conc_low & (conc >= t.dna_min_conc * t.dna_warn_fraction),
+                conc_low,
+                r280_out & (np.abs(r280 - t.a260_280_target) <= t.a260_280_warn_delta),
+                r280_out,
+                r230_low & (r230 >= t.a260_230_min * t.a260_230_warn_fraction),
+                r230_low,
+            ],
+            ["Warn", "Fail", "Warn", "Fail", "Warn", "Fail"],
+            default="Pass",
+        )
+
+    def genotype(self, call_rate, dish_qc) -> np.ndarray:
+        t = self.t
+        cr = np.asarray(call_rate, dtype=float)
+        dq = np.asarray(dish_qc, dtype=float)
+        dish_ok = dq >= t.dishqc_min
+        return np.select(
+            [
+                (cr < t.callrate_fail) | (dq < t.dishqc_min),
+                (cr < t.callrate_min) & dish_ok,
+                (cr >= t.callrate_min) & dish_ok,
+            ],
+            ["Fail", "Warn", "Pass"],
+            default="Fail",
+        )
+
+    def genotype_sql(self, call_rate, dish_qc):
+        """The genotype classifier as a SQL CASE over two column expressions."""
+        t = self.t
+        return case(
+            ((call_rate < t.callrate_fail) | (dish_qc < t.dishqc_min), "Fail"),
+            ((call_rate < t.callrate_min) & (dish_qc >= t.dishqc_min), "Warn"),
+            ((call_rate >= t.callrate_min) & (dish_qc >= t.dishqc_min), "Pass"),
+            else_="Fail",
+        )
+
+
+class ProfileStore:
+    """Reads and versions profiles; compiled profiles are cached per version."""
+
+    def __init__(self, engine: Engine, default_thresholds: Thresholds):
+        self.engine = engine
+        self._compiled: Dict[Tuple[str, int], CompiledProfile] = {}
+        metadata.create_all(bind=engine)
+        # Environment overrides become a new version of the default profile
+        self.save(ProfileIn(name=DEFAULT_PROFILE, thresholds=default_thresholds), if_changed=True)
+
+    def _from_row(self, row) -> Profile:
+        return Profile(
+            name=row.name,
+            version=row.version,
+            assay=row.assay,
+            clinic_id=row.clinic_id,
+            thresholds=Thresholds(**json.loads(row.thresholds)),
+            created_at=row.created_at,
+        )
+
+    def get(self, name: str, version: Optional[int] = None) -> Optional[Profile]:
+        query = select(qc_profiles).where(qc_profiles.c.name == name)
+        if version is None:
+            query = query.order_by(qc_profiles.c.version.desc()).limit(1)
+        else:
+            query = query.where(qc_profiles.c.version == version)
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+        return self._from_row(row) if row else None
+
+    def list(self, latest_only: bool = False) -> List[Profile]:
+        query = select(qc_profiles).order_by(qc_profiles.c.name, qc_profiles.c.version)
+        with self.engine.connect() as conn:
+            profiles = [self._from_row(row) for row in conn.execute(query)]
+        if latest_only:
+            latest = {p.name: p for p in profiles}
+            profiles = list(latest.values())
+        return profiles
+
+    def save(self, profile: ProfileIn, if_changed: bool = False) -> Profile:
+        """Store ``profile`` as the next version of its name.
+
+        Concurrent saves (API workers starting together) race for the same
+        ``(name, version)`` key: SQLite takes the write lock before reading
+        the latest version, other backends retry on the key conflict. With
+        ``if_changed`` a latest version equal to ``profile`` is returned
+        instead of adding one.
+        """
+        for attempt in range(SAVE_ATTEMPTS):
+            try:
+                with self.engine.begin() as conn:
+                    if conn.dialect.name == "sqlite":
+                        conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    latest = conn.execute(
+                        select(qc_profiles).where(qc_profiles.c.name == profile.name)
+                        .order_by(qc_profiles.c.version.desc()).limit(1)
+                    ).first()
+                    if if_changed and latest is not None:
+                        current = self._from_row(latest)
+                        if ProfileIn(**current.model_dump()) == profile:
+                            return current
+                    row = {
+                        "name": profile.name,
+                        "version": (latest.version if latest is not None else 0) + 1,
+                        "assay": profile.assay,
+                        "clinic_id": profile.clinic_id,
+                        "thresholds": profile.thresholds.model_dump_json(),
+                        "created_at": datetime.utcnow(),
+                    }
+                    conn.execute(qc_profiles.insert().values(**row))
+                return Profile(**{**row, "thresholds": profile.thresholds})
+            except IntegrityError:
+                if attempt == SAVE_ATTEMPTS - 1:
+                    raise
+
+    def compiled(self, ref: Optional[str] = None) -> Optional[CompiledProfile]:
+        """Resolve ``name`` or ``name@version`` (default: latest default profile)."""
+        name, _, version = (ref or DEFAULT_PROFILE).partition("@")
+        if version and not version.isdigit():
+            return None
+        profile = self.get(name, int(version) if version else None)
+        if profile is None:
+            return None
+        cache_key = (profile.name, profile.version)
+        if cache_key not in self._compiled:
+            self._compiled[cache_key] = CompiledProfile(profile)
+        return self._compiled[cache_key]
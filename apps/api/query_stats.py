@@ -0,0 +1,71 @@
+"""SQL statement counting and timing hooked into SQLAlchemy engine events.
+
+``install(engine)`` registers the listeners; statements (and the time
+spent executing them) are attributed to every active ``count_queries()``
+block of the current context, innermost first (the context is shared
+with the threadpool worker that runs a sync endpoint). A test can thus
+wrap a request the middleware already counts.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    def __init__(self, keep_statements: bool = False, outer: Optional["QueryCounter"] = None):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_statements = keep_statements
+        self.statements: List[str] = []
+        self.outer = outer
+
+
+_current: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is not None:
+        context._query_started = time.perf_counter()
+    while counter is not None:
+        counter.count += 1
+        if counter.keep_statements:
+            counter.statements.append(statement)
+        counter = counter.outer
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    counter = _current.get()
+    while counter is not None:
+        counter.seconds += elapsed
+        counter = counter.outer
+
+
+def install(engine: Engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def count_queries(keep_statements: bool = False):
+    """Count SQL statements executed inside the block.
+
+        with count_queries() as q:
+            client.get("/samples")
+        assert q.count == 2
+    """
+    counter = QueryCounter(keep_statements, _current.get())
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
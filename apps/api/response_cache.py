@@ -0,0 +1,202 @@
+"""Response caching for polled read endpoints, invalidated by tag.
+
+Every cacheable response depends on one or more tags (``runs``,
+``plates``, ...). ``cache_tags`` keeps a version per tag, bumped by the
+writers in the same transaction as the rows they change:
+
+    response_cache.invalidate(db, response_cache.RUNS)
+
+A cached GET reads its tags' versions (one small query), derives the ETag
+from the route, query string and versions, and answers ``If-None-Match``
+with 304 or serves the body stored under that ETag; only a miss runs the
+endpoint's own queries. Because the versions live in the database,
+invalidation also reaches other API processes and the PRS job workers,
+and a body cached under old versions is simply never asked for again.
+
+Bodies are kept in a ``CacheBackend``: ``MemoryBackend`` (LRU with TTL,
+per process) by default, or ``SQLiteBackend``, a stand-in for a shared
+cache such as Redis that all processes on a host can use.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.engine import Engine
+
+from database import upsert
+
+SETTINGS = "settings"
+RUNS = "runs"
+PLATES = "plates"
+PRS_JOBS = "prs_jobs"
+
+metadata = MetaData()
+
+cache_tags = Table(
+    "cache_tags",
+    metadata,
+    Column("tag", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def invalidate(conn, *tags: str):
+    """Bump the version of ``tags``; ``conn`` is a Connection or Session, the caller commits."""
+    rows = [{"tag": tag, "version": 1} for tag in sorted(set(tags))]
+    upsert(conn, cache_tags, ("tag",), rows, set_=lambda new: {"version": cache_tags.c.version + 1})
+
+
+def tag_versions(conn, tags: Iterable[str]) -> Dict[str, int]:
+    """Current version of each tag (0 if never bumped)."""
+    tags = sorted(set(tags))
+    found = dict(conn.execute(select(cache_tags.c.tag, cache_tags.c.version).where(cache_tags.c.tag.in_(tags))).all())
+    return {tag: found.get(tag, 0) for tag in tags}
+
+
+def etag(key: str, versions: Dict[str, int]) -> str:
+    h = hashlib.sha256(key.encode())
+    for tag, version in sorted(versions.items()):
+        h.update(f"\n{tag}={version}".encode())
+    return f'"{h.hexdigest()[:32]}"'
+
+
+class CacheBackend:
+    """Stores one ``(etag, body)`` per key for up to ``ttl`` seconds."""
+
+    blocking = False  # get/set do I/O: async callers run them in the threadpool
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        raise NotImplementedError
+
+    def set(self, key: str, tag: str, body: bytes, ttl: float):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU; entries also expire after their TTL."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, tag, body = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return tag, body
+
+    def set(self, key, tag, body, ttl):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, tag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend(CacheBackend):
+    """Entries in a separate SQLite file shared by every process on the host.
+
+    Kept out of the LIMS database so cache writes never wait on (or hold)
+    its write lock. Expired entries are dropped on read and pruned on write.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache "
+                "(key TEXT PRIMARY KEY, etag TEXT NOT NULL, body BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connect().execute(
+                "SELECT etag, body FROM response_cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None  # a busy shared cache only costs a miss
+        return (row[0], bytes(row[1])) if row else None
+
+    def set(self, key, tag, body, ttl):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)", (key, tag, body, time.time() + ttl))
+            self._writes += 1
+            if self._writes % 64 == 0:
+                conn.execute("DELETE FROM response_cache WHERE expires <= ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                    "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+                )
+        except sqlite3.OperationalError:
+            pass
+
+
+def backend_from_url(url: str, max_entries: int) -> CacheBackend:
+    """``memory`` (default) or ``sqlite:///path/to/cache.db``."""
+    if not url or url == "memory":
+        return MemoryBackend(max_entries)
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):], max_entries)
+    raise ValueError(f"Unsupported RESPONSE_CACHE_BACKEND {url!r}; expected memory or sqlite:///path")
+
+
+class ResponseCache:
+    """Bodies by (key, ETag) in a backend, with hit / miss / 304 counts."""
+
+    def __init__(self, backend: CacheBackend, ttl: float = 60.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, tag: str) -> Optional[bytes]:
+        entry = self.backend.get(key) if self.ttl > 0 else None
+        hit = entry is not None and entry[0] == tag
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1] if hit else None
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def put(self, key: str, tag: str, body: bytes):
+        if self.ttl > 0:
+            self.backend.set(key, tag, body, self.ttl)
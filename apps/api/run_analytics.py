@@ -0,0 +1,268 @@
+"""Per-run genotype outlier analytics, recomputed after every metrics upload.
+
+A run's metrics are loaded once, joined to each sample's plate well and
+Sentrix position on the run's BeadChips, and analysed as NumPy arrays:
+
+    result = run_analytics.analyze(run_id, columns)
+    run_analytics.store(db, run_id, result)
+
+* heterozygosity outliers: robust z against the run, ``(het - median) /
+  (1.4826 * MAD)``, beyond ``HET_Z`` either way (contamination high, low
+  quality or relatedness low);
+* call-rate z-scores of each sample against its plate and its BeadChip
+  (same robust z, low side only), and of each plate, BeadChip, Sentrix row
+  and column against the run, using the standard error of a median,
+  ``1.2533 * sigma / sqrt(n)``. A plate or chip that failed as a whole has
+  normal within-group scores but a low group score;
+* plate-edge effects: edge against interior wells per plate;
+* sex discordance, from the reported ``sex_concordance``, and the spread of
+  ``sex_call`` values.
+
+Medians and MADs per group come from one ``lexsort`` over (group, value),
+so a 10k-sample run is analysed in a few milliseconds; loading the rows
+dominates. The result is stored as JSON in ``run_analytics`` (one row per
+run) and served as is by ``GET /runs/{run_id}/analytics``.
+"""
+import json
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, select
+from sqlalchemy.engine import Engine
+
+from database import upsert
+
+from plate_layout import PLATE_FORMATS, ROW_LETTERS, SENTRIX_RE, WELL_RE
+
+HET_Z = 3.0  # |robust z| of heterozygosity against the run
+CALL_RATE_Z = 3.0  # robust z of a sample's call rate below its plate / BeadChip
+GROUP_Z = 3.0  # z of a group's median call rate below the run's
+MIN_GROUP_SIZE = 8  # smaller plates/chips get no within-group scores
+MIN_SIGMA = 1e-3  # floor for robust sigmas of tightly clustered values
+
+MAD_SCALE = 1.4826  # MAD -> sigma for normal data
+MEDIAN_SE = 1.2533  # standard error of a median, in sigma / sqrt(n)
+
+DISCORDANT = ("false", "no", "n", "0", "mismatch", "discordant", "fail")
+CONCORDANT = ("true", "yes", "y", "1", "match", "concordant", "pass")
+SEX_CALLS = {"m": "male", "male": "male", "xy": "male", "f": "female", "female": "female", "xx": "female"}
+
+# Loaded per sample by the caller, in this order
+COLUMNS = ("sample_id", "call_rate", "heterozygosity", "sex_call", "sex_concordance",
+           "plate_id", "plate_format", "well", "sentrix_barcode", "sentrix_position")
+
+metadata = MetaData()
+
+run_analytics = Table(
+    "run_analytics",
+    metadata,
+    Column("run_id", String, primary_key=True),
+    Column("samples", Integer, nullable=False),
+    Column("outliers", Integer, nullable=False),
+    Column("result", Text, nullable=False),
+    Column("computed_at", DateTime, nullable=False),
+)
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def group_medians(values: np.ndarray, groups: np.ndarray, n_groups: int):
+    """(median, count) of ``values`` per group index; NaN medians for empty groups."""
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(n_groups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    medians[has] = (ordered[lo] + ordered[hi]) / 2
+    return medians, counts
+
+
+def robust_scores(values: np.ndarray, groups: np.ndarray, n_groups: int):
+    """Robust z of each value against its group, and the groups' (median, sigma, count)."""
+    medians, counts = group_medians(values, groups, n_groups)
+    mads, _ = group_medians(np.abs(values - medians[groups]), groups, n_groups)
+    sigmas = np.maximum(MAD_SCALE * mads, MIN_SIGMA)
+    z = (values - medians[groups]) / sigmas[groups]
+    z[counts[groups] < MIN_GROUP_SIZE] = np.nan
+    return z, medians, sigmas, counts
+
+
+def _round(x, digits: int = 4) -> Optional[float]:
+    return None if x is None or not np.isfinite(x) else round(float(x), digits)
+
+
+def categories(values: np.ndarray):
+    """(distinct strings, code per value) of an object array; None and "" get code -1."""
+    filled = np.where(values == None, "", values).astype(str)  # noqa: E711 (elementwise)
+    names, codes = np.unique(filled, return_inverse=True)
+    codes[filled == ""] = -1
+    return names, codes
+
+
+def _group_effects(names: np.ndarray, codes: np.ndarray, call_rate: np.ndarray, center: float, sigma: float,
+                   key: str) -> List[Dict]:
+    """Median call rate per group and its z against the run."""
+    placed = (codes >= 0) & np.isfinite(call_rate)
+    medians, counts = group_medians(call_rate[placed], codes[placed], len(names))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (medians - center) / (MEDIAN_SE * sigma / np.sqrt(counts))
+    return [{key: str(name), "samples": int(n), "call_rate_median": _round(m), "z": _round(s, 2),
+             "low": bool(s < -GROUP_Z)}
+            for name, n, m, s in zip(names, counts, medians, z) if n]
+
+
+def _parse(names: np.ndarray, codes: np.ndarray, pattern) -> np.ndarray:
+    """(n, 2) integer groups of ``pattern`` per value (parsed once per distinct name), -1 where no match."""
+    parsed = np.full((len(names) + 1, 2), -1)
+    for i, name in enumerate(names):
+        m = pattern.match(name)
+        if m:
+            parsed[i] = [ROW_LETTERS.find(m.group(1).upper()) if m.group(1).isalpha() else int(m.group(1)),
+                         int(m.group(2))]
+    return parsed[codes]  # code -1 selects the last row, left at -1
+
+
+def edge_wells(wells: np.ndarray, formats: np.ndarray) -> np.ndarray:
+    """1 for wells on the plate's outer rows/columns, 0 inside, -1 where unknown."""
+    well_rc = _parse(*categories(wells), WELL_RE)
+    format_names, format_codes = categories(formats)
+    shapes = np.array([[f.rows, f.cols] for f in (PLATE_FORMATS.get(n, PLATE_FORMATS["96"]) for n in format_names)]
+                      + [[PLATE_FORMATS["96"].rows, PLATE_FORMATS["96"].cols]])  # NULL format: 96
+    n_rows, n_cols = shapes[format_codes].T
+    row, col = well_rc[:, 0], well_rc[:, 1] - 1
+    ok = (row >= 0) & (row < n_rows) & (col >= 0) & (col < n_cols)
+    edge = (row == 0) | (row == n_rows - 1) | (col == 0) | (col == n_cols - 1)
+    return np.where(ok, edge.astype(int), -1)
+
+
+def _plate_edges(names: np.ndarray, codes: np.ndarray, edge: np.ndarray, call_rate: np.ndarray,
+                 sigma: float) -> Dict[str, Dict]:
+    """Edge vs interior median call rate per plate, with the z of the difference."""
+    known = (codes >= 0) & (edge >= 0) & np.isfinite(call_rate)
+    medians, counts = group_medians(call_rate[known], codes[known] * 2 + edge[known], 2 * len(names))
+    interior, edges = medians[0::2], medians[1::2]
+    n_interior, n_edge = counts[0::2], counts[1::2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (edges - interior) / (MEDIAN_SE * sigma * np.sqrt(1 / n_edge + 1 / n_interior))
+    return {str(name): {"edge_samples": int(ne), "edge_call_rate_median": _round(e),
+                        "interior_samples": int(ni), "interior_call_rate_median": _round(i),
+                        "edge_z": _round(s, 2), "edge_effect": bool(s < -GROUP_Z)}
+            for name, ne, e, ni, i, s in zip(names, n_edge, edges, n_interior, interior, z) if ne + ni}
+
+
+def analyze(run_id: str, columns: Dict[str, Sequence]) -> Dict:
+    """Outlier analytics of one run from per-sample ``COLUMNS`` (one entry per sample and well)."""
+    # A sample placed twice on the run's chips keeps one well; samples come out sorted
+    _, first = np.unique(np.asarray(columns["sample_id"], dtype=str), return_index=True)
+    col = {name: np.asarray(columns[name], dtype=object)[first] for name in COLUMNS}
+    n = len(first)
+    call_rate = np.array(col["call_rate"], dtype=float)
+    het = np.array(col["heterozygosity"], dtype=float)
+
+    # Heterozygosity against the whole run
+    het_z = np.full(n, np.nan)
+    has_het = np.flatnonzero(np.isfinite(het))
+    het_summary = {"samples": int(len(has_het))}
+    if len(has_het):
+        z, med, sig, _ = robust_scores(het[has_het], np.zeros(len(has_het), dtype=int), 1)
+        het_z[has_het] = z
+        het_summary.update(median=_round(med[0]), sigma=_round(sig[0]),
+                           low=_round(med[0] - HET_Z * sig[0]), high=_round(med[0] + HET_Z * sig[0]))
+    het_out = np.abs(het_z) > HET_Z
+    het_summary["outliers"] = int(het_out.sum())
+
+    # Call rate against the run, each plate and each BeadChip
+    finite = np.isfinite(call_rate)
+    run_center, run_sigma = np.nan, np.nan
+    if finite.any():
+        run_center = float(np.median(call_rate[finite]))
+        run_sigma = max(MAD_SCALE * float(np.median(np.abs(call_rate[finite] - run_center))), MIN_SIGMA)
+    plates, plate_codes = categories(col["plate_id"])
+    chips, chip_codes = categories(col["sentrix_barcode"])
+    z_plate, z_chip = np.full(n, np.nan), np.full(n, np.nan)
+    for z, names, codes in ((z_plate, plates, plate_codes), (z_chip, chips, chip_codes)):
+        placed = (codes >= 0) & finite
+        z[placed] = robust_scores(call_rate[placed], codes[placed], len(names))[0]
+
+    # Sentrix rows/columns and plate edges
+    sentrix_rc = _parse(*categories(col["sentrix_position"]), SENTRIX_RE)
+    edge = edge_wells(col["well"], col["plate_format"])
+    axes = {}
+    for axis, prefix in ((0, "R"), (1, "C")):
+        names = np.array([f"{prefix}{k:02d}" for k in range(sentrix_rc[:, axis].max(initial=0) + 1)])
+        axes[axis] = _group_effects(names, sentrix_rc[:, axis], call_rate, run_center, run_sigma,
+                                    "row" if axis == 0 else "column")
+
+    # Sex: classify each distinct reported value once
+    concordance_names, concordance_codes = categories(col["sex_concordance"])
+    discordant_name = np.append(np.isin(np.char.lower(np.char.strip(concordance_names)), DISCORDANT), False)
+    concordant_name = np.append(np.isin(np.char.lower(np.char.strip(concordance_names)), CONCORDANT), False)
+    discordant = discordant_name[concordance_codes]
+    call_names, call_codes = categories(col["sex_call"])
+    call_labels = [SEX_CALLS.get(c.strip().lower(), "ambiguous") for c in call_names] + ["missing"]
+    sex_calls = Counter()
+    for label, count in zip(call_labels, np.bincount(call_codes % (len(call_names) + 1), minlength=len(call_labels))):
+        if count:
+            sex_calls[label] += int(count)
+
+    flags = {
+        "heterozygosity_high": het_out & (het_z > 0),
+        "heterozygosity_low": het_out & (het_z < 0),
+        "call_rate_low_vs_plate": z_plate < -CALL_RATE_Z,
+        "call_rate_low_vs_beadchip": z_chip < -CALL_RATE_Z,
+        "sex_discordant": discordant,
+    }
+    flagged = np.flatnonzero(np.logical_or.reduce(list(flags.values())))
+    outliers = [{
+        "sample_id": col["sample_id"][i],
+        "reasons": [reason for reason, mask in flags.items() if mask[i]],
+        "call_rate": _round(call_rate[i]),
+        "heterozygosity": _round(het[i]),
+        "heterozygosity_z": _round(het_z[i], 2),
+        "call_rate_z_plate": _round(z_plate[i], 2),
+        "call_rate_z_beadchip": _round(z_chip[i], 2),
+        **{k: col[k][i] for k in ("sex_call", "sex_concordance", "plate_id", "well", "sentrix_barcode",
+                                  "sentrix_position")},
+    } for i in flagged]
+
+    edges = _plate_edges(plates, plate_codes, edge, call_rate, run_sigma)
+    return {
+        "run_id": run_id,
+        "computed_at": datetime.utcnow().isoformat(),
+        "samples": n,
+        "placed": int((chip_codes >= 0).sum()),
+        "thresholds": {"het_z": HET_Z, "call_rate_z": CALL_RATE_Z, "group_z": GROUP_Z,
+                       "min_group_size": MIN_GROUP_SIZE},
+        "call_rate": {"median": _round(run_center), "sigma": _round(run_sigma)},
+        "heterozygosity": het_summary,
+        "sex": {
+            "discordant": int(discordant.sum()),
+            "concordant": int(concordant_name[concordance_codes].sum()),
+            "calls": dict(sex_calls),
+        },
+        "plates": [{**p, **edges.get(p["plate_id"], {})}
+                   for p in _group_effects(plates, plate_codes, call_rate, run_center, run_sigma, "plate_id")],
+        "beadchips": _group_effects(chips, chip_codes, call_rate, run_center, run_sigma, "barcode"),
+        "sentrix_rows": axes[0],
+        "sentrix_columns": axes[1],
+        "outliers": outliers,
+    }
+
+
+def store(conn, run_id: str, result: Dict):
+    """Replace the run's stored analytics; ``conn`` is a Connection or Session, the caller commits."""
+    row = {"run_id": run_id, "samples": result["samples"], "outliers": len(result["outliers"]),
+           "result": json.dumps(result), "computed_at": datetime.utcnow()}
+    upsert(conn, run_analytics, ("run_id",), [row])
+
+
+def read(conn, run_id: str) -> Optional[str]:
+    """The stored analytics JSON of a run, or None."""
+    return conn.execute(select(run_analytics.c.result).where(run_analytics.c.run_id == run_id)).scalar()
@@ -0,0 +1,169 @@
+"""Sample status state machine.
+
+``TRANSITIONS`` maps each status to the statuses a sample may move to it
+from. ``transition`` applies a move to a whole batch of samples with
+set-based statements, so plating 384 samples or banding a run is a fixed
+number of statements however many samples move:
+
+    INSERT INTO sample_status_history (...) SELECT ... WHERE id IN (...) AND status IN (allowed)
+    UPDATE samples SET status = :to WHERE id IN (...) AND status IN (allowed) RETURNING id
+
+Samples whose current status does not allow the move are left alone and
+reported as not moved. ``sample_status_history`` is append-only: one row
+per actual change (and per created sample), never updated. The moving
+rows are read (and locked) first so the per-status dashboard counters and
+the turnaround histogram are adjusted in the same transaction. Turnaround
+is sample receipt (``created_at``) to its first move to Genotyped, from
+Plated or Hold for QA; a sample genotyped again after re-plating or QA
+review is not counted a second time.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Collection, Dict, FrozenSet, Iterable, List, Optional
+
+from sqlalchemy import (
+    Column, DateTime, Index, Integer, MetaData, String, Table, column, insert, literal, select, table, update
+)
+from sqlalchemy.engine import Engine
+
+import aggregates
+import events
+
+RECEIVED = "Received"
+ACCESSIONED = "Accessioned"
+EXTRACTION = "Extraction"
+DNA_READY = "DNA Ready"
+PLATED = "Plated"
+GENOTYPED = "Genotyped"
+HOLD_FOR_QA = "Hold for QA"
+
+STATUSES = [RECEIVED, ACCESSIONED, EXTRACTION, DNA_READY, PLATED, GENOTYPED, HOLD_FOR_QA]
+
+# target status -> statuses a sample may move to it from
+TRANSITIONS: Dict[str, FrozenSet[str]] = {
+    RECEIVED: frozenset(),
+    ACCESSIONED: frozenset({RECEIVED}),
+    EXTRACTION: frozenset({ACCESSIONED, DNA_READY, HOLD_FOR_QA}),  # re-extraction after QC
+    DNA_READY: frozenset({EXTRACTION, HOLD_FOR_QA}),
+    PLATED: frozenset({DNA_READY}),
+    GENOTYPED: frozenset({PLATED, HOLD_FOR_QA}),
+    HOLD_FOR_QA: frozenset({EXTRACTION, DNA_READY, PLATED, GENOTYPED}),
+}
+
+metadata = MetaData()
+
+status_history = Table(
+    "sample_status_history",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sample_id", String, nullable=False),
+    Column("from_status", String, nullable=True),  # NULL when the sample was created
+    Column("to_status", String, nullable=False),
+    Column("reason", String, nullable=True),
+    Column("changed_at", DateTime, nullable=False),
+    Index("ix_sample_status_history_sample_id", "sample_id", "id"),
+    Index("ix_sample_status_history_changed_at", "changed_at"),
+)
+
+# Only the columns the state machine touches; the full model lives in app.py
+samples = table("samples", column("id", String), column("status", String), column("created_at", DateTime))
+
+
+def create_tables(engine: Engine):
+    metadata.create_all(bind=engine)
+
+
+def allowed_from(to_status: str) -> FrozenSet[str]:
+    if to_status not in TRANSITIONS:
+        raise ValueError(f"Unknown sample status {to_status!r}")
+    return TRANSITIONS[to_status]
+
+
+def record_created(conn, sample_ids: Iterable[str], status: str = RECEIVED, reason: Optional[str] = None):
+    """History rows (and a ``sample.status`` event) for newly inserted samples."""
+    now = datetime.utcnow()
+    rows = [{"sample_id": sid, "from_status": None, "to_status": status, "reason": reason, "changed_at": now}
+            for sid in sample_ids]
+    if rows:
+        conn.execute(insert(status_history), rows)
+        aggregates.bump(conn, aggregates.SAMPLE_STATUS, {status: len(rows)})
+        events.publish(conn, events.SAMPLE_STATUS, {
+            "status": status, "reason": reason, **events.id_list([r["sample_id"] for r in rows])
+        })
+
+
+def transition(conn, sample_ids: Iterable[str], to_status: str, reason: Optional[str] = None,
+               only_from: Optional[Collection[str]] = None, run_id: Optional[str] = None,
+               plate_id: Optional[str] = None) -> List[str]:
+    """Move ``sample_ids`` to ``to_status`` where the transition is legal.
+
+    ``conn`` is a Connection or Session; the caller commits. ``only_from``
+    narrows the legal source statuses further. Returns the IDs that moved.
+    ``run_id`` / ``plate_id`` tag the published ``sample.status`` event so
+    ``/events`` subscribers can filter on them.
+    """
+    sources = allowed_from(to_status)
+    if only_from is not None:
+        sources = sources & frozenset(only_from)
+    ids = list(set(sample_ids))
+    if not ids or not sources:
+        return []
+    where = (samples.c.id.in_(ids), samples.c.status.in_(sorted(sources)))
+    current = conn.execute(
+        select(samples.c.id, samples.c.status, samples.c.created_at).where(*where).with_for_update()
+    ).all()
+    if not current:
+        return []
+    now = datetime.utcnow()
+    genotyped_before = set()
+    if to_status == GENOTYPED:
+        genotyped_before = set(conn.execute(
+            select(status_history.c.sample_id).distinct()
+            .where(status_history.c.sample_id.in_([sid for sid, _, _ in current]),
+                   status_history.c.to_status == GENOTYPED)
+        ).scalars())
+    conn.execute(insert(status_history).from_select(
+        ["sample_id", "from_status", "to_status", "reason", "changed_at"],
+        select(
+            samples.c.id,
+            samples.c.status,
+            literal(to_status, String),
+            literal(reason, String),
+            literal(now, DateTime),
+        ).where(*where)
+    ))
+    moved = list(conn.execute(
+        update(samples).where(*where).values(status=to_status).returning(samples.c.id)
+    ).scalars())
+
+    moved_set = set(moved)
+    deltas = Counter({to_status: len(moved)})
+    deltas.subtract(status for sid, status, _ in current if sid in moved_set)
+    aggregates.bump(conn, aggregates.SAMPLE_STATUS, deltas)
+    if to_status == GENOTYPED:
+        aggregates.record_turnaround(conn, [
+            (now - created_at).total_seconds()
+            for sid, _, created_at in current
+            if sid in moved_set and sid not in genotyped_before and created_at is not None
+        ])
+    if moved:
+        events.publish(conn, events.SAMPLE_STATUS, {"status": to_status, "reason": reason, **events.id_list(moved)},
+                       run_id=run_id, plate_id=plate_id)
+    return moved
+
+
+def transition_each(conn, targets: Dict[str, str], reason: Optional[str] = None,
+                    only_from: Optional[Collection[str]] = None, run_id: Optional[str] = None) -> List[str]:
+    """Apply a ``{sample_id: to_status}`` map, one ``transition`` per distinct target."""
+    moved = []
+    for to_status in set(targets.values()):
+        moved += transition(conn, [sid for sid, st in targets.items() if st == to_status], to_status, reason,
+                            only_from, run_id=run_id)
+    return moved
+
+
+def history(conn, sample_id: str) -> List[dict]:
+    rows = conn.execute(
+        select(status_history).where(status_history.c.sample_id == sample_id).order_by(status_history.c.id)
+    ).mappings()
+    return [dict(r) for r in rows]
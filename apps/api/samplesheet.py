@@ -0,0 +1,122 @@
+"""Illumina SampleSheet rendering with content-addressed caching.
+
+Every plate stores ``wells_hash``, a digest of its name and well contents
+written together with the wells. A sheet's ETag is that digest plus the
+sheet date, so a conditional GET can be answered from the ``plates`` row
+alone, and a cached sheet is never served after its wells change: the
+new digest simply misses the cache.
+
+Sheets are rendered line block by line block while the rows are streamed
+from the database, so a large run is never held in memory; the rendered
+text is cached (LRU, ``SAMPLESHEET_CACHE_SIZE`` entries) once the stream
+has been fully produced.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import AsyncIterable, AsyncIterator, Hashable, Iterable, Optional, Sequence, Tuple
+
+RENDER_BLOCK_ROWS = 500
+
+DATA_COLUMNS = "Sample_ID,SentrixBarcode_A,SentrixPosition_A,Sample_Plate,Sample_Well"
+
+
+def header(sheet_date: date) -> str:
+    return (
+        "[Header]\n"
+        f"Date,{sheet_date.strftime('%m/%d/%Y')}\n"
+        "Workflow,GenerateFASTQ\n"
+        "Application,FASTQ Only\n"
+        "Instrument Type,iScan\n"
+        "Assay,Infinium Global Screening Array-24 v3.0\n"
+        "Index Adapters,Illumina Infinium\n\n"
+        "[Manifests]\n"
+        "A,GSA-24v3-0_A1.bpm\n\n"
+        "[Data]\n"
+        f"{DATA_COLUMNS}\n"
+    )
+
+
+def wells_digest(plate_name: str, wells: Iterable[Sequence]) -> str:
+    """Digest of a plate's name and (well, aliquot_id, sentrix_barcode, sentrix_position) rows."""
+    h = hashlib.sha256(str(plate_name).encode())
+    for row in sorted(tuple("" if v is None else str(v) for v in w) for w in wells):
+        h.update(b"\n" + "\t".join(row).encode())
+    return h.hexdigest()[:32]
+
+
+def combined_digest(digests: Iterable[Tuple[str, Optional[str]]]) -> Optional[str]:
+    """Digest over several plates' ``(plate_id, wells_hash)``; None if any plate has no hash."""
+    h = hashlib.sha256()
+    for plate_id, digest in sorted(digests):
+        if digest is None:
+            return None
+        h.update(f"{plate_id}:{digest}\n".encode())
+    return h.hexdigest()[:32]
+
+
+def etag(digest: Optional[str], sheet_date: date) -> Optional[str]:
+    return f'"{digest}-{sheet_date:%Y%m%d}"' if digest else None
+
+
+def etag_matches(if_none_match: Optional[str], current: Optional[str]) -> bool:
+    if not if_none_match or not current:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == current for c in candidates)
+
+
+async def render(rows: AsyncIterable[Sequence], sheet_date: date) -> AsyncIterator[str]:
+    """Yield the sheet for (sample_id, sentrix_barcode, sentrix_position, plate_name, well) rows."""
+    yield header(sheet_date)
+    block = []
+    async for row in rows:
+        block.append(",".join("" if v is None else str(v) for v in row))
+        if len(block) >= RENDER_BLOCK_ROWS:
+            yield "\n".join(block) + "\n"
+            block = []
+    if block:
+        yield "\n".join(block) + "\n"
+
+
+class SamplesheetCache:
+    """LRU of rendered sheets keyed by (scope key, ETag)."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[Hashable, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, tag: Optional[str]) -> Optional[str]:
+        if tag is None:
+            return None
+        with self._lock:
+            body = self._entries.get((key, tag))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((key, tag))
+            self.hits += 1
+            return body
+
+    def put(self, key: Hashable, tag: Optional[str], body: str):
+        if tag is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            # Older versions of the same sheet can no longer be requested
+            for stale in [k for k in self._entries if k[0] == key]:
+                del self._entries[stale]
+            self._entries[(key, tag)] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def stream(self, key: Hashable, tag: Optional[str], chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass ``chunks`` through, caching the full text once it has been produced."""
+        produced = []
+        async for chunk in chunks:
+            produced.append(chunk)
+            yield chunk
+        self.put(key, tag, "".join(produced))
@@ -0,0 +1,272 @@
+"""Search index over the identifiers bench staff scan or type.
+
+``search_terms`` holds one row per searchable value (kit ID and QR code,
+sample ID and subject pseudo-ID, aliquot ID and label, plate ID and name,
+run ID and name, Sentrix barcodes of plates and runs), normalized to
+upper case. Writers add the terms of the rows they insert, in the same
+transaction:
+
+    search_index.index_rows(db, "kits", [{"id": kit.id, "qr_code": kit.qr_code}])
+
+A query is answered in up to three steps, each only if the previous ones
+found fewer than ``limit`` hits:
+
+1. exact and prefix matches: a range scan of the B-tree on ``term``
+2. substring matches: on SQLite an FTS5 trigram index (``search_trigrams``,
+   an external-content table over ``search_terms`` kept in sync by
+   triggers); a LIKE scan elsewhere
+3. typo-tolerant matches, for queries of ``FUZZY_MIN_LENGTH`` or more: every
+   string one edit away from the query (substitution, insertion, deletion
+   or adjacent transposition, ~900 for an 11-character ID) is looked up as
+   a prefix range of the same B-tree, a few terms per variant. On
+   PostgreSQL, ``pg_trgm`` similarity is used when the extension is
+   available. Trigram candidates are no help here: IDs like
+   ``SAMP-012345`` share most of their trigrams with thousands of others.
+
+Hits are ranked exact > prefix > substring > fuzzy, shorter terms first,
+one hit per entity.
+"""
+import json
+import logging
+import string
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, column, func, insert, literal, select, table, text
+from sqlalchemy.engine import Engine
+
+from database import dialect_name
+
+logger = logging.getLogger("lims.search")
+
+KIT = "kit"
+SAMPLE = "sample"
+ALIQUOT = "aliquot"
+PLATE = "plate"
+RUN = "run"
+ENTITIES = (KIT, SAMPLE, ALIQUOT, PLATE, RUN)
+
+MIN_QUERY_LENGTH = 3  # the trigram index cannot serve shorter queries
+FUZZY_MIN_LENGTH = 5  # shorter queries are one edit away from too many IDs
+FUZZY_PER_VARIANT = 5  # terms fetched per one-edit variant of the query
+FUZZY_CANDIDATES = 200
+ALPHABET = string.ascii_uppercase + string.digits + "-_"
+
+# (table, entity, entity ID column, value column, field name in results)
+SOURCES: List[Tuple[str, str, str, str, str]] = [
+    ("kits", KIT, "id", "id", "id"),
+    ("kits", KIT, "id", "qr_code", "qr_code"),
+    ("samples", SAMPLE, "id", "id", "id"),
+    ("samples", SAMPLE, "id", "subject_pseudoid", "subject_pseudoid"),
+    ("aliquots", ALIQUOT, "id", "id", "id"),
+    ("aliquots", ALIQUOT, "id", "label", "label"),
+    ("plates", PLATE, "id", "id", "id"),
+    ("plates", PLATE, "id", "name", "name"),
+    ("plate_wells", PLATE, "plate_id", "sentrix_barcode", "sentrix_barcode"),
+    ("runs", RUN, "id", "id", "id"),
+    ("runs", RUN, "id", "run_name", "run_name"),
+    ("beadchips", RUN, "run_id", "barcode", "sentrix_barcode"),
+]
+
+metadata = MetaData()
+
+search_terms = Table(
+    "search_terms",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("term", String, nullable=False),  # upper-cased value
+    Column("value", String, nullable=False),
+    Column("entity", String, nullable=False),
+    Column("entity_id", String, nullable=False),
+    Column("field", String, nullable=False),
+    Index("ix_search_terms_term", "term"),
+)
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_trigrams USING fts5("
+    "term, content='search_terms', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS search_terms_ai AFTER INSERT ON search_terms BEGIN "
+    "INSERT INTO search_trigrams (rowid, term) VALUES (new.id, new.term); END",
+    "CREATE TRIGGER IF NOT EXISTS search_terms_ad AFTER DELETE ON search_terms BEGIN "
+    "INSERT INTO search_trigrams (search_trigrams, rowid, term) VALUES ('delete', old.id, old.term); END",
+]
+
+trigrams = table("search_trigrams", column("rowid", Integer))
+
+# Whether pg_trgm is installed (PostgreSQL only); set by create_tables
+_pg_trigrams = False
+
+
+def create_tables(engine: Engine):
+    global _pg_trigrams
+    metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            for statement in SQLITE_FTS:
+                conn.exec_driver_sql(statement)
+    elif engine.dialect.name == "postgresql":
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                conn.exec_driver_sql(
+                    "CREATE INDEX IF NOT EXISTS ix_search_terms_term_trgm ON search_terms USING gin (term gin_trgm_ops)"
+                )
+            _pg_trigrams = True
+        except Exception:
+            logger.warning("pg_trgm is not available; /search falls back to prefix and LIKE matching")
+
+
+def normalize(value: str) -> str:
+    return value.strip().upper()
+
+
+def index_rows(conn, table_name: str, rows: Iterable[Mapping]):
+    """Add the searchable values of ``rows`` (dicts of ``table_name`` columns) to the index."""
+    rows = list(rows)
+    terms = {}
+    for source_table, entity, id_column, value_column, field in SOURCES:
+        if source_table != table_name:
+            continue
+        for row in rows:
+            value, entity_id = row.get(value_column), row.get(id_column)
+            if value and entity_id and normalize(str(value)):
+                terms[(entity, str(entity_id), field, str(value))] = None
+    if terms:
+        conn.execute(insert(search_terms), [
+            {"term": normalize(value), "value": value, "entity": entity, "entity_id": entity_id, "field": field}
+            for entity, entity_id, field, value in terms
+        ])
+
+
+def rebuild(conn):
+    """Re-index every source table with INSERT ... SELECT (new databases, or after manual fixes)."""
+    conn.execute(search_terms.delete())
+    for source_table, entity, id_column, value_column, field in SOURCES:
+        source = table(source_table, column(id_column), column(value_column))
+        value = source.c[value_column]
+        conn.execute(insert(search_terms).from_select(
+            ["term", "value", "entity", "entity_id", "field"],
+            select(
+                func.upper(func.trim(value)), value, literal(entity), source.c[id_column], literal(field)
+            ).where(value.is_not(None), func.trim(value) != "", source.c[id_column].is_not(None)).distinct()
+        ))
+
+
+def edit_distances(query: str, term: str) -> Tuple[int, int]:
+    """Edit distance (with adjacent transpositions) from ``query`` to ``term`` and to its closest prefix."""
+    before, previous = None, list(range(len(term) + 1))
+    for i, q in enumerate(query, 1):
+        current = [i]
+        for j, t in enumerate(term, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (q != t))
+            if before is not None and j > 1 and q == term[j - 2] and query[i - 2] == t:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        before, previous = previous, current
+    return previous[-1], min(previous)
+
+
+def variants(query: str) -> Set[str]:
+    """Every string one substitution, insertion, deletion or adjacent transposition away from ``query``."""
+    found = set()
+    for i in range(len(query) + 1):
+        head, tail = query[:i], query[i:]
+        for ch in ALPHABET:
+            found.add(head + ch + tail)
+            if tail:
+                found.add(head + ch + tail[1:])
+        if tail:
+            found.add(head + tail[1:])
+        if len(tail) > 1:
+            found.add(head + tail[1] + tail[0] + tail[2:])
+    found.discard(query)
+    return found
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _columns(terms=search_terms):
+    return terms.c.term, terms.c.value, terms.c.entity, terms.c.entity_id, terms.c.field
+
+
+def _entity_filter(terms, entities: Optional[Sequence[str]]) -> list:
+    return [terms.c.entity.in_(list(entities))] if entities else []
+
+
+def _prefix_rows(conn, q: str, entities, limit: int):
+    query = select(*_columns()).where(*_entity_filter(search_terms, entities))
+    if dialect_name(conn) == "sqlite":
+        # A range on the B-tree; LIKE with an ESCAPE clause would not use it
+        query = query.where(search_terms.c.term >= q, search_terms.c.term < q + "\uffff")
+    else:
+        query = query.where(search_terms.c.term.startswith(q, autoescape=True))
+    # Index order: the exact match (if any) comes first, then the shortest extensions of it
+    return conn.execute(query.order_by(search_terms.c.term).limit(limit)).all()
+
+
+def _containing_rows(conn, fragment: str, entities, limit: int):
+    query = select(*_columns()).where(*_entity_filter(search_terms, entities)).limit(limit)
+    if dialect_name(conn) == "sqlite":
+        query = query.join(trigrams, trigrams.c.rowid == search_terms.c.id) \
+            .where(text("search_trigrams MATCH :phrase")).params(phrase=_fts_phrase(fragment))
+    else:
+        query = query.where(search_terms.c.term.contains(fragment, autoescape=True))
+    return conn.execute(query).all()
+
+
+def _variant_rows(conn, q: str, entities):
+    """``(variant, *columns)`` for terms equal to or starting with a one-edit variant of ``q``."""
+    found = func.json_each(json.dumps(sorted(variants(q)))).table_valued("value").alias("variants")
+    candidates = search_terms.alias("candidates")
+    per_variant = select(candidates.c.id).where(
+        candidates.c.term >= found.c.value, candidates.c.term < found.c.value + "\uffff",
+        *_entity_filter(candidates, entities),
+    ).order_by(candidates.c.term).limit(FUZZY_PER_VARIANT)
+    query = select(found.c.value, *_columns()).select_from(found) \
+        .join(search_terms, search_terms.c.id.in_(per_variant)).limit(FUZZY_CANDIDATES)
+    return conn.execute(query).all()
+
+
+def _similar_rows(conn, q: str, entities):
+    if not _pg_trigrams:
+        return []
+    query = select(*_columns()).where(search_terms.c.term.op("%")(q), *_entity_filter(search_terms, entities)) \
+        .order_by(func.similarity(search_terms.c.term, q).desc()).limit(FUZZY_CANDIDATES)
+    return conn.execute(query).all()
+
+
+def search(conn, query: str, entities: Optional[Sequence[str]] = None, limit: int = 20) -> List[Dict]:
+    """Ranked hits ``{type, id, field, value, match, distance, score}`` for ``query``."""
+    q = normalize(query)
+    if len(q) < MIN_QUERY_LENGTH:
+        return []
+    best: Dict[Tuple[str, str], Dict] = {}
+
+    def consider(term, value, entity, entity_id, field, match, distance, score):
+        hit = {"type": entity, "id": entity_id, "field": field, "value": value,
+               "match": match, "distance": distance, "score": round(score, 4)}
+        key = (entity, entity_id)
+        if key not in best or score > best[key]["score"]:
+            best[key] = hit
+
+    for row in _prefix_rows(conn, q, entities, limit):
+        term = row[0]
+        if term == q:
+            consider(*row, "exact", 0, 1.0)
+        else:
+            consider(*row, "prefix", 0, 0.7 + 0.2 * len(q) / len(term))
+    if len(best) < limit:
+        for row in _containing_rows(conn, q, entities, limit):
+            consider(*row, "substring", 0, 0.45 + 0.2 * len(q) / len(row[0]))
+    if len(best) < limit and len(q) >= FUZZY_MIN_LENGTH:
+        if dialect_name(conn) == "sqlite":
+            for variant, *row in _variant_rows(conn, q, entities):
+                # Within one edit of the whole term, or only of a prefix of it
+                consider(*row, "fuzzy", 1, 0.4 * (1 - 1 / len(q)) - 0.1 * (row[0] != variant))
+        else:
+            for row in _similar_rows(conn, q, entities):
+                full, prefix = edit_distances(q, row[0])
+                if min(full, prefix) <= 1:
+                    consider(*row, "fuzzy", 1, 0.4 * (1 - 1 / len(q)) - 0.1 * (full > prefix))
+    return sorted(best.values(), key=lambda h: (-h["score"], len(h["value"]), h["value"]))[:limit]
@@ -0,0 +1,37 @@
+"""Point the API at a throwaway SQLite database before ``app`` is imported."""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix="lims-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/lims.db"
+os.environ.setdefault("RESPONSE_CACHE_TTL_S", "0")  # measure the handlers, not cache hits
+os.environ.setdefault("PRS_OUTPUT_DIR", os.path.join(_db_dir, "prs"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def api():
+    import app
+    return app
+
+
+@pytest.fixture(scope="session")
+def call(api):
+    """``call(method, path, **kwargs)``: one request through the ASGI app, in the caller's context.
+
+    Unlike ``TestClient``, which serves requests from a portal thread, this
+    keeps context variables (``query_stats.count_queries`` blocks) visible
+    to the request.
+    """
+    import httpx
+
+    async def send(method, path, **kwargs):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.request(method, path, **kwargs)
+
+    return lambda method, path, **kwargs: asyncio.run(send(method, path, **kwargs))
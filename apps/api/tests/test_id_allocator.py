@@ -0,0 +1,21 @@
+"""A new prefix sequence must start after the IDs already in use."""
+from sqlalchemy import Column, MetaData, String, Table, create_engine, delete, insert
+
+from id_allocator import IdAllocator
+
+
+def test_seed_skips_past_deleted_rows(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/ids.db")
+    dna_qc = Table("dna_qc", MetaData(), Column("id", String, primary_key=True))
+    dna_qc.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(dna_qc), [{"id": f"QC-{n:05d}"} for n in (1, 2, 3)])
+        # Upload deduplication keeps the newest row, leaving one row but QC-00003 in use
+        conn.execute(delete(dna_qc).where(dna_qc.c.id != "QC-00003"))
+
+    ids = IdAllocator(engine, block_size=10)
+    ids.register("QC", 5, dna_qc.c.id)
+    allocated = [ids.next_id("QC"), ids.next_id("QC")]
+    with engine.begin() as conn:
+        conn.execute(insert(dna_qc), [{"id": qc_id} for qc_id in allocated])
+    assert allocated == ["QC-00004", "QC-00005"]
@@ -0,0 +1,70 @@
+"""Read endpoints must run a fixed number of SQL statements, whatever the row count.
+
+Each endpoint is measured after a small data set is seeded, and again
+after a much larger one is added, so the list endpoints read 3 and then
+123 rows; a per-row lazy load or lookup shows up as a difference in the
+count.
+"""
+import pytest
+from sqlalchemy import insert
+
+import query_stats
+
+SMALL, LARGE = 3, 120
+CHIP_SIZE = 24
+
+
+def seed(api, call, tag: str, n: int):
+    """``n`` samples with aliquots on one plate, placed on the BeadChips of one run."""
+    samples = [f"S-{tag}-{i}" for i in range(n)]
+    chips = [f"{tag}{i // CHIP_SIZE:04d}" for i in range(n)]
+    with api.SessionLocal() as db:
+        db.execute(insert(api.SampleModel), [{"id": sid, "kit_qr": f"QR-{sid}", "status": "Plated"} for sid in samples])
+        db.execute(insert(api.ConsentModel), [{"id": f"C-{sid}", "sample_id": sid} for sid in samples[::2]])
+        db.execute(insert(api.AliquotModel), [{"id": f"{sid}-A01", "sample_id": sid, "label": "DNA"} for sid in samples])
+        db.execute(insert(api.PlateModel), [{"id": f"PLT-{tag}", "name": f"Plate {tag}", "plate_format": "384"}])
+        db.execute(insert(api.PlateWellModel), [
+            {"id": f"W-{sid}", "plate_id": f"PLT-{tag}", "aliquot_id": f"{sid}-A01",
+             "well": f"{'ABCDEFGHIJKLMNOP'[i % 16]}{i // 16 + 1}", "sentrix_barcode": chips[i],
+             "sentrix_position": f"R{i % CHIP_SIZE % 12 + 1:02d}C{i % CHIP_SIZE // 12 + 1:02d}"}
+            for i, sid in enumerate(samples)
+        ])
+        db.commit()
+    response = call("POST", "/runs", json={"run_name": f"Run {tag}", "beadchip_barcodes": sorted(set(chips))})
+    assert response.status_code == 200, response.text
+    return {"plate_id": f"PLT-{tag}", "run_id": response.json()["id"]}
+
+
+def statements(call, path: str) -> int:
+    with query_stats.count_queries() as queries:
+        response = call("GET", path)
+    assert response.status_code == 200, response.text
+    return queries.count
+
+
+PATHS = [
+    "/samples?limit=1000",
+    "/aliquots?limit=1000",
+    "/runs?limit=1000",
+    "/plates?limit=1000",
+    "/plates/{plate_id}/samplesheet",
+    "/runs/{run_id}/samplesheet",
+]
+
+
+@pytest.fixture(scope="module")
+def counts(api, call):
+    """Statements per path with only the small set seeded, then with the large set added."""
+    small = seed(api, call, "s", SMALL)
+    before = {path: statements(call, path.format(**small)) for path in PATHS}
+    large = seed(api, call, "l", LARGE)
+    after = {path: statements(call, path.format(**large)) for path in PATHS}
+    return before, after
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_statement_count_does_not_grow_with_rows(counts, path):
+    before, after = counts
+    assert before[path] == after[path], (
+        f"{path}: {before[path]} statements for {SMALL} rows, {after[path]} for {SMALL + LARGE}"
+    )
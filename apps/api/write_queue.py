@@ -0,0 +1,152 @@
+"""In-process single-writer queue with group commit.
+
+SQLite allows one writer at a time, so many small request transactions
+mostly wait on each other's lock and fsync. ``WriteQueue`` hands small
+writes to one writer thread, which drains whatever queued up while the
+previous group was committing (up to ``max_batch``, optionally waiting
+``max_wait`` seconds for more) and commits the whole group in one
+transaction:
+
+    result = writes.submit(lambda db: create_thing(db, payload))
+
+Each write runs in its own SAVEPOINT, so a write that raises (e.g. an
+``HTTPException`` for a missing kit) is rolled back alone and its
+exception re-raised in the caller; the rest of the group still commits.
+Writes must not allocate IDs or open other connections while inside the
+queue, since the writer already holds the database write lock.
+
+Writes run in a copy of the submitting request's context, so per-request
+instrumentation (``query_stats``) still sees their statements.
+
+With ``enabled=False`` (the default off SQLite) ``submit`` runs the write
+in its own session and commits it immediately.
+"""
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger("lims.writes")
+
+Write = Callable[[Session], Any]
+
+
+def _write_and_flush(fn: Write, db: Session) -> Any:
+    # Flush here rather than on savepoint release so the write's INSERTs run
+    # (and are counted) in the submitting request's context
+    result = fn(db)
+    db.flush()
+    return result
+
+
+class WriteQueue:
+    def __init__(self, session_factory: sessionmaker, enabled: bool = True,
+                 max_batch: int = 64, max_wait: float = 0.0):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.commits = 0
+        self.writes = 0
+        self._queue: "queue.Queue[Tuple[Write, Future, contextvars.Context]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def submit(self, fn: Write) -> Any:
+        """Run ``fn(session)`` in the next group commit and return its result."""
+        if not self.enabled:
+            with self.session_factory() as db:
+                result = fn(db)
+                db.commit()
+            return result
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((fn, future, contextvars.copy_context()))
+        return future.result()
+
+    @property
+    def pending(self) -> int:
+        """Writes waiting for the writer thread."""
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="lims-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join(timeout)
+
+    def _next_batch(self) -> List[Tuple[Write, Future, contextvars.Context]]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _run(self):
+        # Keep draining after stop() so no caller is left waiting
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[Write, Future, contextvars.Context]]):
+        outcomes = []
+        db = self.session_factory()
+        try:
+            if db.get_bind().dialect.name == "sqlite":
+                # Take the write lock up front: a deferred transaction that
+                # reads first fails with SQLITE_BUSY (without waiting out the
+                # busy timeout) if another connection commits before it writes
+                db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            for fn, future, context in batch:
+                # The savepoint flushes on exit, so the write only succeeded
+                # once the with-block is left without an error
+                try:
+                    with db.begin_nested():
+                        result = context.run(_write_and_flush, fn, db)
+                except Exception as e:
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+            db.commit()
+        except Exception as e:
+            logger.exception("Group commit of %s writes failed", len(batch))
+            db.rollback()
+            outcomes = [(future, None, e) for _, future, _ in batch]
+        finally:
+            db.close()
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -98,10 +98,10 @@ export default function Page() {
 
   const fetchSamples = async () => {
     try {
-      const response = await fetch(`${API_URL}/samples`)
+      const response = await fetch(`${API_URL}/samples?limit=1000`)
       if (response.ok) {
         const data = await response.json()
-        setSamples(data)
+        setSamples(data.items)
       }
     } catch (error) {
       console.error('Error fetching samples:', error)
@@ -110,10 +110,10 @@ export default function Page() {
 
   const fetchKits = async () => {
     try {
-      const response = await fetch(`${API_URL}/kits`)
+      const response = await fetch(`${API_URL}/kits?limit=1000`)
       if (response.ok) {
         const data = await response.json()
-        setKits(data)
+        setKits(data.items)
       }
     } catch (error) {
       console.error('Error fetching kits:', error)
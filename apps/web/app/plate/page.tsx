@@ -42,9 +42,9 @@ export default function Page() {
 
   const fetchAliquots = async () => {
     try {
-      const response = await fetch(`${API_URL}/aliquots`)
+      const response = await fetch(`${API_URL}/aliquots?qc_flag=Pass,Warn&limit=1000`)
       const data = await response.json()
-      setAliquots(data.filter((a: Aliquot) => a.qc_flag === 'Pass' || a.qc_flag === 'Warn'))
+      setAliquots(data.items)
     } catch (error) {
       console.error('Error fetching aliquots:', error)
     }
@@ -52,9 +52,9 @@ export default function Page() {
 
   const fetchPlates = async () => {
     try {
-      const response = await fetch(`${API_URL}/plates`)
+      const response = await fetch(`${API_URL}/plates?limit=1000`)
       const data = await response.json()
-      setPlates(data)
+      setPlates(data.items)
     } catch (error) {
       console.error('Error fetching plates:', error)
     }
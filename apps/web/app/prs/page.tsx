@@ -30,11 +30,11 @@ export default function Page() {
 
   const fetchRuns = async () => {
     try {
-      const response = await fetch(`${API_URL}/runs`)
+      const response = await fetch(`${API_URL}/runs?status=Completed&limit=1000`)
       if (response.ok) {
         const data = await response.json()
         // Only show completed runs for PRS generation
-        setRuns(data.filter((r: Run) => r.status === 'Completed'))
+        setRuns(data.items)
       }
     } catch (error) {
       console.error('Error fetching runs:', error)
@@ -43,10 +43,10 @@ export default function Page() {
 
   const fetchPrsJobs = async () => {
     try {
-      const response = await fetch(`${API_URL}/prs_jobs`)
+      const response = await fetch(`${API_URL}/prs_jobs?limit=1000`)
       if (response.ok) {
         const data = await response.json()
-        setPrsJobs(data)
+        setPrsJobs(data.items)
       }
     } catch (error) {
       console.error('Error fetching PRS jobs:', error)
@@ -78,7 +78,7 @@ export default function Page() {
       }
       
       const job = await response.json()
-      addToast({ message: `PRS package ${job.id} created successfully`, type: 'success' })
+      addToast({ message: `PRS package ${job.id} queued`, type: 'success' })
       setSelectedRun('')
       setJobName('')
       fetchPrsJobs()
@@ -107,8 +107,17 @@ export default function Page() {
     fetchPrsJobs()
   }, [])
 
+  // Refresh when a job changes status (the workers publish to /events); a
+  // reset means events were missed while disconnected
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/events?topic=prs_job`)
+    source.addEventListener('prs_job.status', fetchPrsJobs)
+    source.addEventListener('reset', fetchPrsJobs)
+    return () => source.close()
+  }, [])
+
   const completedRuns = runs.filter(r => r.status === 'Completed')
-  const processingJobs = prsJobs.filter(j => j.status === 'Processing').length
+  const processingJobs = prsJobs.filter(j => j.status === 'Queued' || j.status === 'Processing').length
   const completedJobs = prsJobs.filter(j => j.status === 'Completed').length
 
   return (
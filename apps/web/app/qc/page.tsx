@@ -25,6 +25,11 @@ interface Aliquot {
   }
 }
 
+interface QCStats {
+  samples: { total: number; by_status: Record<string, number> }
+  aliquots: { total: number; by_qc_flag: Record<string, number> }
+}
+
 interface QCData {
   [aliquotId: string]: {
     concentration: string
@@ -37,6 +42,7 @@ export default function Page() {
   const [samples, setSamples] = useState<Sample[]>([])
   const [selectedSamples, setSelectedSamples] = useState<string[]>([])
   const [aliquots, setAliquots] = useState<Aliquot[]>([])
+  const [stats, setStats] = useState<QCStats | null>(null)
   const [qcData, setQcData] = useState<QCData>({})
   const [loading, setLoading] = useState(false)
   const [consentFiles, setConsentFiles] = useState<File[]>([])
@@ -45,12 +51,24 @@ export default function Page() {
 
   const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
+  const fetchStats = async () => {
+    try {
+      const response = await fetch(`${API_URL}/stats`)
+      if (response.ok) {
+        setStats(await response.json())
+      }
+    } catch (error) {
+      console.error('Error fetching stats:', error)
+    }
+  }
+
+  // Only the samples the extraction table lists; counts come from /stats
   const fetchSamples = async () => {
     try {
-      const response = await fetch(`${API_URL}/samples`)
+      const response = await fetch(`${API_URL}/samples?status=Received,Accessioned&limit=1000`)
       if (response.ok) {
         const data = await response.json()
-        setSamples(data)
+        setSamples(data.items)
       }
     } catch (error) {
       console.error('Error fetching samples:', error)
@@ -59,10 +77,10 @@ export default function Page() {
 
   const fetchAliquots = async () => {
     try {
-      const response = await fetch(`${API_URL}/aliquots`)
+      const response = await fetch(`${API_URL}/aliquots?limit=1000`)
       if (response.ok) {
         const data = await response.json()
-        setAliquots(data)
+        setAliquots(data.items)
       }
     } catch (error) {
       console.error('Error fetching aliquots:', error)
@@ -94,6 +112,7 @@ export default function Page() {
       setSelectedSamples([])
       fetchSamples()
       fetchAliquots()
+      fetchStats()
     } catch (error: any) {
       addToast({ message: error.message || 'Error creating extraction', type: 'error' })
     } finally {
@@ -176,6 +195,7 @@ export default function Page() {
       setQcData({})
       fetchAliquots()
       fetchSamples()
+      fetchStats()
     } catch (error: any) {
       addToast({ message: error.message || 'Error submitting QC', type: 'error' })
     } finally {
@@ -284,12 +304,14 @@ export default function Page() {
   }
 
   useEffect(() => {
+    fetchStats()
     fetchSamples()
     fetchAliquots()
   }, [])
 
-  const extractableCount = samples.filter(s => s.status === 'Received' || s.status === 'Accessioned').length
-  const aliquotsWithoutQC = aliquots.filter(a => !a.qc).length
+  const extractableSamples = samples.filter(s => s.status === 'Received' || s.status === 'Accessioned')
+  const extractableCount = (stats?.samples.by_status['Received'] ?? 0) + (stats?.samples.by_status['Accessioned'] ?? 0)
+  const aliquotCounts = stats?.aliquots.by_qc_flag ?? {}
 
   return (
     <div className="space-y-6">
@@ -325,7 +347,7 @@ export default function Page() {
           </CardDescription>
         </CardHeader>
         <CardContent>
-          {extractableCount === 0 ? (
+          {extractableSamples.length === 0 ? (
             <div className="text-center py-8 text-gray-500 dark:text-gray-400">
               <svg className="w-12 h-12 mx-auto mb-4 opacity-50" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                 <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M20 13V6a2 2 0 00-2-2H6a2 2 0 00-2 2v7m16 0v5a2 2 0 01-2 2H6a2 2 0 01-2-2v-5m16 0h-2.586a1 1 0 00-.707.293l-2.414 2.414a1 1 0 01-.707.293h-3.172a1 1 0 01-.707-.293l-2.414-2.414A1 1 0 006.586 13H4" />
@@ -342,15 +364,12 @@ export default function Page() {
                       <TableHead className="w-12">
                         <input 
                           type="checkbox"
-                          checked={selectedSamples.length === extractableCount && extractableCount > 0}
+                          checked={selectedSamples.length === extractableSamples.length && extractableSamples.length > 0}
                           onChange={() => {
-                            if (selectedSamples.length === extractableCount) {
+                            if (selectedSamples.length === extractableSamples.length) {
                               setSelectedSamples([])
                             } else {
-                              setSelectedSamples(samples
-                                .filter(s => s.status === 'Received' || s.status === 'Accessioned')
-                                .map(s => s.id.toString())
-                              )
+                              setSelectedSamples(extractableSamples.map(s => s.id.toString()))
                             }
                           }}
                         />
@@ -362,8 +381,7 @@ export default function Page() {
                     </TableRow>
                   </TableHeader>
                   <TableBody>
-                    {samples
-                      .filter(s => s.status === 'Received' || s.status === 'Accessioned')
+                    {extractableSamples
                       .map(sample => (
                         <TableRow key={sample.id}>
                           <TableCell>
@@ -596,7 +614,7 @@ export default function Page() {
       </Card>
 
       {/* QC Summary */}
-      {aliquots.length > 0 && (
+      {(stats?.aliquots.total ?? 0) > 0 && (
         <Card>
           <CardHeader>
             <CardTitle>QC Summary</CardTitle>
@@ -606,25 +624,25 @@ export default function Page() {
             <div className="grid grid-cols-2 md:grid-cols-4 gap-4">
               <div className="text-center">
                 <div className="text-2xl font-bold text-gray-900 dark:text-white">
-                  {aliquots.length}
+                  {stats?.aliquots.total ?? 0}
                 </div>
                 <p className="text-sm text-gray-600 dark:text-gray-400">Total Aliquots</p>
               </div>
               <div className="text-center">
                 <div className="text-2xl font-bold text-green-600 dark:text-green-400">
-                  {aliquots.filter(a => a.qc_flag === 'Pass').length}
+                  {aliquotCounts['Pass'] ?? 0}
                 </div>
                 <p className="text-sm text-gray-600 dark:text-gray-400">Passed QC</p>
               </div>
               <div className="text-center">
                 <div className="text-2xl font-bold text-red-600 dark:text-red-400">
-                  {aliquots.filter(a => a.qc_flag === 'Fail').length}
+                  {aliquotCounts['Fail'] ?? 0}
                 </div>
                 <p className="text-sm text-gray-600 dark:text-gray-400">Failed QC</p>
               </div>
               <div className="text-center">
                 <div className="text-2xl font-bold text-amber-600 dark:text-amber-400">
-                  {aliquotsWithoutQC}
+                  {aliquotCounts['Pending'] ?? 0}
                 </div>
                 <p className="text-sm text-gray-600 dark:text-gray-400">Pending QC</p>
               </div>
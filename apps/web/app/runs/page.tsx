@@ -37,6 +37,7 @@ export default function Page() {
   const [runName, setRunName] = useState('')
   const [beadchips, setBeadchips] = useState([''])
   const [runs, setRuns] = useState<Run[]>([])
+  const [runCount, setRunCount] = useState(0)
   const [selectedRun, setSelectedRun] = useState('')
   const [metricsJson, setMetricsJson] = useState('')
   const [loading, setLoading] = useState(false)
@@ -48,12 +49,17 @@ export default function Page() {
 
   const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
+  // One page of runs for the picker and table; the total comes from /stats
   const fetchRuns = async () => {
     try {
-      const response = await fetch(`${API_URL}/runs`)
+      const [response, stats] = await Promise.all([fetch(`${API_URL}/runs`), fetch(`${API_URL}/stats`)])
       if (response.ok) {
         const data = await response.json()
-        setRuns(data)
+        setRuns(data.items)
+      }
+      if (stats.ok) {
+        const data = await stats.json()
+        setRunCount(data.runs.total)
       }
     } catch (error) {
       console.error('Error fetching runs:', error)
@@ -301,7 +307,7 @@ export default function Page() {
         </div>
         <div className="flex gap-2">
           <Badge variant="outline">
-            {runs.length} total runs
+            {runCount} total runs
           </Badge>
         </div>
       </div>